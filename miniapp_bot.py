@@ -1,28 +1,29 @@
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import Application, CommandHandler, ContextTypes
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "telegram-bot-files"))
 
-MINI_APP_URL = os.getenv("MINI_APP_URL", "https://savos-club-two.vercel.app/mini-app")
-# Токен бота захардкожен по запросу пользователя
-BOT_TOKEN = "8498015879:AAEemLqn9Hv9NWC_hcqvx4goKlVwNCFsT_c"
+from dotenv import load_dotenv
 
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [[InlineKeyboardButton("📱 Открыть мини‑приложение", web_app=WebAppInfo(url=MINI_APP_URL))]]
-    await update.message.reply_text(
-        "👋 Добро пожаловать в SavosBot Club!\n\nНажмите кнопку ниже, чтобы открыть мини‑приложение.",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-    )
+from miniapp import MiniAppBot
 
 
 def main():
-    token = BOT_TOKEN or os.getenv("TELEGRAM_BOT_TOKEN")
+    # Токен только из окружения (.env); вместе с основным ботом - runtime.py
+    load_dotenv()
+    token = os.getenv("MINIAPP_BOT_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
-        raise SystemExit("Set BOT_TOKEN or TELEGRAM_BOT_TOKEN env var with your Telegram bot token")
+        raise SystemExit("Set MINIAPP_BOT_TOKEN or TELEGRAM_BOT_TOKEN env var with your Telegram bot token")
+
+    app = MiniAppBot(token).application
+
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        # Встроенный webhook-сервер из telegram-bot-files/webhook.py
+        import asyncio
+        from webhook import serve_webhook, webhook_settings_from_env
 
-    app = Application.builder().token(token).build()
-    app.add_handler(CommandHandler("start", start))
+        asyncio.run(serve_webhook(app, **webhook_settings_from_env()))
+        return
 
     # На всякий случай снимем возможный webhook перед запуском polling
     app.run_polling(drop_pending_updates=True)
@@ -30,5 +31,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
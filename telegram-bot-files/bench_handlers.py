@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - бенчмарк обработчиков бота
+
+Прогоняет обработчики SavosBotWorking (start, handle_contact, handle_text,
+stats) на синтетических обновлениях через FakeBotRequest - без сети и без
+сайта. Для каждого движка хранения (DB_STORAGE) и размера базы создаётся
+заполненная база, и каждый прогон идёт в отдельном процессе, чтобы пик
+памяти (RSS) относился только к нему.
+
+Результат - JSON (p50/p99 задержки, пропускная способность, пик RSS), который
+удобно сравнивать между версиями:
+    python3 bench_handlers.py --users 1000,100000 --output bench.json
+    python3 bench_handlers.py --backends sqlite --users 1000000 --iterations 500
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import logging
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+BACKENDS = ('json', 'journal', 'sqlite')
+
+
+def synthetic_user(user_id: int, registered: bool, now: datetime) -> Dict[str, Any]:
+    """Запись пользователя в формате бота"""
+    from fake_telegram import synthetic_phone
+
+    user = {
+        'id': user_id,
+        'username': f'user{user_id}',
+        'first_name': f'User{user_id}',
+        'last_name': None,
+        'joined_at': (now - timedelta(minutes=user_id % 525600)).isoformat(),
+        'is_active': True,
+        'profile_link': f'https://t.me/user{user_id}',
+        'photo_url': f'photos/photo-{user_id}.jpg',
+        'phone': None
+    }
+    if registered:
+        user['phone'] = synthetic_phone(user_id)
+        user['internal_id'] = user_id
+    return user
+
+
+def populate(data_dir: str, backend: str, users: int, registered_share: float = 0.8):
+    """Заполнение базы синтетическими пользователями (id 1..users)"""
+    os.makedirs(data_dir, exist_ok=True)
+    now = datetime.now()
+    registered_until = int(users * registered_share)
+
+    if backend == 'sqlite':
+        from database import SqliteStorage
+
+        storage = SqliteStorage(data_dir)
+        storage.open()
+        chunk = []
+        for user_id in range(1, users + 1):
+            chunk.append(synthetic_user(user_id, user_id <= registered_until, now))
+            if len(chunk) == 10000:
+                storage.upsert_many(chunk)
+                chunk = []
+        if chunk:
+            storage.upsert_many(chunk)
+        storage.close()
+        return
+
+    # json и journal читают снимок users.json; пишем его потоково
+    with open(os.path.join(data_dir, 'users.json'), 'w') as f:
+        f.write('[')
+        for user_id in range(1, users + 1):
+            if user_id > 1:
+                f.write(',')
+            f.write(json.dumps(synthetic_user(user_id, user_id <= registered_until, now)))
+        f.write(']')
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    """Пик RSS процесса (ru_maxrss - КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+async def run_worker(backend: str, users: int, iterations: int, time_limit: float,
+                     work_dir: str, latency: float) -> Dict[str, Any]:
+    """Один прогон всех сценариев для движка и размера базы"""
+    from telegram import Update
+    from fake_telegram import FakeBotRequest, SyntheticUpdates
+
+    data_dir = os.path.join(work_dir, 'data')
+    started = time.perf_counter()
+    populate(data_dir, backend, users)
+    populate_seconds = time.perf_counter() - started
+
+    os.environ['DB_STORAGE'] = backend
+    os.environ.setdefault('BOT_TOKEN', '123456:bench')
+    # Сайт не используется: пул соединений не открывается (post_init не вызывается)
+    os.environ.setdefault('WEBSITE_URL', 'http://127.0.0.1:9')
+
+    from bot_working import SavosBotWorking
+
+    started = time.perf_counter()
+    bot_request = FakeBotRequest(latency=latency)
+    bot = SavosBotWorking(data_dir=data_dir, request=bot_request)
+    load_seconds = time.perf_counter() - started
+    application = bot.application
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+
+    application.add_error_handler(on_error)
+    await application.initialize()
+
+    generator = SyntheticUpdates()
+    rng = random.Random(42)
+    next_id = users + 1
+    results = []
+
+    async def measure(name: str, make_updates):
+        """Последовательный прогон обновлений с замером каждого"""
+        latencies = []
+        error_count = len(errors)
+        scenario_started = time.perf_counter()
+        for raw in make_updates():
+            update = Update.de_json(raw, application.bot)
+            t0 = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - t0)
+            if time.perf_counter() - scenario_started >= time_limit:
+                break
+        elapsed = time.perf_counter() - scenario_started
+        # Фоновые задачи (фото профиля) не входят в замер, но дожидаемся их
+        await asyncio.gather(*list(bot._background_tasks), return_exceptions=True)
+        results.append({
+            'backend': backend,
+            'users': users,
+            'handler': name,
+            'count': len(latencies),
+            'errors': len(errors) - error_count,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'max_ms': round(max(latencies, default=0) * 1000, 3),
+            'throughput_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'peak_rss_mb': peak_rss_mb()
+        })
+
+    # Новые пользователи: /start, затем контакт
+    new_ids = list(range(next_id, next_id + iterations))
+    next_id += iterations
+    await measure('start_new', lambda: (generator.command(uid, '/start') for uid in new_ids))
+    registered = new_ids[:results[-1]['count']]
+    await measure('contact', lambda: (generator.contact(uid) for uid in registered))
+
+    # Повторный /start существующих
+    await measure('start_existing', lambda: (
+        generator.command(rng.randint(1, users), '/start') for _ in range(iterations)
+    ))
+
+    # Телефон текстом: пользователи заранее проходят /start (вне замера)
+    text_ids = list(range(next_id, next_id + iterations))
+    next_id += iterations
+    for uid in text_ids:
+        await application.process_update(Update.de_json(generator.command(uid, '/start'), application.bot))
+    await asyncio.gather(*list(bot._background_tasks), return_exceptions=True)
+    await measure('text_phone', lambda: (generator.text(uid, f'+7 999 {uid:07d}') for uid in text_ids))
+
+    await measure('stats', lambda: (
+        generator.command(rng.randint(1, users), '/stats') for _ in range(iterations)
+    ))
+
+    await application.shutdown()
+    bot.db.close()
+
+    for result in results:
+        result['populate_s'] = round(populate_seconds, 2)
+        result['load_s'] = round(load_seconds, 2)
+    return {'results': results, 'errors': errors[:10], 'bot_api_calls': dict(bot_request.calls)}
+
+
+def worker_main(args):
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='savos-bench-')
+    try:
+        report = asyncio.run(run_worker(
+            args.backend, args.worker_users, args.iterations, args.time_limit, work_dir, args.latency
+        ))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(report, ensure_ascii=False))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк обработчиков SavosBot')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='Движки хранения через запятую')
+    parser.add_argument('--users', default='1000,100000,1000000', help='Размеры базы через запятую')
+    parser.add_argument('--iterations', type=int, default=200, help='Обновлений на сценарий')
+    parser.add_argument('--time-limit', type=float, default=60, help='Предел времени на сценарий, с')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа Bot API, с')
+    parser.add_argument('--output', help='Файл для JSON-результата (по умолчанию stdout)')
+    parser.add_argument('--work-dir', help='Каталог для баз (по умолчанию временный)')
+    parser.add_argument('--keep', action='store_true', help='Не удалять созданные базы')
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-users', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker_main(args)
+        return
+
+    backends = [b for b in args.backends.split(',') if b]
+    sizes = [int(n) for n in args.users.split(',') if n]
+    report = {
+        'benchmark': 'handlers',
+        'revision': git_revision(),
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'iterations': args.iterations,
+        'latency_s': args.latency,
+        'results': [],
+        'failures': []
+    }
+
+    for backend in backends:
+        for users in sizes:
+            print(f"⏱️ {backend}, {users} пользователей...", file=sys.stderr)
+            command = [
+                sys.executable, os.path.abspath(__file__), '--worker',
+                '--backend', backend, '--worker-users', str(users),
+                '--iterations', str(args.iterations), '--time-limit', str(args.time_limit),
+                '--latency', str(args.latency), '--log-level', args.log_level
+            ]
+            if args.keep:
+                command.append('--keep')
+            if args.work_dir:
+                command += ['--work-dir', os.path.join(args.work_dir, f'{backend}-{users}')]
+            proc = subprocess.run(command, capture_output=True, text=True)
+            if proc.returncode != 0:
+                report['failures'].append({
+                    'backend': backend, 'users': users, 'stderr': proc.stderr[-2000:]
+                })
+                print(f"❌ {backend}/{users}: код {proc.returncode}", file=sys.stderr)
+                continue
+            worker_report = json.loads(proc.stdout.strip().splitlines()[-1])
+            report['results'].extend(worker_report['results'])
+            for result in worker_report['results']:
+                print(
+                    f"   {result['handler']:<15} p50 {result['p50_ms']:>9.3f} мс  "
+                    f"p99 {result['p99_ms']:>9.3f} мс  {result['throughput_per_s']:>8.1f}/с  "
+                    f"RSS {result['peak_rss_mb']} МБ",
+                    file=sys.stderr
+                )
+            if worker_report['errors']:
+                print(f"⚠️ Ошибки обработчиков: {worker_report['errors']}", file=sys.stderr)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"💾 Результаты: {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,278 +6,332 @@ SavosBot Club - ФИНАЛЬНАЯ рабочая версия для Python 3.1
 """
 
 import os
-import json
+import time
+import asyncio
 import logging
-import aiohttp
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Optional, Tuple
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
+from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
+from telegram.error import TelegramError
 from dotenv import load_dotenv
 
+from database import DatabaseManager
+from website import WebsiteConnection, OutboxWorker, BulkSyncer, CircuitBreaker, HealthMonitor, SyncReport
+from sync_job import SyncJob
+from broadcast import Broadcaster
+from webhook import serve_webhook, webhook_settings_from_env
+from photos import ProfilePhotoResolver
+from update_processor import PerUserUpdateProcessor
+from metrics import REGISTRY, UPDATE_LAG_SECONDS, timed_handler, summary as metrics_summary, metrics_server_from_env
+from logging_setup import setup_logging, hot
+from shards import ensure_unsharded, merge_statistics, read_shard_statistics, shard_dir
+
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования (LOG_MODE, LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE - см. logging_setup.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-class DatabaseManager:
-    """Простой менеджер базы данных"""
-    
-    def __init__(self):
-        self.data_dir = 'data'
-        self.users_file = os.path.join(self.data_dir, 'users.json')
-        self.stats_file = os.path.join(self.data_dir, 'statistics.json')
-    
-    def initialize(self):
-        """Инициализация базы данных"""
-        os.makedirs(self.data_dir, exist_ok=True)
-        
-        if not os.path.exists(self.users_file):
-            with open(self.users_file, 'w') as f:
-                json.dump([], f)
-        
-        if not os.path.exists(self.stats_file):
-            with open(self.stats_file, 'w') as f:
-                json.dump({
-                    'total_users': 0,
-                    'active_users': 0,
-                    'today_users': 0,
-                    'last_update': datetime.now().isoformat()
-                }, f)
-    
-    def save_user(self, user_data: Dict[str, Any]):
-        """Сохранение пользователя"""
-        try:
-            with open(self.users_file, 'r') as f:
-                users = json.load(f)
-            
-            # Проверка существования
-            user_exists = any(u['id'] == user_data['id'] for u in users)
-            
-            if not user_exists:
-                users.append(user_data)
-                
-                with open(self.users_file, 'w') as f:
-                    json.dump(users, f, indent=2)
-                
-                logger.info(f"✅ Пользователь {user_data['id']} сохранён")
-            else:
-                # Обновляем существующего пользователя
-                for i, u in enumerate(users):
-                    if u['id'] == user_data['id']:
-                        users[i] = {**u, **user_data}
-                        break
-                
-                with open(self.users_file, 'w') as f:
-                    json.dump(users, f, indent=2)
-                
-                logger.info(f"✅ Пользователь {user_data['id']} обновлён")
-            
-            # Обновление статистики
-            self.update_stats()
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения: {e}")
-    
-    def update_stats(self):
-        """Обновление статистики"""
-        try:
-            with open(self.users_file, 'r') as f:
-                users = json.load(f)
-            
-            today = datetime.now().date().isoformat()
-            active = [u for u in users if u.get('is_active', False)]
-            today_users = [u for u in users if u.get('joined_at', '').startswith(today)]
-            
-            stats = {
-                'total_users': len(users),
-                'active_users': len(active),
-                'today_users': len(today_users),
-                'last_update': datetime.now().isoformat()
-            }
-            
-            with open(self.stats_file, 'w') as f:
-                json.dump(stats, f, indent=2)
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка статистики: {e}")
+_direct_connection_forced = False
+
+
+def force_direct_connection():
+    """Отключение прокси и IPv6 для клиента Telegram (один раз на процесс)
+
+    Вызывается до создания пулов соединений: httpx читает переменные
+    прокси при создании клиента.
+    """
+    global _direct_connection_forced
+    if _direct_connection_forced:
+        return
+    _direct_connection_forced = True
     
-    def get_statistics(self) -> Dict[str, Any]:
-        """Получение статистики"""
-        try:
-            with open(self.stats_file, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"❌ Ошибка чтения статистики: {e}")
-            return {
-                'total_users': 0,
-                'active_users': 0,
-                'today_users': 0
-            }
+    # Жестко отключаем прокси через переменные окружения для клиента Telegram
+    for var in [
+        'HTTP_PROXY','http_proxy','HTTPS_PROXY','https_proxy',
+        'ALL_PROXY','all_proxy'
+    ]:
+        if os.environ.get(var):
+            os.environ.pop(var, None)
+    os.environ['NO_PROXY'] = '*'
+    # Форсируем IPv4, чтобы обойти проблемы с IPv6 маршрутами
+    try:
+        import socket as _socket
+        _orig_getaddrinfo = _socket.getaddrinfo
+        def _ipv4_only_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+            return _orig_getaddrinfo(host, port, _socket.AF_INET, type, proto, flags)
+        _socket.getaddrinfo = _ipv4_only_getaddrinfo
+        logger.info("🌐 IPv4 enforced for outgoing connections")
+    except Exception as _e:
+        logger.warning(f"⚠️ IPv4 enforce failed: {_e}")
 
-class WebsiteConnection:
-    """Подключение к сайту"""
+class StartupTimer:
+    """Замер этапов запуска (до первого полученного обновления)"""
     
-    def __init__(self, website_url: str, api_key: str):
-        self.website_url = website_url.rstrip('/')
-        self.api_key = api_key
-        self.timeout = aiohttp.ClientTimeout(total=10)
-        self.connected = False
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = []
     
-    def check_connection(self) -> Dict[str, Any]:
-        """Проверка подключения (синхронная)"""
-        try:
-            try:
-                import requests
-                
-                # Отключаем прокси для проверки
-                session = requests.Session()
-                session.trust_env = False
-                session.proxies = {
-                    'http': None,
-                    'https': None,
-                    'no_proxy': '*'
-                }
-                
-                response = session.get(f"{self.website_url}/api/health", timeout=5)
-                if response.status_code == 200:
-                    self.connected = True
-                    return response.json()
-                else:
-                    self.connected = False
-                    return {'status': 'error', 'message': f'HTTP {response.status_code}'}
-            except ImportError:
-                logger.warning("⚠️ Библиотека requests не установлена")
-                self.connected = False
-                return {'status': 'error', 'message': 'requests not installed'}
-        except Exception as e:
-            self.connected = False
-            return {'status': 'error', 'message': str(e)}
+    def mark(self, stage: str, since: float = None):
+        """Отметка этапа: длительность от since (или от начала)"""
+        now = time.monotonic()
+        duration = now - (since if since is not None else self.started)
+        self.stages.append((stage, duration, now - self.started))
+        logger.info(f"⏱️ {stage}: {duration:.2f} с (с начала запуска {now - self.started:.2f} с)")
     
-    def send_user(self, user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Отправка пользователя на сайт"""
-        try:
-            import requests
-            import ssl
-            import os
-            
-            # Логируем текущие настройки прокси
-            logger.info(f"🔍 Текущие переменные прокси: HTTP_PROXY={os.environ.get('HTTP_PROXY', 'НЕТ')}")
-            
-            # Создаем session с отключенным прокси
-            session = requests.Session()
-            
-            # Отключаем прокси полностью
-            session.trust_env = False
-            session.proxies = {
-                'http': None,
-                'https': None,
-                'no_proxy': '*'
-            }
-            
-            # Отключаем SSL проверку для прокси (если нужно)
-            session.verify = True
-            
-            logger.info(f"📤 Отправка пользователя {user_data.get('id')} на {self.website_url}/api/users")
-            
-            response = session.post(
-                f"{self.website_url}/api/users",
-                json={
-                    **user_data,
-                    'source': 'telegram_bot'
-                },
-                headers={
-                    'Authorization': f'Bearer {self.api_key}',
-                    'Content-Type': 'application/json'
-                },
-                timeout=10
-            )
-            
-            logger.info(f"📥 Ответ сайта: {response.status_code}")
-            if response.status_code == 200:
-                logger.info(f"✅ Пользователь {user_data['id']} отправлен на сайт")
-                return response.json()
-            else:
-                logger.warning(f"⚠️ Ошибка отправки: {response.status_code}")
-                return None
-        except Exception as e:
-            logger.warning(f"⚠️ Ошибка подключения к сайту: {e}")
-            # Сохраняем пользователя для повторной попытки при следующем запуске
-            # Автоматическая синхронизация при запуске обработает это
-            return None
+    def summary(self) -> str:
+        return ', '.join(f"{stage}={at:.2f}с" for stage, _, at in self.stages)
 
 class SavosBotWorking:
     """Рабочая версия бота БЕЗ asyncio проблем С ПОДКЛЮЧЕНИЕМ К САЙТУ"""
     
-    def __init__(self):
-        self.bot_token = os.getenv('BOT_TOKEN')
+    def __init__(self, data_dir: str = 'data', request=None, *, name: str = 'main',
+                 token: Optional[str] = None, db: Optional[DatabaseManager] = None,
+                 get_updates_request=None, serve_metrics: bool = True,
+                 shard: Optional[Tuple[int, int]] = None):
+        """data_dir - каталог данных; request - свой BaseRequest для Bot API (бенчмарки)
+        
+        Для нескольких ботов в одном процессе (runtime.py): name - метка bot
+        в метриках, token вместо BOT_TOKEN, db - общая база (открывает и
+        закрывает её вызывающий), get_updates_request - общий пул для
+        getUpdates, serve_metrics=False - сервер метрик один на процесс.
+        
+        Воркер dispatcher.py: shard - (номер, количество), база - в
+        data_dir/shard-<номер>, /stats показывает сводку по всем шардам.
+        """
+        self.name = name
+        self.data_dir = data_dir
+        self.shard = shard
+        self.shard_label = f"🧩 Шард {shard[0] + 1} из {shard[1]}" if shard else ''
+        self.timer = StartupTimer()
+        self._first_update_seen = False
+        self._background_tasks = set()
+        self._startup_synced = False
+        self._resync_pending = False
+        self.sync_job: Optional[SyncJob] = None
+        self.sync_progress_interval = float(os.getenv('SYNC_PROGRESS_INTERVAL', '3'))
+        
+        # Администраторы (Telegram ID через запятую) - доступ к /metrics
+        self.admin_ids = {
+            int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if admin_id
+        }
+        self.metrics_server = metrics_server_from_env() if serve_metrics else None
+        
+        self.bot_token = token or os.getenv('BOT_TOKEN')
         if not self.bot_token:
             raise ValueError("❌ BOT_TOKEN не найден! Создайте файл .env")
         
+        # Режим получения обновлений: polling (по умолчанию) или webhook
+        self.mode = os.getenv('BOT_MODE', 'polling')
+        
         self.website_url = os.getenv('WEBSITE_URL', 'https://savos-club-two.vercel.app')
         self.api_key = os.getenv('API_KEY', 'savosbot2024')
         
-        self.db = DatabaseManager()
-        self.db.initialize()  # Синхронная инициализация
-        
-        # Проверка подключения к сайту
-        self.website = WebsiteConnection(self.website_url, self.api_key)
-        connection_result = self.website.check_connection()
-        logger.info(f"🌐 Статус сайта: {connection_result.get('status')}")
-        
-        # Жестко отключаем прокси через переменные окружения для клиента Telegram
-        for var in [
-            'HTTP_PROXY','http_proxy','HTTPS_PROXY','https_proxy',
-            'ALL_PROXY','all_proxy'
-        ]:
-            if os.environ.get(var):
-                os.environ.pop(var, None)
-        os.environ['NO_PROXY'] = '*'
-        # Форсируем IPv4, чтобы обойти проблемы с IPv6 маршрутами
-        try:
-            import socket as _socket
-            _orig_getaddrinfo = _socket.getaddrinfo
-            def _ipv4_only_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
-                return _orig_getaddrinfo(host, port, _socket.AF_INET, type, proto, flags)
-            _socket.getaddrinfo = _ipv4_only_getaddrinfo
-            logger.info("🌐 IPv4 enforced for outgoing connections")
-        except Exception as _e:
-            logger.warning(f"⚠️ IPv4 enforce failed: {_e}")
+        if db is None:
+            if shard:
+                db = DatabaseManager(shard_dir(data_dir, shard[0]), id_shard=shard)
+            else:
+                ensure_unsharded(data_dir)
+                db = DatabaseManager(data_dir)
+            db.initialize()  # Синхронная инициализация
+            self.timer.mark("загрузка базы")
+        self.db = db
+        
+        # Подключение к сайту (пул соединений открывается в post_init)
+        self.website = WebsiteConnection(
+            self.website_url,
+            self.api_key,
+            pool_size=int(os.getenv('WEBSITE_POOL_SIZE', '20')),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv('WEBSITE_BREAKER_FAILURES', '5')),
+                reset_timeout=float(os.getenv('WEBSITE_BREAKER_RESET', '30'))
+            )
+        )
+        # Периодическая проверка сайта; восстановление запускает досылку
+        self.health = HealthMonitor(self.website, interval=float(os.getenv('WEBSITE_HEALTH_INTERVAL', '30')))
+        self.website.breaker.on_change(self._on_website_state)
+        # Фоновая отправка пользователей на сайт с повторами
+        self.outbox = OutboxWorker(
+            self.db,
+            self.website,
+            concurrency=int(os.getenv('OUTBOX_CONCURRENCY', '4'))
+        )
+        # Массовая синхронизация (общая с sync_users_to_website.py)
+        self.syncer = BulkSyncer(
+            self.website,
+            concurrency=int(os.getenv('SYNC_CONCURRENCY', '8')),
+            batch_size=int(os.getenv('SYNC_BATCH_SIZE', '1'))
+        )
+        # Фото профиля - в фоне, с кэшем по file_unique_id
+        self.photos = ProfilePhotoResolver(
+            self.db,
+            ttl=float(os.getenv('PHOTO_CACHE_TTL', '3000')),
+            on_update=self.outbox.notify
+        )
+        # Рассылка всем участникам с учётом лимитов Telegram (лимит на бота делят воркеры)
+        self.broadcaster = Broadcaster(
+            self.db,
+            rate=float(os.getenv('BROADCAST_RATE', '25')) / (shard[1] if shard else 1),
+            chat_interval=float(os.getenv('BROADCAST_CHAT_INTERVAL', '1')),
+            concurrency=int(os.getenv('BROADCAST_CONCURRENCY', '8')),
+            progress_interval=self.sync_progress_interval,
+            on_update=self.outbox.notify
+        )
+        self.broadcaster.progress.label = self.shard_label
+        
+        force_direct_connection()
         # Создаём приложение Telegram (без прокси)
-        self.application = Application.builder().token(self.bot_token).build()
-        
-        # Регистрация обработчиков
-        self.application.add_handler(CommandHandler("start", self.start))
-        self.application.add_handler(CommandHandler("help", self.help))
-        self.application.add_handler(CommandHandler("stats", self.stats))
-        self.application.add_handler(CommandHandler("sync", self.sync))
-        self.application.add_handler(MessageHandler(filters.CONTACT, self.handle_contact))
+        builder = (
+            Application.builder()
+            .token(self.bot_token)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        if request is not None:
+            builder = builder.request(request)
+        if get_updates_request is not None:
+            builder = builder.get_updates_request(get_updates_request)
+        # CONCURRENT_UPDATES > 1: параллельная обработка разных пользователей,
+        # обновления одного пользователя идут по порядку
+        self.concurrent_updates = int(os.getenv('CONCURRENT_UPDATES', '1'))
+        if self.concurrent_updates > 1:
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(self.concurrent_updates))
+            logger.info(f"⚡ Параллельная обработка обновлений: до {self.concurrent_updates}")
+        self.application = builder.build()
+        
+        # Регистрация обработчиков (с замером времени для метрик)
+        self.application.add_handler(TypeHandler(Update, self.on_update), group=-1)
+        self.application.add_handler(CommandHandler("start", timed_handler('start', self.start, name)))
+        self.application.add_handler(CommandHandler("help", timed_handler('help', self.help, name)))
+        self.application.add_handler(CommandHandler("stats", timed_handler('stats', self.stats, name)))
+        self.application.add_handler(CommandHandler("sync", timed_handler('sync', self.sync, name)))
+        self.application.add_handler(CommandHandler("metrics", timed_handler('metrics', self.metrics, name)))
+        self.application.add_handler(CommandHandler("broadcast", timed_handler('broadcast', self.broadcast, name)))
+        self.application.add_handler(MessageHandler(filters.CONTACT, timed_handler('contact', self.handle_contact, name)))
         # Обработчик текстовых сообщений с номером телефона
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
+        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler('text', self.handle_text, name)))
+        # Добавляем обработчик ошибок
+        self.application.add_error_handler(self.error_handler)
         
+        REGISTRY.gauge('savosbot_update_queue_size', 'Обновлений в очереди Application',
+                       ['bot']).set_function(self.application.update_queue.qsize, bot=name)
+        REGISTRY.gauge('savosbot_outbox_depth', 'Пользователей в очереди отправки на сайт',
+                       ['bot']).set_function(lambda: self.outbox.depth, bot=name)
+        
+    async def post_init(self, application: Application):
+        """Открытие пула соединений с сайтом и запуск фоновых задач
+        
+        Ничего не ждёт по сети: проверка сайта и досинхронизация идут
+        параллельно с polling, поэтому бот принимает сообщения сразу.
+        """
+        self.timer.mark("инициализация Telegram")
+        await self.website.start()
+        
+        self.health.start()
+        self._spawn(self._startup_health_check(), 'startup-health-check')
+        if not self._startup_synced:
+            self._spawn(self._startup_sync(), 'startup-sync')
+        self.outbox.start()
+        self._spawn(self._flush_stats(), 'stats-flush')
+        if self.broadcaster.interrupted:
+            self._spawn(self._resume_broadcast(), 'broadcast-resume')
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.warning(f"⚠️ Адрес метрик недоступен: {e}")
+                self.metrics_server = None
+    
+    def _spawn(self, coro, name: str):
+        """Фоновая задача, отменяемая при остановке бота"""
+        task = asyncio.create_task(coro, name=name)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+    
+    async def _resume_broadcast(self):
+        """Продолжение рассылки, прерванной перезапуском бота"""
+        logger.info("📢 Продолжение прерванной рассылки")
+        self.broadcaster.resume(self.application.bot, self._spawn)
+        try:
+            text = self.broadcaster.progress.text()
+            message = await self.application.bot.send_message(self.broadcaster.state['chat_id'], text)
+            self.broadcaster.progress.add(message, text)
+        except TelegramError as e:
+            logger.warning(f"⚠️ Не удалось сообщить о продолжении рассылки: {e}")
+    
+    async def _flush_stats(self):
+        """Периодическая запись statistics.json
+        
+        save_user пишет файл не чаще STATS_FLUSH_INTERVAL, и без новых
+        сохранений последние изменения остались бы только в памяти, а
+        сводка по шардам (dispatcher.py) читает именно файлы.
+        """
+        while True:
+            await asyncio.sleep(max(1.0, self.db.stats_flush_interval))
+            await self.db.run(self.db.flush_stats)
+    
+    async def _startup_health_check(self):
+        started = time.monotonic()
+        await self.health.wait_first_check()
+        logger.info(f"🌐 Статус сайта: {'OK' if self.website.connected else 'error'}")
+        self.timer.mark("проверка сайта", since=started)
+    
+    async def _startup_sync(self):
+        started = time.monotonic()
+        while True:
+            self._resync_pending = False
+            report = await self._start_sync_job().wait()
+            self._startup_synced = report is not None and not report.failed
+            # Сайт восстановился во время прохода - повторяем сразу, иначе ждём восстановления
+            if self._startup_synced or not self._resync_pending:
+                break
+        self.timer.mark("досинхронизация с сайтом", since=started)
+    
+    def _on_website_state(self, old: str, new: str):
+        """Сайт восстановился: досылаем очередь и незавершённую досинхронизацию"""
+        if new != CircuitBreaker.CLOSED:
+            return
+        self.outbox.resume()
+        if self._startup_synced:
+            return
+        if any(task.get_name() == 'startup-sync' for task in self._background_tasks):
+            self._resync_pending = True
+        else:
+            self._spawn(self._startup_sync(), 'startup-sync')
+    
+    async def on_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Задержка обновления (от даты сообщения) и время до первого обновления"""
+        message = update.effective_message
+        if message and message.date and not update.edited_message:
+            UPDATE_LAG_SECONDS.observe(max(0.0, time.time() - message.date.timestamp()))
+        if self._first_update_seen:
+            return
+        self._first_update_seen = True
+        self.timer.mark("первое обновление")
+        logger.info(f"⏱️ Этапы запуска: {self.timer.summary()}")
+    
+    async def post_shutdown(self, application: Application):
+        """Остановка фоновых задач и закрытие пула соединений с сайтом"""
+        for task in list(self._background_tasks):
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await self.health.stop()
+        await self.outbox.stop()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await self.website.close()
+    
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик /start"""
         user = update.effective_user
-        logger.info(f"👤 Новый пользователь: {user.id} ({user.username})")
+        logger.info("👤 /start", extra=hot(user_id=user.id, username=user.username))
         
         # Проверяем, есть ли пользователь в базе
-        try:
-            if os.path.exists(self.db.users_file):
-                with open(self.db.users_file, 'r') as f:
-                    users = json.load(f)
-            else:
-                users = []
-        except Exception as e:
-            logger.error(f"❌ Ошибка чтения базы: {e}")
-            users = []
-        
-        existing_user = next((u for u in users if u['id'] == user.id), None)
+        existing_user = await self.db.run(self.db.get_user, user.id)
         
         if existing_user:
             # Пользователь уже зарегистрирован
@@ -291,37 +345,28 @@ class SavosBotWorking:
                 "Добро пожаловать обратно в SavosBot Club.",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
+            
+            # Пользователь, заблокировавший бота, снова получает рассылки
+            if not existing_user.get('is_active', True):
+                await self.db.run(self.db.update_user, user.id, lambda u: {'is_active': True} if u else None)
+                self.outbox.notify()
+            
+            # Ленивое обновление фото, не чаще раза в PHOTO_CACHE_TTL
+            if self.photos.is_stale(user.id):
+                self.photos.schedule(context.bot, user.id, self._spawn)
         else:
             # Новый пользователь - просим телефон
             phone_keyboard = [[KeyboardButton("📲 Отправить номер телефона", request_contact=True)]]
             
             # Сохраняем базовые данные
-            profile_link = f"https://t.me/{user.username}" if user.username else None
-            
-            user_data = {
-                'id': user.id,
-                'username': user.username,
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-                'joined_at': datetime.now().isoformat(),
-                'is_active': True,
-                'profile_link': profile_link,
-                'photo_url': None,
-                'phone': None
-            }
-            
-            # Получаем фото профиля
-            try:
-                photos = await context.bot.get_user_profile_photos(user.id, limit=1)
-                if photos.total_count > 0:
-                    photo_file = await context.bot.get_file(photos.photos[0][0].file_id)
-                    user_data['photo_url'] = photo_file.file_path
-            except Exception as e:
-                logger.warning(f"⚠️ Не удалось получить фото: {e}")
+            user_data = self._profile_data(user)
             
             # НЕ отправляем на сайт до получения телефона
             # Только сохраняем локально для последующей синхронизации
-            self.db.save_user(user_data)
+            await self.db.run(self.db.save_user, user_data)
+            
+            # Фото профиля получаем в фоне, запись обновится по готовности
+            self.photos.schedule(context.bot, user.id, self._spawn)
             
             await update.message.reply_text(
                 f"👋 Добро пожаловать в SavosBot Club, {user.first_name}!\n\n"
@@ -333,51 +378,40 @@ class SavosBotWorking:
                 )
             )
     
+    @staticmethod
+    def _profile_data(user) -> dict:
+        """Базовая запись нового пользователя из профиля Telegram"""
+        return {
+            'id': user.id,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'joined_at': datetime.now().isoformat(),
+            'is_active': True,
+            'profile_link': f"https://t.me/{user.username}" if user.username else None,
+            'photo_url': None,
+            'phone': None
+        }
+    
     async def handle_contact(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик получения контакта с номером телефона"""
         user = update.effective_user
         contact = update.message.contact
         
-        logger.info(f"📞 Получен контакт от пользователя {user.id}")
-        
-        # Загружаем пользователя из БД
-        try:
-            if os.path.exists(self.db.users_file):
-                with open(self.db.users_file, 'r') as f:
-                    users = json.load(f)
-            else:
-                users = []
-        except Exception as e:
-            logger.error(f"❌ Ошибка чтения базы: {e}")
-            users = []
-        
-        # Считаем зарегистрированных пользователей (с телефоном)
-        registered_count = len([u for u in users if u.get('phone')])
-        
-        # Обновляем телефон пользователя и устанавливаем internal_id
-        user_internal = None
-        for u in users:
-            if u['id'] == user.id:
-                u['phone'] = contact.phone_number
-                if not u.get('internal_id'):
-                    u['internal_id'] = registered_count + 1
-                user_internal = u
-                break
-        
-        with open(self.db.users_file, 'w') as f:
-            json.dump(users, f, indent=2)
+        logger.info("📞 Получен контакт", extra=hot(user_id=user.id))
         
-        # Отправка на сайт ВСЕГДА
-        logger.info(f"📤 Попытка отправки пользователя на сайт...")
-        if user_internal:
-            result = self.website.send_user(user_internal)
-            if result:
-                logger.info(f"✅ Пользователь успешно отправлен на сайт")
-            else:
-                logger.warning(f"⚠️ Не удалось отправить на сайт, сохранено локально")
+        # Телефон и internal_id записываются одной операцией
+        # (пользователь без /start создаётся из профиля Telegram)
+        user_internal = await self.db.run(
+            self.db.register_phone, user.id, contact.phone_number, self._profile_data(user)
+        )
+        if user_internal is None:
+            await self._reply_registration_failed(update)
+            return
         
-        # Находим внутренний ID пользователя
-        internal_id = user_internal.get('internal_id', registered_count + 1) if user_internal else registered_count + 1
+        # Пользователь уже в очереди отправки на сайт - ответ не ждёт сайт
+        self.outbox.notify()
+        internal_id = user_internal.get('internal_id')
         
         # Убираем клавиатуру и показываем завершение регистрации
         keyboard = [
@@ -394,29 +428,25 @@ class SavosBotWorking:
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
         
-        logger.info(f"✅ Пользователь {user.id} зарегистрирован (телефон: {contact.phone_number})")
+        logger.info("✅ Пользователь зарегистрирован", extra=hot(user_id=user.id, phone=contact.phone_number))
+    
+    @staticmethod
+    async def _reply_registration_failed(update: Update):
+        """Ответ, если телефон не удалось записать в базу"""
+        await update.message.reply_text(
+            "❌ Не удалось сохранить номер телефона.\n"
+            "Попробуйте отправить его ещё раз чуть позже."
+        )
     
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик текстовых сообщений (для ввода номера телефона)"""
         user = update.effective_user
         text = update.message.text
         
-        logger.info(f"📝 Получен текст от пользователя {user.id}: {text}")
+        logger.info("📝 Получен текст", extra=hot(user_id=user.id, text=text))
         
         # Проверяем, есть ли пользователь в базе и нет ли у него телефона
-        try:
-            if os.path.exists(self.db.users_file):
-                with open(self.db.users_file, 'r') as f:
-                    users = json.load(f)
-            else:
-                users = []
-        except Exception as e:
-            logger.error(f"❌ Ошибка чтения базы: {e}")
-            await update.message.reply_text("❌ Ошибка чтения базы данных. Попробуйте /start")
-            return
-        
-        # Ищем пользователя
-        user_data = next((u for u in users if u['id'] == user.id), None)
+        user_data = await self.db.run(self.db.get_user, user.id)
         
         if user_data and not user_data.get('phone'):
             # Пользователь существует но нет телефона - проверяем текст
@@ -427,40 +457,21 @@ class SavosBotWorking:
                 # Это похоже на номер телефона
                 phone = re.sub(r'\D', '', text)  # Оставляем только цифры
                 
-                # Определяем или устанавливаем internal_id
-                # Считаем зарегистрированных пользователей (с телефоном)
-                registered_count = len([u for u in users if u.get('phone')])
-                if not user_data.get('internal_id'):
-                    # Генерируем internal_id на основе количества зарегистрированных
-                    user_data['internal_id'] = registered_count + 1
+                # Обновляем телефон и выдаём internal_id одной операцией
+                user_data = await self.db.run(self.db.register_phone, user.id, phone)
+                if user_data is None:
+                    await self._reply_registration_failed(update)
+                    return
                 
-                # Обновляем телефон
-                user_data['phone'] = phone
-                
-                # Сохраняем
-                for i, u in enumerate(users):
-                    if u['id'] == user.id:
-                        users[i] = user_data
-                        break
-                
-                with open(self.db.users_file, 'w') as f:
-                    json.dump(users, f, indent=2)
-                
-                # Отправка на сайт ВСЕГДА (даже если сайт не доступен, попробуем)
-                logger.info(f"📤 Попытка отправки пользователя на сайт...")
-                result = self.website.send_user(user_data)
-                if result:
-                    logger.info(f"✅ Пользователь успешно отправлен на сайт")
-                else:
-                    logger.warning(f"⚠️ Не удалось отправить на сайт, сохранено локально")
+                # Пользователь уже в очереди отправки на сайт - ответ не ждёт сайт
+                self.outbox.notify()
                 
                 keyboard = [
                     [InlineKeyboardButton("📱 Открыть приложение", web_app=WebAppInfo(url="https://savos-club-two.vercel.app/mini-app"))],
                     [InlineKeyboardButton("📋 Мой профиль", callback_data="profile")]
                 ]
                 
-                # Внутренний ID уже установлен выше
-                internal_id = user_data.get('internal_id', registered_count + 1)
+                internal_id = user_data.get('internal_id')
                 
                 await update.message.reply_text(
                     f"✅ Регистрация завершена!\n\n"
@@ -471,7 +482,7 @@ class SavosBotWorking:
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
                 
-                logger.info(f"✅ Пользователь {user.id} зарегистрирован (телефон: {phone})")
+                logger.info("✅ Пользователь зарегистрирован", extra=hot(user_id=user.id, phone=phone))
             else:
                 # Не похоже на номер телефона
                 await update.message.reply_text(
@@ -500,8 +511,19 @@ class SavosBotWorking:
         )
     
     async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик /stats"""
-        stats = self.db.get_statistics()
+        """Обработчик /stats (/stats rebuild - полный пересчёт)"""
+        if context.args and context.args[0] == 'rebuild':
+            stats = await self.db.run(self.db.rebuild_stats)
+        else:
+            stats = self.db.get_statistics()
+        
+        shards = ''
+        if self.shard:
+            # Свой шард - из памяти, остальные - из их statistics.json
+            index, count = self.shard
+            others = await self.db.run(read_shard_statistics, self.data_dir, count, index)
+            stats = merge_statistics([stats, *others])
+            shards = f"🧩 Шардов: {stats['shards']} из {count}\n"
         
         status = "✅ Подключено" if self.website.connected else "❌ Отключено"
         
@@ -509,13 +531,90 @@ class SavosBotWorking:
             f"📊 Статистика:\n\n"
             f"👥 Всего: {stats['total_users']}\n"
             f"🟢 Активных: {stats['active_users']}\n"
-            f"📅 Сегодня: {stats['today_users']}\n\n"
+            f"📞 С телефоном: {stats['registered_users']}\n"
+            f"📅 Сегодня: {stats['today_users']}\n"
+            f"📤 В очереди на сайт: {self.outbox.depth}{' (этот шард)' if self.shard else ''}\n"
+            f"{shards}\n"
             f"🌐 Сайт: {status}"
         )
     
+    async def metrics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик /metrics - сводка метрик (только для ADMIN_IDS)"""
+        if update.effective_user.id not in self.admin_ids:
+            await update.message.reply_text("⛔ Команда доступна только администраторам.")
+            return
+        
+        await update.message.reply_text(f"📈 Метрики:\n\n{metrics_summary()}")
+    
+    async def broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик /broadcast - рассылка всем участникам (только для ADMIN_IDS)
+        
+        /broadcast <текст> (или ответом на сообщение) - новая рассылка,
+        /broadcast status | stop | resume - ход, остановка, продолжение.
+        """
+        if update.effective_user.id not in self.admin_ids:
+            await update.message.reply_text("⛔ Команда доступна только администраторам.")
+            return
+        
+        broadcaster = self.broadcaster
+        command = context.args[0] if len(context.args) == 1 else None
+        
+        if command == 'stop':
+            if not broadcaster.running:
+                await update.message.reply_text("📭 Рассылка не идёт.")
+                return
+            await broadcaster.stop()
+            await update.message.reply_text(broadcaster.progress.text())
+            return
+        
+        if command == 'resume':
+            if not broadcaster.running:
+                if broadcaster.state is None or broadcaster.state['status'] == 'done':
+                    await update.message.reply_text("📭 Нет остановленной рассылки.")
+                    return
+                broadcaster.resume(context.bot, self._spawn)
+            await broadcaster.attach(update.message)
+            return
+        
+        if command == 'status':
+            if broadcaster.running:
+                await broadcaster.attach(update.message)
+            elif broadcaster.state is None:
+                await update.message.reply_text("📭 Рассылок ещё не было.")
+            else:
+                await update.message.reply_text(broadcaster.progress.text())
+            return
+        
+        # Текст рассылки - всё после команды (с переносами строк) или сообщение, на которое ответили
+        parts = update.message.text.split(maxsplit=1)
+        text = parts[1].strip() if len(parts) > 1 else ''
+        if not text and update.message.reply_to_message:
+            text = update.message.reply_to_message.text or ''
+        if not text:
+            await update.message.reply_text(
+                "📢 Рассылка всем участникам:\n"
+                "/broadcast <текст> - или ответом на сообщение\n"
+                "/broadcast status | stop | resume"
+            )
+            return
+        
+        if broadcaster.running:
+            await broadcaster.attach(update.message)
+            return
+        
+        broadcaster.start(context.bot, text, update.effective_chat.id, self._spawn)
+        logger.info(f"📢 Рассылка запущена администратором {update.effective_user.id}")
+        await broadcaster.attach(update.message)
+    
     async def sync(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик /sync - синхронизация с сайтом"""
-        if not self.website.connected:
+        """Обработчик /sync - фоновая синхронизация с сайтом (/sync full - всех, для ADMIN_IDS)"""
+        full = bool(context.args) and context.args[0] == 'full'
+        if full and update.effective_user.id not in self.admin_ids:
+            await update.message.reply_text("⛔ Полная синхронизация доступна только администраторам.")
+            return
+        
+        running = self.sync_job is not None and not self.sync_job.finished
+        if not running and not self.website.connected:
             await update.message.reply_text(
                 "❌ Сайт недоступен.\n"
                 "Все данные сохранены локально.\n"
@@ -523,90 +622,64 @@ class SavosBotWorking:
             )
             return
         
-        await update.message.reply_text("🔄 Начинаю синхронизацию...")
-        
-        # Здесь можно добавить логику синхронизации
-        await update.message.reply_text("✅ Синхронизация завершена!")
+        # Уже идущая синхронизация не дублируется: сообщение подключается к ней
+        job = self._start_sync_job(full)
+        await job.attach(update.message)
+    
+    def _start_sync_job(self, full: bool = False) -> SyncJob:
+        """Текущая фоновая синхронизация или новая, если ничего не идёт"""
+        if self.sync_job is not None and not self.sync_job.finished:
+            return self.sync_job
+        
+        job = SyncJob(full=full, interval=self.sync_progress_interval)
+        job.progress.label = self.shard_label
+        job.start(lambda report: self.sync_existing_users(full, report=report), self._spawn)
+        self.sync_job = job
+        return job
     
-    def sync_existing_users(self):
-        """Синхронизация существующих пользователей с сайтом"""
+    async def sync_existing_users(self, full: bool = False, report: Optional[SyncReport] = None):
+        """Синхронизация с сайтом пользователей, изменённых после прошлой синхронизации
+
+        full=True (или SYNC_FULL=1) - отправка всех пользователей с телефоном.
+        report - заполняется по ходу отправки (для сообщений о прогрессе).
+        """
         try:
-            import requests
-            # Проверяем наличие файла users.json
-            if not os.path.exists(self.db.users_file):
-                logger.info("📭 Нет файла users.json для синхронизации")
-                return
+            full = full or os.getenv('SYNC_FULL', '') == '1'
             
-            # Загружаем пользователей
-            with open(self.db.users_file, 'r') as f:
-                users = json.load(f)
-            
-            if not users:
-                logger.info("📭 Нет пользователей для синхронизации")
-                return
+            # Синхронизируем только тех, у кого есть телефон
+            changed = self.db.iter_users_async(
+                source=lambda: self.db.iter_changed(full=full, with_phone=True)
+            )
             
-            logger.info(f"📤 Синхронизация {len(users)} пользователей с сайтом...")
+            # Отметки пишутся один раз в конце, а не на каждую пачку
+            async with self.db.deferred_sync_marks():
+                report = await self.syncer.sync(
+                    changed,
+                    on_synced=lambda users: self.db.run(self.db.mark_synced_many, users),
+                    report=report
+                )
             
-            success_count = 0
-            for user in users:
-                if user.get('phone'):  # Синхронизируем только тех, у кого есть телефон
-                    try:
-                        # Отключаем прокси полностью
-                        session = requests.Session()
-                        session.trust_env = False
-                        session.proxies = {
-                            'http': None,
-                            'https': None,
-                            'no_proxy': '*'
-                        }
-                        
-                        response = session.post(
-                            f"{self.website_url}/api/users",
-                            json={
-                                **user,
-                                'source': 'telegram_bot_sync'
-                            },
-                            headers={
-                                'Authorization': f'Bearer {self.api_key}',
-                                'Content-Type': 'application/json'
-                            },
-                            timeout=10
-                        )
-                        
-                        if response.status_code == 200:
-                            logger.info(f"✅ Синхронизирован пользователь {user.get('id')} ({user.get('first_name')})")
-                            success_count += 1
-                    except Exception as e:
-                        logger.warning(f"⚠️ Ошибка синхронизации пользователя {user.get('id')}: {e}")
+            if not report.total:
+                logger.info("📭 Нет изменённых пользователей для синхронизации")
+                return report
             
-            logger.info(f"✅ Синхронизировано {success_count}/{len([u for u in users if u.get('phone')])} пользователей")
+            logger.info(f"✅ Синхронизация {'всех' if full else 'изменённых'} пользователей: {report.summary()}")
+            return report
             
         except Exception as e:
             logger.error(f"❌ Ошибка при синхронизации: {e}")
+            return None
     
     def run(self):
         """Запуск бота"""
-        logger.info("🚀 Запуск SavosBot...")
-        # Удаляем webhook, если он активен, чтобы polling начал принимать апдейты
-        try:
-            import requests
-            session = requests.Session()
-            session.trust_env = False
-            session.proxies = {}
-            session.post(
-                f"https://api.telegram.org/bot{self.bot_token}/deleteWebhook",
-                params={"drop_pending_updates": True},
-                timeout=10
-            )
-            logger.info("🧹 Webhook удалён (если был включен)")
-        except Exception as e:
-            logger.warning(f"⚠️ Не удалось удалить webhook: {e}")
+        logger.info(f"🚀 Запуск SavosBot (режим: {self.mode})...")
         
-        # Синхронизируем существующих пользователей
-        self.sync_existing_users()
+        if self.mode == 'webhook':
+            self.run_webhook()
+            return
         
-        # Добавляем обработчик ошибок
-        self.application.add_error_handler(self.error_handler)
+        # Webhook удаляет сам run_polling (deleteWebhook с drop_pending_updates
+        # первым запросом перед getUpdates), отдельный запрос не нужен
         
         # Пробуем запустить с повторными попытками
         max_retries = 5
@@ -636,6 +709,24 @@ class SavosBotWorking:
                     # Не сетевая ошибка - выходим
                     logger.error(f"❌ Критическая ошибка: {e}")
                     break
+        
+        # Фиксируем хранилище перед выходом
+        self.db.close()
+    
+    def run_webhook(self):
+        """Работа через webhook со встроенным HTTP-сервером"""
+        settings = webhook_settings_from_env()
+        if not settings['secret_token']:
+            logger.warning("⚠️ WEBHOOK_SECRET не задан - запросы к webhook не проверяются")
+        try:
+            asyncio.run(serve_webhook(
+                self.application,
+                allowed_updates=['message', 'callback_query', 'inline_query'],
+                **settings
+            ))
+        finally:
+            # Фиксируем хранилище перед выходом
+            self.db.close()
     
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ошибок"""
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - рассылка сообщения всем участникам клуба
+
+Telegram ограничивает отправку: около 30 сообщений в секунду на бота и
+примерно одно сообщение в секунду в один чат, при превышении отвечает 429
+с retry_after. Рассылка поэтому идёт через корзину токенов (BROADCAST_RATE,
+по умолчанию 25/с - запас для обычных ответов бота) и паузу между
+сообщениями в один чат, а retry_after приостанавливает всю отправку.
+
+Пользователи обходятся по возрастанию id, ход сохраняется в
+data/broadcast.json: после перезапуска бота рассылка продолжается с места
+остановки. Заблокировавшие бота получают is_active=False и в следующие
+рассылки не попадают (повторный /start снова делает их активными).
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from telegram import Message
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from database import atomic_write_json
+from metrics import BROADCAST_MESSAGES
+from progress import ProgressMessages
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Корзина токенов: в среднем rate событий в секунду, не более burst подряд"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановка выдачи токенов (retry_after от Telegram)"""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            # После паузы отправка начинается без накопленного запаса
+            self._tokens = 0.0
+            self._refilled_at = until
+
+    async def acquire(self):
+        """Ожидание токена (ожидающие обслуживаются по очереди)"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatLimiter:
+    """Минимальная пауза между сообщениями в один чат"""
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._next: Dict[int, float] = {}  # chat_id -> когда можно писать снова
+
+    def defer(self, chat_id: int, seconds: float):
+        self._next[chat_id] = max(self._next.get(chat_id, 0.0), time.monotonic() + seconds)
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        ready = self._next.get(chat_id, 0.0)
+        if ready > now:
+            await asyncio.sleep(ready - now)
+            now = time.monotonic()
+        self._next[chat_id] = now + self.interval
+        if len(self._next) > 10000:
+            self._next = {cid: t for cid, t in self._next.items() if t > now}
+
+
+def _seconds(value) -> float:
+    """retry_after из PTB: int или timedelta в зависимости от версии"""
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class Broadcaster:
+    """Рассылка одного сообщения всем активным пользователям
+
+    Одновременно идёт не больше одной рассылки. Состояние (текст, позиция,
+    счётчики) хранится словарём и периодически сохраняется в
+    broadcast.json; status: running - идёт или прервана перезапуском,
+    stopped - остановлена командой, done - завершена.
+    """
+
+    CHECKPOINT_FILE = 'broadcast.json'
+
+    def __init__(self, db, rate: float = 25.0, chat_interval: float = 1.0, concurrency: int = 8,
+                 max_attempts: int = 5, checkpoint_interval: float = 2.0,
+                 progress_interval: float = 3.0, on_update=None):
+        self.db = db
+        self.bucket = TokenBucket(rate)
+        self.chats = ChatLimiter(chat_interval)
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max_attempts
+        self.checkpoint_interval = checkpoint_interval
+        self.on_update = on_update  # вызывается после изменения записи (например, outbox.notify)
+        self.checkpoint_path = os.path.join(db.data_dir, self.CHECKPOINT_FILE)
+        self.state: Optional[Dict[str, Any]] = self._load_checkpoint()
+        self.task: Optional[asyncio.Task] = None
+        self.retries = 0
+        self.progress = ProgressMessages(
+            self.text, progress_interval, busy_text="📢 Рассылка уже идёт, ход - в сообщении выше."
+        )
+        self._stopping = False
+        self._dispatched: Deque[int] = deque()
+        self._pending: Set[int] = set()
+        self._run_started = 0.0
+        self._run_processed = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def interrupted(self) -> bool:
+        """Рассылка прервана перезапуском и ждёт продолжения"""
+        return not self.running and self.state is not None and self.state['status'] == 'running'
+
+    def _load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Ошибка чтения {self.CHECKPOINT_FILE}: {e}")
+            return None
+
+    async def _save_checkpoint(self):
+        self.state['done_ids'] = [uid for uid in self._dispatched if uid not in self._pending]
+        await self.db.run(atomic_write_json, self.checkpoint_path, dict(self.state))
+
+    def start(self, bot, text: str, chat_id: int, spawn) -> asyncio.Task:
+        """Новая рассылка; chat_id - чат администратора для сообщений о ходе"""
+        self.state = {
+            'id': datetime.now().strftime('%Y%m%d%H%M%S'),
+            'text': text,
+            'chat_id': chat_id,
+            'status': 'running',
+            'started_at': datetime.now().isoformat(),
+            'total': 0,
+            'cursor': 0,
+            'done_ids': [],
+            'delivered': 0,
+            'blocked': 0,
+            'failed': 0
+        }
+        self.progress = ProgressMessages(self.text, self.progress.interval, self.progress.busy_text)
+        return self._spawn(bot, spawn)
+
+    def resume(self, bot, spawn) -> asyncio.Task:
+        """Продолжение прерванной или остановленной рассылки"""
+        self.state['status'] = 'running'
+        return self._spawn(bot, spawn)
+
+    def _spawn(self, bot, spawn) -> asyncio.Task:
+        self._stopping = False
+        self.task = spawn(self._run(bot), 'broadcast')
+        return self.task
+
+    async def stop(self):
+        """Остановка с сохранением позиции (продолжение - resume)"""
+        if not self.running:
+            return
+        self._stopping = True
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def attach(self, message: Message):
+        await self.progress.attach(message)
+
+    def text(self) -> str:
+        """Текст сообщения о ходе рассылки"""
+        state = self.state or {}
+        processed = state.get('delivered', 0) + state.get('blocked', 0) + state.get('failed', 0)
+        elapsed = time.monotonic() - self._run_started if self._run_started else 0.0
+        rate = (processed - self._run_processed) / elapsed if elapsed > 0 else 0.0
+        title = {
+            'running': "📢 Рассылка идёт..." if self.running else "⏸️ Рассылка прервана перезапуском",
+            'stopped': "⏸️ Рассылка остановлена (/broadcast resume - продолжить)",
+            'done': "✅ Рассылка завершена"
+        }.get(state.get('status'), "📢 Рассылка")
+        return (
+            f"{title}\n\n"
+            f"✅ Доставлено: {state.get('delivered', 0)}\n"
+            f"🚫 Заблокировали бота: {state.get('blocked', 0)}\n"
+            f"❌ Ошибок: {state.get('failed', 0)}\n"
+            f"📋 Обработано: {processed} из {state.get('total', 0)}\n"
+            f"⚡ {rate:.1f} сообщ/с"
+        )
+
+    def _target_ids(self, cursor: int, done: Set[int]) -> List[int]:
+        """Активные пользователи после позиции рассылки (в потоке базы)"""
+        return sorted(
+            user['id'] for user in self.db.iter_users()
+            if user['id'] > cursor and user['id'] not in done and user.get('is_active', True)
+        )
+
+    async def _run(self, bot):
+        state = self.state
+        ids = await self.db.run(self._target_ids, state['cursor'], set(state['done_ids']))
+        processed = state['delivered'] + state['blocked'] + state['failed']
+        state['total'] = processed + len(ids)
+        self._dispatched = deque(state['done_ids'])
+        self._pending = set()
+        self._run_started = time.monotonic()
+        self._run_processed = processed
+        logger.info(f"📢 Рассылка {state['id']}: {len(ids)} получателей (уже обработано: {processed})")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+        reporter = asyncio.create_task(self.progress.run())
+        saver = asyncio.create_task(self._checkpoint_loop())
+        try:
+            for user_id in ids:
+                await semaphore.acquire()
+                self._dispatched.append(user_id)
+                self._pending.add(user_id)
+                task = asyncio.create_task(self._send(bot, user_id, semaphore))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+            state['status'] = 'done'
+            logger.info(
+                f"✅ Рассылка {state['id']} завершена: доставлено {state['delivered']}, "
+                f"заблокировали {state['blocked']}, ошибок {state['failed']}"
+            )
+        except asyncio.CancelledError:
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Остановка командой - stopped; завершение бота - running (продолжится при запуске)
+            if self._stopping:
+                state['status'] = 'stopped'
+            logger.info(f"⏸️ Рассылка {state['id']} прервана, позиция сохранена")
+            raise
+        finally:
+            reporter.cancel()
+            saver.cancel()
+            await self._save_checkpoint()
+            await self.progress.refresh()
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self._save_checkpoint()
+
+    async def _send(self, bot, user_id: int, semaphore: asyncio.Semaphore):
+        try:
+            try:
+                result = await self._deliver(bot, user_id)
+                if result == 'blocked':
+                    await self._deactivate(user_id)
+            except Exception as e:
+                logger.error(f"❌ Ошибка рассылки пользователю {user_id}: {e}")
+                result = 'failed'
+            self.state[result] += 1
+            BROADCAST_MESSAGES.inc(result=result)
+            self._pending.discard(user_id)
+            # Позиция - последний id, до которого всё обработано
+            while self._dispatched and self._dispatched[0] not in self._pending:
+                self.state['cursor'] = self._dispatched.popleft()
+        finally:
+            semaphore.release()
+
+    async def _deliver(self, bot, user_id: int) -> str:
+        """Отправка одному пользователю: delivered, blocked или failed"""
+        for attempt in range(self.max_attempts):
+            await self.chats.wait(user_id)
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=user_id, text=self.state['text'])
+                return 'delivered'
+            except RetryAfter as e:
+                # Лимит общий для бота: приостанавливаем всю рассылку
+                seconds = _seconds(e.retry_after)
+                self.bucket.pause(seconds)
+                self.chats.defer(user_id, seconds)
+                self.retries += 1
+                logger.warning(f"⏳ Telegram просит паузу {seconds:.0f} с (пользователь {user_id})")
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    return 'blocked'
+                logger.warning(f"⚠️ Рассылка пользователю {user_id} отклонена: {e}")
+                return 'failed'
+            except NetworkError as e:
+                logger.debug(f"Сетевая ошибка при рассылке пользователю {user_id}: {e}")
+                self.retries += 1
+                await asyncio.sleep(min(30, 2 ** attempt))
+            except TelegramError as e:
+                logger.warning(f"⚠️ Ошибка рассылки пользователю {user_id}: {e}")
+                return 'failed'
+        return 'failed'
+
+    async def _deactivate(self, user_id: int):
+        """Заблокировавший бота пользователь больше не получает рассылки"""
+        def mutate(user):
+            if user is None or not user.get('is_active', True):
+                return None
+            return {'is_active': False}
+
+        if await self.db.run(self.db.update_user, user_id, mutate) and self.on_update:
+            self.on_update()
@@ -0,0 +1,1504 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - хранилище пользователей бота
+
+DatabaseManager держит всех пользователей в памяти с индексами,
+а запись на диск делегирует движку хранения:
+
+- json    - users.json перезаписывается целиком (по умолчанию)
+- journal - каждое изменение дописывается одной строкой в журнал,
+            журнал периодически сжимается в снимок users.json
+- sqlite  - база data/users.db (WAL), пользователи не держатся в памяти,
+            каждый запрос читает одну строку по индексу
+
+Движок выбирается переменной окружения DB_STORAGE. Формат снимка json и
+journal - DB_SNAPSHOT_FORMAT: json (users.json) или binary (users.snap,
+см. snapshot.py). Читается более свежий из двух файлов, поэтому формат
+можно менять в любую сторону: следующая запись будет уже в новом.
+
+json и journal держат записи в памяти компактно (UserRecord, см.
+user_record.py); DB_COMPACT_RECORDS=0 - обычные словари (быстрее запуск,
+но в 2-2.5 раза больше памяти).
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import itertools
+import sqlite3
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import REGISTRY, STORAGE_BYTES, STORAGE_OP_SECONDS, STORAGE_QUEUE_SECONDS
+from logging_setup import hot
+from snapshot import iter_snapshot, read_snapshot, write_snapshot
+from user_record import UserRecord
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка каталога данных не поддерживается
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Служебные поля записи, которые не отправляются на сайт:
+# sync_pending - пользователь в очереди отправки,
+# synced_hash  - хэш содержимого, последним успешно отправленного на сайт
+INTERNAL_FIELDS = ('sync_pending', 'synced_hash')
+
+# Последний выданный internal_id для json/journal (sqlite хранит его в meta)
+SEQUENCE_FILE = 'internal_id.seq'
+
+# Файлы снимка пользователей json/journal по формату (DB_SNAPSHOT_FORMAT)
+SNAPSHOT_FILES = {'json': 'users.json', 'binary': 'users.snap'}
+
+# Блокировка каталога json/journal: файлы пишет только один процесс
+LOCK_FILE = 'users.lock'
+
+
+def public_user(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия записи без служебных полей (данные для сайта)"""
+    return {k: v for k, v in user.items() if k not in INTERNAL_FIELDS}
+
+
+def content_hash(user: Dict[str, Any]) -> str:
+    """Хэш содержимого записи (без служебных полей)"""
+    data = json.dumps(public_user(user), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _copy(user: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Копия записи обычным словарём (dict или UserRecord)"""
+    return user.copy() if user is not None else None
+
+
+def atomic_write(path: str, write: Callable[[IO], Any], binary: bool = False) -> int:
+    """Атомарная запись файла: временный файл + fsync + rename
+
+    write(f) пишет содержимое в открытый временный файл. При падении
+    процесса на диске остаётся либо старый, либо новый файл, но никогда
+    не обрезанный. Возвращает размер записанного файла.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb' if binary else 'w') as f:
+        write(f)
+        f.flush()
+        size = f.tell()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # Фиксируем сам rename в каталоге
+    try:
+        dir_fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+    return size
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = None) -> int:
+    """Атомарная запись JSON (см. atomic_write)"""
+    return atomic_write(path, lambda f: json.dump(data, f, indent=indent))
+
+
+def scan_internal_ids(internal_ids: Iterable[Optional[int]]) -> Tuple[int, List[int]]:
+    """Максимальный выданный internal_id и повторяющиеся номера"""
+    seen = set()
+    duplicates = set()
+    for internal_id in internal_ids:
+        if not internal_id:
+            continue
+        if internal_id in seen:
+            duplicates.add(internal_id)
+        seen.add(internal_id)
+    return max(seen, default=0), sorted(duplicates)
+
+
+def validate_sequence(persisted: int, max_id: int, duplicates: List[int]) -> int:
+    """Проверка последовательности internal_id при запуске; возвращает её значение
+
+    Последовательность не может быть меньше уже выданных номеров (например,
+    если файл последовательности потерян). Дубликаты, оставшиеся от прежней
+    нумерации по количеству пользователей, не исправляются - сайт уже знает
+    эти номера, - но попадают в лог.
+    """
+    if duplicates:
+        logger.warning(f"⚠️ Повторяющиеся internal_id: {len(duplicates)} (например, {duplicates[:5]})")
+    if persisted < max_id:
+        if persisted:
+            logger.warning(f"⚠️ Последовательность internal_id ({persisted}) отстаёт от выданных ({max_id}), исправлено")
+        return max_id
+    return persisted
+
+
+def next_internal_id(last: int, id_shard: Tuple[int, int] = (0, 1)) -> int:
+    """Следующий internal_id после last
+
+    id_shard - (номер, количество) шардов базы (dispatcher.py): шард с
+    номером i выдаёт только номера, дающие i + 1 в остатке от деления на
+    количество, поэтому номера разных шардов не пересекаются. Без шардов
+    (0, 1) - просто last + 1.
+    """
+    index, count = id_shard
+    candidate = last + 1
+    return candidate + (index + 1 - candidate) % count
+
+
+def read_sequence(path: str) -> int:
+    """Чтение файла последовательности internal_id"""
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, 'r') as f:
+            return int(json.load(f))
+    except (ValueError, TypeError):
+        logger.warning(f"⚠️ Повреждён файл {path}, последовательность восстановлена по записям")
+        return 0
+
+
+class DataDirLockedError(RuntimeError):
+    """Каталог данных уже открыт другим процессом (обычно работающим ботом)"""
+
+
+class DataDirLock:
+    """Исключительная блокировка каталога данных (flock на users.lock)
+
+    Держится, пока хранилище открыто, и снимается системой при завершении
+    процесса. В файл пишется PID владельца - для сообщения об ошибке.
+    """
+
+    def __init__(self, data_dir: str):
+        self.path = os.path.join(data_dir, LOCK_FILE)
+        self._file: Optional[IO] = None
+
+    def acquire(self):
+        if fcntl is None or self._file is not None:
+            return
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.seek(0)
+            owner = f.read().strip() or '?'
+            f.close()
+            raise DataDirLockedError(
+                f"❌ {os.path.dirname(self.path) or '.'} уже открыт другим процессом (PID {owner})"
+            )
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def latest_snapshot(data_dir: str) -> Optional[str]:
+    """Более свежий из снимков users.json / users.snap (None, если нет ни одного)"""
+    paths = [os.path.join(data_dir, name) for name in SNAPSHOT_FILES.values()]
+    return max((p for p in paths if os.path.exists(p)), key=os.path.getmtime, default=None)
+
+
+def read_users_snapshot(path: str) -> List[Dict[str, Any]]:
+    """Все пользователи из снимка любого формата"""
+    if path.endswith('.snap'):
+        return read_snapshot(path)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def iter_users_snapshot(path: str) -> Iterator[Dict[str, Any]]:
+    """Потоковое чтение снимка любого формата"""
+    if path.endswith('.snap'):
+        return iter_snapshot(path)
+    return iter_json_array(path)
+
+
+def write_users_snapshot(path: str, users: List[Dict[str, Any]], indent: Optional[int] = None) -> int:
+    """Атомарная запись снимка в формате по расширению файла"""
+    if path.endswith('.snap'):
+        return atomic_write(path, lambda f: write_snapshot(f, users), binary=True)
+    return atomic_write_json(path, users, indent=indent)
+
+
+def iter_json_array(path: str, buffer_size: int = 64 * 1024) -> Iterator[Any]:
+    """Потоковое чтение JSON-массива: элементы по одному
+
+    В памяти только буфер чтения и текущий элемент, поэтому расход памяти
+    не зависит от размера файла, а первый элемент доступен сразу.
+    """
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\r\n'
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = f.read(buffer_size)
+        pos = 0
+        eof = not buf
+
+        def peek() -> str:
+            """Следующий значимый символ (пустая строка - конец файла)"""
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos] in whitespace:
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if eof:
+                    return ''
+                buf = f.read(buffer_size)
+                pos = 0
+                eof = not buf
+
+        if peek() != '[':
+            raise ValueError(f"{path}: ожидался JSON-массив")
+        pos += 1
+        if peek() == ']':
+            return
+
+        while True:
+            peek()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # Элемент прочитан целиком, только если за ним уже виден
+                    # разделитель: число на границе буфера могло оборваться
+                    after = end
+                    while after < len(buf) and buf[after] in whitespace:
+                        after += 1
+                    if eof or (after < len(buf) and buf[after] in ',]'):
+                        break
+                except ValueError:
+                    if eof:
+                        raise
+                more = f.read(buffer_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+            yield value
+            pos = end
+
+            separator = peek()
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f"{path}: неожиданный символ {separator!r} в массиве")
+            pos += 1
+
+
+def select_changed(users: Iterable[Dict[str, Any]], full: bool = False,
+                   with_phone: bool = False) -> Iterator[Dict[str, Any]]:
+    """Пользователи, изменённые после последней успешной синхронизации (данные для сайта)"""
+    for user in users:
+        if with_phone and not user.get('phone'):
+            continue
+        public = public_user(user)
+        if full or user.get('synced_hash') != content_hash(public):
+            yield public
+
+
+def iter_journal(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Записи журнала по одной со смещением строки
+
+    Только чтение: обрезанный или повреждённый хвост просто пропускается.
+    """
+    if not os.path.exists(path):
+        return
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+            yield offset, record
+            offset += len(line)
+
+
+def stream_users(data_dir: str) -> Iterator[Dict[str, Any]]:
+    """Потоковый обход пользователей json/journal без загрузки всей базы
+
+    Снимок (users.json или users.snap) читается по одной записи. Для
+    журнала сначала запоминается только положение последней записи каждого
+    пользователя (id -> смещение): такие пользователи пропускаются в снимке
+    и выдаются вторым проходом по журналу. Файлы только читаются: снимок
+    заменяется ботом атомарно, поэтому обход безопасен и при работающем боте.
+    """
+    journal_file = os.path.join(data_dir, 'users.journal')
+    journals = (f"{journal_file}.old", journal_file)
+    latest: Dict[int, Tuple[int, int]] = {}  # id -> (номер журнала, смещение)
+    for index, path in enumerate(journals):
+        for offset, record in iter_journal(path):
+            if 'id' in record:
+                latest[record['id']] = (index, offset)
+
+    users_file = latest_snapshot(data_dir)
+    if users_file:
+        for user in iter_users_snapshot(users_file):
+            if user['id'] not in latest:
+                yield user
+
+    for index, path in enumerate(journals):
+        for offset, record in iter_journal(path):
+            if latest.get(record.get('id')) == (index, offset):
+                yield record
+
+
+class StatsCounters:
+    """Счётчики статистики, обновляемые при каждом сохранении
+
+    Полный пересчёт нужен только при запуске (rebuild). Регистрации по
+    дням хранятся в словаре, поэтому смена суток не требует обхода базы.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.active = 0
+        self.registered = 0
+        self.joins_by_day: Dict[str, int] = {}
+
+    @staticmethod
+    def _day(user: Dict[str, Any]) -> str:
+        return (user.get('joined_at') or '')[:10]
+
+    def add(self, user: Dict[str, Any], sign: int = 1):
+        """Учёт (sign=1) или снятие с учёта (sign=-1) одной записи"""
+        self.total += sign
+        if user.get('is_active', False):
+            self.active += sign
+        if user.get('phone'):
+            self.registered += sign
+        day = self._day(user)
+        if day:
+            self.joins_by_day[day] = self.joins_by_day.get(day, 0) + sign
+
+    def apply(self, old: Optional[Dict[str, Any]], new: Dict[str, Any]):
+        """Учёт изменения одной записи за O(1)"""
+        if old is not None:
+            self.add(old, -1)
+        self.add(new)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = datetime.now()
+        return {
+            'total_users': self.total,
+            'active_users': self.active,
+            'registered_users': self.registered,
+            'today_users': self.joins_by_day.get(now.date().isoformat(), 0),
+            'last_update': now.isoformat()
+        }
+
+
+class MemoryStorage:
+    """Базовый класс: все пользователи в памяти с индексами
+
+    Наследники реализуют load() и _persist() - запись изменения на диск.
+    compact_records=True - записи хранятся как UserRecord (см. user_record.py),
+    иначе обычными словарями; снаружи они неотличимы.
+    """
+
+    name = 'memory'
+
+    def __init__(self, compact_records: bool = True):
+        self.compact_records = compact_records
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self._by_phone: Dict[str, Dict[str, Any]] = {}
+        self._by_internal_id: Dict[int, Dict[str, Any]] = {}
+        # Очередь отправки на сайт: user_id -> время постановки.
+        # Признак хранится в самой записи (sync_pending) и пишется вместе с ней
+        self.outbox: Dict[int, float] = {}
+        # Последний выданный internal_id; наследники сохраняют его раньше записи
+        self.internal_id_seq = 0
+        self._seq_dirty = False
+        # (номер, количество) шардов: выдаются только номера своего шарда
+        self.id_shard = (0, 1)
+        # Блокировка каталога (задают наследники с файлами на диске)
+        self.lock: Optional[DataDirLock] = None
+
+    def open(self):
+        """Загрузка пользователей в память (один раз при запуске)"""
+        if self.lock:
+            self.lock.acquire()
+        try:
+            self._load_all()
+        except Exception:
+            if self.lock:
+                self.lock.release()
+            raise
+
+    def _load_all(self):
+        self.users = {}
+        self._by_phone = {}
+        self._by_internal_id = {}
+        self.outbox = {}
+        loaded = self.load()
+        if self.compact_records:
+            loaded = UserRecord.from_dicts(loaded)
+        for u in loaded:
+            self.users[u['id']] = u
+            self._index(u)
+            if u.get('sync_pending'):
+                self.outbox[u['id']] = 0.0
+        max_id, duplicates = scan_internal_ids(u.get('internal_id') for u in self.users.values())
+        self.internal_id_seq = validate_sequence(self.load_sequence(), max_id, duplicates)
+
+    def load(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def load_sequence(self) -> int:
+        """Сохранённое значение последовательности internal_id"""
+        return 0
+
+    def _allocate_internal_id(self, user: Dict[str, Any]):
+        """Выдача следующего internal_id (сохраняется вместе с записью)"""
+        self.internal_id_seq = next_internal_id(self.internal_id_seq, self.id_shard)
+        user['internal_id'] = self.internal_id_seq
+        self._seq_dirty = True
+
+    def _persist(self, user: Dict[str, Any]):
+        raise NotImplementedError
+
+    def _persist_many(self, users: List[Dict[str, Any]]):
+        for user in users:
+            self._persist(user)
+
+    def _index(self, user: Dict[str, Any]):
+        """Добавление пользователя в индексы"""
+        if user.get('phone'):
+            self._by_phone[user['phone']] = user
+        if user.get('internal_id'):
+            self._by_internal_id[user['internal_id']] = user
+
+    def _unindex(self, user: Dict[str, Any]):
+        """Удаление пользователя из индексов"""
+        if user.get('phone') and self._by_phone.get(user['phone']) is user:
+            del self._by_phone[user['phone']]
+        if user.get('internal_id') and self._by_internal_id.get(user['internal_id']) is user:
+            del self._by_internal_id[user['internal_id']]
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self.users.get(user_id)
+
+    def get_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
+        return self._by_phone.get(phone)
+
+    def get_by_internal_id(self, internal_id: int) -> Optional[Dict[str, Any]]:
+        return self._by_internal_id.get(internal_id)
+
+    def count(self) -> int:
+        return len(self.users)
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        return iter(list(self.users.values()))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Копии всех записей обычными словарями (для записи снимка)"""
+        return [u.copy() for u in self.users.values()]
+
+    def upsert(self, user_data: Dict[str, Any], enqueue: bool = False,
+               allocate_internal_id: bool = False) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """Создание или обновление; возвращает (старая копия, новая запись)
+
+        enqueue=True ставит пользователя в очередь отправки на сайт
+        той же записью на диск, что и само изменение.
+        allocate_internal_id=True выдаёт internal_id, если его ещё нет.
+        Если запись на диск не удалась, память возвращается к прежнему
+        состоянию (запись, индексы, очередь, последовательность) и
+        исключение пробрасывается дальше.
+        """
+        existing = self.users.get(user_data['id'])
+        sequence = (self.internal_id_seq, self._seq_dirty)
+        queued = user_data['id'] in self.outbox
+
+        if existing is None:
+            old = None
+            user = UserRecord(user_data) if self.compact_records else dict(user_data)
+            self.users[user['id']] = user
+        else:
+            old = existing.copy()
+            self._unindex(existing)
+            existing.update(user_data)
+            user = existing
+        if allocate_internal_id and not user.get('internal_id'):
+            self._allocate_internal_id(user)
+        self._index(user)
+
+        if enqueue:
+            user['sync_pending'] = True
+            self.outbox.setdefault(user['id'], time.time())
+
+        try:
+            self._persist(user)
+        except Exception:
+            self._unindex(user)
+            if old is None:
+                del self.users[user['id']]
+            else:
+                user.clear()
+                user.update(old)
+                self._index(user)
+            if not queued:
+                self.outbox.pop(user['id'], None)
+            self.internal_id_seq, self._seq_dirty = sequence
+            raise
+        return old, user
+
+    def mark_synced(self, entries: List[Tuple[int, str, bool]]):
+        """Запись отметок синхронизации одной операцией
+
+        entries - (user_id, хэш отправленного содержимого, снять с очереди).
+        При ошибке записи отметки и очередь в памяти восстанавливаются.
+        """
+        changed = []
+        undo = []
+        for user_id, synced_hash, ack in entries:
+            user = self.users.get(user_id)
+            undo.append((user_id, self.outbox.get(user_id),
+                         user, {k: user[k] for k in INTERNAL_FIELDS if k in user} if user else None))
+            if ack:
+                self.outbox.pop(user_id, None)
+            if user is None:
+                continue
+            user['synced_hash'] = synced_hash
+            if ack:
+                user.pop('sync_pending', None)
+            changed.append(user)
+        if not changed:
+            return
+        try:
+            self._persist_many(changed)
+        except Exception:
+            for user_id, queued_at, user, fields in undo:
+                if queued_at is not None:
+                    self.outbox[user_id] = queued_at
+                if user is not None:
+                    for key in INTERNAL_FIELDS:
+                        if key in fields:
+                            user[key] = fields[key]
+                        else:
+                            user.pop(key, None)
+            raise
+
+    def scan_counters(self) -> StatsCounters:
+        """Полный пересчёт статистики (только при запуске)"""
+        counters = StatsCounters()
+        for u in self.users.values():
+            counters.add(u)
+        return counters
+
+    def close(self):
+        """Завершение работы"""
+        if self.lock:
+            self.lock.release()
+
+
+class JsonStorage(MemoryStorage):
+    """Хранение в users.json (или users.snap) с полной перезаписью при каждом изменении"""
+
+    name = 'json'
+
+    def __init__(self, data_dir: str, snapshot_format: str = 'json', compact_records: bool = True):
+        if snapshot_format not in SNAPSHOT_FILES:
+            raise ValueError(f"❌ Неизвестный формат снимка: {snapshot_format}")
+
+        super().__init__(compact_records)
+        self.data_dir = data_dir
+        self.users_file = os.path.join(data_dir, SNAPSHOT_FILES[snapshot_format])
+        self.seq_file = os.path.join(data_dir, SEQUENCE_FILE)
+        self.lock = DataDirLock(data_dir)
+        # Отметки синхронизации копятся в памяти, пока идёт массовая
+        # синхронизация (см. defer_marks); _marks_unsaved - есть незаписанные
+        self._deferred_marks = 0
+        self._marks_unsaved = False
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Чтение всех пользователей"""
+        path = latest_snapshot(self.data_dir)
+        if not path:
+            return []
+        STORAGE_BYTES.inc(os.path.getsize(path), engine=self.name, direction='read')
+        return read_users_snapshot(path)
+
+    def load_sequence(self) -> int:
+        return read_sequence(self.seq_file)
+
+    def _persist(self, user: Dict[str, Any]):
+        """Сохранение изменения (весь файл)
+
+        Последовательность пишется первой: при сбое между двумя записями
+        номер пропускается, но никогда не выдаётся повторно.
+        """
+        written = 0
+        if self._seq_dirty:
+            written += atomic_write_json(self.seq_file, self.internal_id_seq)
+            self._seq_dirty = False
+        written += write_users_snapshot(self.users_file, self.snapshot(), indent=2)
+        # В снимок попали и отложенные отметки синхронизации
+        self._marks_unsaved = False
+        STORAGE_BYTES.inc(written, engine=self.name, direction='write')
+
+    def _persist_many(self, users: List[Dict[str, Any]]):
+        """Несколько изменений - одна перезапись файла
+
+        Пока отметки отложены, файл не пишется: они уйдут на диск с
+        ближайшим изменением или в flush_marks().
+        """
+        if self._deferred_marks:
+            self._marks_unsaved = True
+            return
+        self._persist(users[0])
+
+    def defer_marks(self, enabled: bool):
+        """Начало (True) или конец (False) отложенной записи отметок
+
+        Каждое подтверждение пачки иначе перезаписывало бы весь файл.
+        Вызовы вложенные; с последним False отметки записываются.
+        """
+        if enabled:
+            self._deferred_marks += 1
+            return
+        self._deferred_marks -= 1
+        if not self._deferred_marks:
+            self.flush_marks()
+
+    def flush_marks(self):
+        """Запись отложенных отметок синхронизации (одна перезапись файла)
+
+        Ошибка только логируется: отметки остаются в памяти и попадут на
+        диск со следующей записью; при падении процесса пользователи будут
+        отправлены ещё раз.
+        """
+        if not self._marks_unsaved:
+            return
+        try:
+            self._persist(None)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи отметок синхронизации: {e}")
+
+    def close(self):
+        self.flush_marks()
+        super().close()
+
+
+class JournalStorage(MemoryStorage):
+    """Журнал изменений + снимок users.json
+
+    Каждое сохранение пользователя - одна JSON-строка в users.journal
+    с полной записью пользователя. Когда журнал превышает порог, он
+    переименовывается в users.journal.old, а в фоновом потоке пишется
+    новый снимок users.json, после чего старый журнал удаляется.
+
+    При запуске читается снимок, затем users.journal.old (если сжатие
+    было прервано) и users.journal. Повторное применение записей
+    безопасно, так как каждая запись содержит пользователя целиком.
+
+    Выдача internal_id пишется строкой {"internal_id_seq": N} в той же
+    записи журнала, что и пользователь; при сжатии значение переносится
+    в internal_id.seq.
+
+    Политика fsync (DB_JOURNAL_FSYNC):
+    - always   - fsync после каждой записи
+    - interval - fsync не чаще раза в DB_JOURNAL_FSYNC_INTERVAL секунд
+    - never    - только flush в ОС (переживает падение процесса, но не питания)
+    """
+
+    name = 'journal'
+    FSYNC_POLICIES = ('always', 'interval', 'never')
+
+    def __init__(self, data_dir: str, fsync: str = 'interval',
+                 fsync_interval: float = 1.0, compact_bytes: int = 4 * 1024 * 1024,
+                 snapshot_format: str = 'json', compact_records: bool = True):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"❌ Неизвестная политика fsync: {fsync}")
+        if snapshot_format not in SNAPSHOT_FILES:
+            raise ValueError(f"❌ Неизвестный формат снимка: {snapshot_format}")
+
+        super().__init__(compact_records)
+        self.data_dir = data_dir
+        self.users_file = os.path.join(data_dir, SNAPSHOT_FILES[snapshot_format])
+        self.journal_file = os.path.join(data_dir, 'users.journal')
+        self.old_journal_file = f"{self.journal_file}.old"
+        self.seq_file = os.path.join(data_dir, SEQUENCE_FILE)
+        self.lock = DataDirLock(data_dir)
+        self._journal_seq = 0
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+
+        self._journal = None
+        self._journal_size = 0
+        self._last_fsync = 0.0
+        self._compaction: Optional[threading.Thread] = None
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Снимок + воспроизведение журнала"""
+        users: Dict[int, Dict[str, Any]] = {}
+
+        snapshot_file = latest_snapshot(self.data_dir)
+        if snapshot_file:
+            STORAGE_BYTES.inc(os.path.getsize(snapshot_file), engine=self.name, direction='read')
+            for u in read_users_snapshot(snapshot_file):
+                users[u['id']] = u
+
+        replayed = 0
+        self._journal_seq = 0
+        for path in (self.old_journal_file, self.journal_file):
+            for record in self._read_journal(path):
+                if 'internal_id_seq' in record:
+                    self._journal_seq = max(self._journal_seq, record['internal_id_seq'])
+                    continue
+                users[record['id']] = record
+                replayed += 1
+
+        if replayed:
+            logger.info(f"📜 Из журнала восстановлено записей: {replayed}")
+
+        # Прерванное сжатие доводим до конца сразу при запуске
+        if os.path.exists(self.old_journal_file):
+            self._write_snapshot(list(users.values()), self.load_sequence())
+
+        self._open_journal()
+        return list(users.values())
+
+    def _read_journal(self, path: str) -> List[Dict[str, Any]]:
+        """Чтение журнала; обрезанная последняя строка отбрасывается"""
+        if not os.path.exists(path):
+            return []
+
+        records = []
+        valid_size = 0
+        STORAGE_BYTES.inc(os.path.getsize(path), engine=self.name, direction='read')
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    logger.warning(f"⚠️ Обрезанная запись в конце {path} отброшена")
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"⚠️ Повреждённая запись в {path} отброшена")
+                    break
+                valid_size += len(line)
+
+        # Отрезаем мусор, чтобы новые записи не склеились с ним
+        if valid_size != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+        return records
+
+    def load_sequence(self) -> int:
+        return max(read_sequence(self.seq_file), self._journal_seq)
+
+    def _open_journal(self):
+        self._journal = open(self.journal_file, 'ab')
+        self._journal_size = self._journal.tell()
+
+    def _persist(self, user: Dict[str, Any]):
+        """Дописывание одной записи в журнал"""
+        self._persist_many([user])
+
+    def _persist_many(self, users: List[Dict[str, Any]]):
+        """Дописывание записей в журнал с одним flush/fsync"""
+        lines = users
+        if self._seq_dirty:
+            # Номер фиксируется той же записью, что и пользователь, которому он выдан
+            lines = [{'internal_id_seq': self.internal_id_seq}, *users]
+            self._seq_dirty = False
+        data = b''.join(
+            json.dumps(line.copy(), ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            for line in lines
+        )
+        self._journal.write(data)
+        self._journal.flush()
+        self._journal_size += len(data)
+        STORAGE_BYTES.inc(len(data), engine=self.name, direction='write')
+
+        if self.fsync == 'always' or (
+            self.fsync == 'interval' and time.monotonic() - self._last_fsync >= self.fsync_interval
+        ):
+            os.fsync(self._journal.fileno())
+            self._last_fsync = time.monotonic()
+
+        if self._journal_size >= self.compact_bytes:
+            # Записи уже в журнале: сбой сжатия не должен выглядеть как сбой записи
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"❌ Ошибка сжатия журнала: {e}")
+
+    def compact(self, wait: bool = False):
+        """Запуск сжатия журнала в снимок"""
+        if self._compaction and self._compaction.is_alive():
+            if wait:
+                self._compaction.join()
+            return
+
+        # Ротация журнала: всё, что было до этого момента, попадёт в снимок
+        try:
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+            self._rotate_journal()
+        finally:
+            if self._journal.closed:
+                self._open_journal()
+
+        # Копии записей, чтобы фоновый поток не видел дальнейших изменений
+        snapshot = self.snapshot()
+
+        self._compaction = threading.Thread(
+            target=self._write_snapshot, args=(snapshot, self.internal_id_seq),
+            name='journal-compaction', daemon=True
+        )
+        self._compaction.start()
+        if wait:
+            self._compaction.join()
+
+    def _rotate_journal(self):
+        """Перенос журнала в users.journal.old
+
+        Оставшийся .old значит, что прошлый снимок не записан: его записи
+        есть только там. Тогда журнал дописывается в конец .old (повтор
+        записи при сбое между шагами безопасен - записи полные).
+        """
+        if not os.path.exists(self.old_journal_file):
+            os.replace(self.journal_file, self.old_journal_file)
+            return
+
+        logger.warning("⚠️ Прошлое сжатие журнала не завершено, журнал дописывается к users.journal.old")
+        with open(self.journal_file, 'rb') as src, open(self.old_journal_file, 'ab') as dst:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.remove(self.journal_file)
+
+    def _write_snapshot(self, snapshot: List[Dict[str, Any]], internal_id_seq: int = 0):
+        """Запись снимка и удаление сжатого журнала (фоновый поток)"""
+        try:
+            started = time.monotonic()
+            written = 0
+            if internal_id_seq:
+                written += atomic_write_json(self.seq_file, internal_id_seq)
+            written += write_users_snapshot(self.users_file, snapshot)
+            STORAGE_BYTES.inc(written, engine=self.name, direction='write')
+            if os.path.exists(self.old_journal_file):
+                os.remove(self.old_journal_file)
+            logger.info(f"🗜️ Журнал сжат: {len(snapshot)} пользователей за {time.monotonic() - started:.2f} с")
+        except Exception as e:
+            logger.error(f"❌ Ошибка сжатия журнала: {e}")
+
+    def close(self):
+        """Завершение работы: дожидаемся сжатия и фиксируем журнал"""
+        if self._compaction and self._compaction.is_alive():
+            self._compaction.join()
+        if self._journal and not self._journal.closed:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+        super().close()
+
+
+class SqliteStorage:
+    """Хранение в SQLite (data/users.db) в режиме WAL
+
+    Пользователи не загружаются в память: каждый поиск - один SELECT
+    по первичному ключу или индексу. Поля, для которых нет колонок,
+    хранятся в JSON-колонке extra.
+    """
+
+    name = 'sqlite'
+
+    COLUMNS = (
+        'id', 'username', 'first_name', 'last_name', 'joined_at', 'is_active',
+        'profile_link', 'photo_url', 'phone', 'internal_id', 'synced_hash'
+    )
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            joined_at TEXT,
+            is_active INTEGER NOT NULL DEFAULT 1,
+            profile_link TEXT,
+            photo_url TEXT,
+            phone TEXT,
+            internal_id INTEGER,
+            extra TEXT,
+            synced_hash TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone);
+        CREATE INDEX IF NOT EXISTS idx_users_internal_id ON users(internal_id);
+        CREATE INDEX IF NOT EXISTS idx_users_joined_at ON users(joined_at);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS outbox (
+            user_id INTEGER PRIMARY KEY,
+            enqueued_at REAL NOT NULL
+        );
+    """
+
+    # Запросы фиксированы, sqlite3 кэширует их подготовленные выражения
+    SELECT_SQL = f"SELECT {', '.join(COLUMNS)}, extra FROM users"
+    UPSERT_SQL = (
+        f"INSERT INTO users ({', '.join(COLUMNS)}, extra) "
+        f"VALUES ({', '.join('?' * (len(COLUMNS) + 1))}) "
+        f"ON CONFLICT(id) DO UPDATE SET "
+        + ', '.join(f"{c} = excluded.{c}" for c in COLUMNS[1:] + ('extra',))
+    )
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.db_file = os.path.join(data_dir, 'users.db')
+        self.conn: Optional[sqlite3.Connection] = None
+        self.outbox: Dict[int, float] = {}
+        self.id_shard = (0, 1)
+
+    def open(self):
+        """Открытие базы и однократный импорт users.json"""
+        # Соединение используется из потока DatabaseManager, доступ сериализован
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False, cached_statements=64)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+        # Базы, созданные до появления отметок синхронизации
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(users)')}
+        if 'synced_hash' not in columns:
+            self.conn.execute('ALTER TABLE users ADD COLUMN synced_hash TEXT')
+
+        if self.get_meta('migrated_from_json') is None:
+            migrate_json_to_sqlite(self.data_dir, self)
+
+        self._validate_sequence()
+        self.outbox = dict(self.conn.execute('SELECT user_id, enqueued_at FROM outbox ORDER BY enqueued_at'))
+
+    def _validate_sequence(self):
+        """Сверка последовательности internal_id с выданными номерами"""
+        persisted = int(self.get_meta('internal_id_seq') or 0)
+        max_id = self.conn.execute('SELECT COALESCE(MAX(internal_id), 0) FROM users').fetchone()[0]
+        duplicates = [row[0] for row in self.conn.execute(
+            'SELECT internal_id FROM users WHERE internal_id IS NOT NULL '
+            'GROUP BY internal_id HAVING COUNT(*) > 1 ORDER BY internal_id'
+        )]
+        seq = validate_sequence(persisted, max_id, duplicates)
+        if seq != persisted:
+            with self.conn:
+                self.set_meta('internal_id_seq', str(seq))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self.conn.execute(
+            'INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, value)
+        )
+
+    def _row_to_user(self, row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        user = dict(zip(self.COLUMNS, row[:-1]))
+        user['is_active'] = bool(user['is_active'])
+        if row[-1]:
+            user.update(json.loads(row[-1]))
+        return user
+
+    def _user_to_row(self, user: Dict[str, Any]) -> tuple:
+        extra = {k: v for k, v in user.items() if k not in self.COLUMNS and k not in INTERNAL_FIELDS}
+        values = [user.get(c) for c in self.COLUMNS]
+        values[self.COLUMNS.index('is_active')] = 1 if user.get('is_active', True) else 0
+        return (*values, json.dumps(extra, ensure_ascii=False) if extra else None)
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self._row_to_user(self.conn.execute(f"{self.SELECT_SQL} WHERE id = ?", (user_id,)).fetchone())
+
+    def get_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
+        return self._row_to_user(self.conn.execute(f"{self.SELECT_SQL} WHERE phone = ?", (phone,)).fetchone())
+
+    def get_by_internal_id(self, internal_id: int) -> Optional[Dict[str, Any]]:
+        return self._row_to_user(
+            self.conn.execute(f"{self.SELECT_SQL} WHERE internal_id = ?", (internal_id,)).fetchone()
+        )
+
+    def count(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        """Постраничный обход по первичному ключу (без загрузки всех строк)"""
+        last_id = None
+        while True:
+            if last_id is None:
+                rows = self.conn.execute(f"{self.SELECT_SQL} ORDER BY id LIMIT 500").fetchall()
+            else:
+                rows = self.conn.execute(
+                    f"{self.SELECT_SQL} WHERE id > ? ORDER BY id LIMIT 500", (last_id,)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._row_to_user(row)
+            last_id = rows[-1][0]
+
+    def upsert(self, user_data: Dict[str, Any], enqueue: bool = False,
+               allocate_internal_id: bool = False) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """Создание или обновление одной строки в транзакции
+
+        При enqueue=True строка очереди отправки пишется в той же транзакции,
+        как и новое значение последовательности при выдаче internal_id.
+        """
+        enqueued_at = time.time()
+        with self.conn:
+            old = self.get(user_data['id'])
+            user = {**old, **user_data} if old else dict(user_data)
+            if allocate_internal_id and not user.get('internal_id'):
+                user['internal_id'] = next_internal_id(int(self.get_meta('internal_id_seq') or 0), self.id_shard)
+                self.set_meta('internal_id_seq', str(user['internal_id']))
+            self.conn.execute(self.UPSERT_SQL, self._user_to_row(user))
+            if enqueue:
+                self.conn.execute(
+                    'INSERT OR IGNORE INTO outbox (user_id, enqueued_at) VALUES (?, ?)',
+                    (user['id'], enqueued_at)
+                )
+        if enqueue:
+            self.outbox.setdefault(user['id'], enqueued_at)
+        return old, user
+
+    def mark_synced(self, entries: List[Tuple[int, str, bool]]):
+        """Запись отметок синхронизации одной транзакцией"""
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE users SET synced_hash = ? WHERE id = ?',
+                [(synced_hash, user_id) for user_id, synced_hash, _ in entries]
+            )
+            self.conn.executemany(
+                'DELETE FROM outbox WHERE user_id = ?',
+                [(user_id,) for user_id, _, ack in entries if ack]
+            )
+        for user_id, _, ack in entries:
+            if ack:
+                self.outbox.pop(user_id, None)
+
+    def upsert_many(self, users: List[Dict[str, Any]]):
+        """Пакетная запись (для миграции)"""
+        with self.conn:
+            self.conn.executemany(self.UPSERT_SQL, [self._user_to_row(u) for u in users])
+
+    def scan_counters(self) -> StatsCounters:
+        """Полный пересчёт статистики агрегатными запросами (только при запуске)"""
+        counters = StatsCounters()
+        counters.total, counters.active, counters.registered = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(is_active), 0), "
+            "COALESCE(SUM(phone IS NOT NULL AND phone != ''), 0) FROM users"
+        ).fetchone()
+        for day, count in self.conn.execute(
+            "SELECT substr(joined_at, 1, 10), COUNT(*) FROM users "
+            "WHERE joined_at IS NOT NULL AND joined_at != '' GROUP BY 1"
+        ):
+            counters.joins_by_day[day] = count
+        return counters
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+def migrate_json_to_sqlite(data_dir: str, storage: SqliteStorage) -> int:
+    """Однократный импорт users.json и statistics.json в SQLite
+
+    Исходные файлы не удаляются. Повторный запуск ничего не делает:
+    факт миграции записывается в таблицу meta.
+    """
+    users_file = latest_snapshot(data_dir)
+    stats_file = os.path.join(data_dir, 'statistics.json')
+
+    users = read_users_snapshot(users_file) if users_file else []
+
+    with storage.conn:
+        storage.upsert_many(users)
+        if os.path.exists(stats_file):
+            with open(stats_file, 'r') as f:
+                storage.set_meta('imported_statistics', f.read())
+        storage.set_meta('migrated_from_json', datetime.now().isoformat())
+
+    if users:
+        logger.info(f"📦 Импортировано из users.json в SQLite: {len(users)} пользователей")
+    return len(users)
+
+
+def create_storage(data_dir: str, kind: Optional[str] = None):
+    """Создание движка хранения по имени (или по DB_STORAGE)"""
+    kind = kind or os.getenv('DB_STORAGE', 'json')
+    snapshot_format = os.getenv('DB_SNAPSHOT_FORMAT', 'json')
+    compact_records = os.getenv('DB_COMPACT_RECORDS', '1') != '0'
+
+    if kind == 'json':
+        return JsonStorage(data_dir, snapshot_format=snapshot_format, compact_records=compact_records)
+    if kind == 'journal':
+        return JournalStorage(
+            data_dir,
+            fsync=os.getenv('DB_JOURNAL_FSYNC', 'interval'),
+            fsync_interval=float(os.getenv('DB_JOURNAL_FSYNC_INTERVAL', '1.0')),
+            compact_bytes=int(os.getenv('DB_JOURNAL_COMPACT_BYTES', str(4 * 1024 * 1024))),
+            snapshot_format=snapshot_format,
+            compact_records=compact_records
+        )
+    if kind == 'sqlite':
+        return SqliteStorage(data_dir)
+    raise ValueError(f"❌ Неизвестный движок хранения: {kind}")
+
+
+class DatabaseManager:
+    """Менеджер базы данных пользователей
+
+    Поиск и обновление идут через движок хранения: для json/journal это
+    индексы в памяти, для sqlite - запросы по одной строке. Все обращения
+    из асинхронных обработчиков выполняются через run() в отдельном
+    потоке, чтобы диск не блокировал цикл событий.
+    """
+
+    def __init__(self, data_dir: str = 'data', storage=None, id_shard: Tuple[int, int] = (0, 1)):
+        """id_shard - (номер, количество) шардов для выдачи internal_id (см. next_internal_id)"""
+        self.data_dir = data_dir
+        self.stats_file = os.path.join(self.data_dir, 'statistics.json')
+        self.storage = storage or create_storage(self.data_dir)
+        self.storage.id_shard = id_shard
+        self.users_file = getattr(self.storage, 'users_file', os.path.join(self.data_dir, 'users.json'))
+
+        # Один поток на все операции: движки не обязаны быть потокобезопасными
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+        # Статистика в памяти; statistics.json пишется не чаще stats_flush_interval
+        self.stats = StatsCounters()
+        self.stats_flush_interval = float(os.getenv('STATS_FLUSH_INTERVAL', '5'))
+        self._stats_flushed_at = 0.0
+        self._stats_dirty = False
+
+        # Метка store - каталог базы: у нескольких баз в процессе свои значения
+        self._gauges = [
+            (REGISTRY.gauge('savosbot_storage_file_bytes', 'Размер файлов базы на диске, байт', ['store']),
+             self.data_size),
+            (REGISTRY.gauge('savosbot_users', 'Пользователей в базе', ['store']), lambda: self.stats.total),
+        ]
+        for gauge, func in self._gauges:
+            gauge.set_function(func, store=self.data_dir)
+
+    def initialize(self):
+        """Инициализация базы данных
+
+        Для json/journal каталог блокируется до close(): второй процесс
+        получит DataDirLockedError, а не будет писать те же файлы.
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        lock = getattr(self.storage, 'lock', None)
+        if lock:
+            lock.acquire()
+
+        if not latest_snapshot(self.data_dir):
+            write_users_snapshot(self.users_file, [])
+
+        if not os.path.exists(self.stats_file):
+            atomic_write_json(self.stats_file, {
+                'total_users': 0,
+                'active_users': 0,
+                'today_users': 0,
+                'last_update': datetime.now().isoformat()
+            })
+
+        try:
+            self.storage.open()
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения базы: {e}")
+            raise
+
+        self.rebuild_stats()
+        logger.info(f"📂 Загружено пользователей: {self.stats.total} (хранилище: {self.storage.name})")
+
+    @asynccontextmanager
+    async def deferred_sync_marks(self):
+        """Отметки синхронизации внутри блока пишутся на диск один раз, в конце
+
+        Для json каждая запись - перезапись всего users.json, и массовая
+        синхронизация писала бы его на каждую подтверждённую пачку. Внутри
+        блока отметки меняются только в памяти (и попадают на диск с любым
+        другим изменением). journal и sqlite пишут отметки дёшево и
+        записывают их сразу.
+        """
+        defer = getattr(self.storage, 'defer_marks', None)
+        if defer is None:
+            yield
+            return
+        await self.run(defer, True)
+        try:
+            yield
+        finally:
+            await self.run(defer, False)
+
+    async def run(self, func, *args):
+        """Выполнение операции с базой вне цикла событий
+
+        Для метрик замеряются ожидание потока базы и время самой операции.
+        """
+        loop = asyncio.get_running_loop()
+        op = getattr(func, '__name__', '<lambda>')
+        if op.startswith('<'):
+            op = 'call'
+        submitted = time.perf_counter()
+
+        def call():
+            started = time.perf_counter()
+            STORAGE_QUEUE_SECONDS.observe(started - submitted, op=op)
+            try:
+                return func(*args)
+            finally:
+                STORAGE_OP_SECONDS.observe(time.perf_counter() - started, op=op)
+
+        return await loop.run_in_executor(self._executor, call)
+
+    def data_size(self) -> int:
+        """Суммарный размер файлов в каталоге данных"""
+        total = 0
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    total += entry.stat().st_size
+        return total
+
+    def close(self):
+        """Завершение работы хранилища"""
+        self._executor.shutdown(wait=True)
+        self.flush_stats()
+        self.storage.close()
+        for gauge, func in self._gauges:
+            gauge.remove_function(func, store=self.data_dir)
+
+    # Поиск возвращает копии: запись в памяти меняется только в потоке базы,
+    # и параллельные обработчики не видят её наполовину обновлённой
+
+    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Поиск пользователя по Telegram ID"""
+        return _copy(self.storage.get(user_id))
+
+    def get_user_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
+        """Поиск пользователя по номеру телефона"""
+        return _copy(self.storage.get_by_phone(phone))
+
+    def get_user_by_internal_id(self, internal_id: int) -> Optional[Dict[str, Any]]:
+        """Поиск пользователя по внутреннему ID"""
+        return _copy(self.storage.get_by_internal_id(internal_id))
+
+    def registered_count(self) -> int:
+        """Количество зарегистрированных пользователей (с телефоном)"""
+        return self.stats.registered
+
+    def iter_users(self) -> Iterator[Dict[str, Any]]:
+        """Обход всех пользователей"""
+        return self.storage.iter_users()
+
+    async def iter_users_async(self, chunk_size: int = 500, source=None):
+        """Асинхронный обход пользователей порциями из потока базы
+
+        source - функция, возвращающая итератор (по умолчанию iter_users).
+        """
+        iterator = await self.run(source or self.iter_users)
+        while True:
+            chunk = await self.run(lambda: [u.copy() for u in itertools.islice(iterator, chunk_size)])
+            if not chunk:
+                return
+            for user in chunk:
+                yield user
+
+    def save_user(self, user_data: Dict[str, Any], allocate_internal_id: bool = False) -> Optional[Dict[str, Any]]:
+        """Сохранение пользователя (создание или обновление)
+
+        Пользователи с телефоном ставятся в очередь отправки на сайт
+        атомарно с самим изменением. allocate_internal_id=True выдаёт
+        следующий internal_id (если его ещё нет) той же записью.
+        При ошибке записи - None: изменение не сохранено, не поставлено в
+        очередь и не видно в памяти (движок откатывает запись, см.
+        MemoryStorage.upsert; SQLite - транзакция).
+        """
+        try:
+            existing = self.storage.get(user_data['id']) or {}
+            enqueue = bool(user_data.get('phone', existing.get('phone')))
+            old, user = self.storage.upsert(
+                user_data, enqueue=enqueue, allocate_internal_id=allocate_internal_id
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения: {e}", extra=hot(user_id=user_data.get('id')))
+            return None
+
+        logger.info("✅ Пользователь сохранён" if old is None else "✅ Пользователь обновлён",
+                    extra=hot(user_id=user['id']))
+
+        # Обновление статистики за O(1)
+        self.stats.apply(old, user)
+        self._stats_dirty = True
+        if time.monotonic() - self._stats_flushed_at >= self.stats_flush_interval:
+            self.update_stats()
+        return user.copy()
+
+    def register_phone(self, user_id: int, phone: str,
+                       profile: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Регистрация: телефон и internal_id одной атомарной записью
+
+        Номер берётся из сохранённой последовательности, а не из количества
+        пользователей, поэтому одновременные регистрации получают разные ID.
+        Если пользователя ещё нет, он создаётся из profile (без него - None).
+        None и при ошибке записи - регистрация не состоялась.
+        """
+        if self.storage.get(user_id) is None:
+            if profile is None:
+                return None
+            return self.save_user({**profile, 'id': user_id, 'phone': phone}, allocate_internal_id=True)
+        return self.save_user({'id': user_id, 'phone': phone}, allocate_internal_id=True)
+
+    def update_user(self, user_id: int, mutate) -> Optional[Dict[str, Any]]:
+        """Атомарное чтение-изменение-запись одного пользователя
+
+        mutate(копия записи или None) возвращает словарь изменений или None,
+        если менять нечего. Весь цикл выполняется одной операцией в потоке
+        базы, поэтому параллельные обновления не затирают друг друга.
+        """
+        updates = mutate(_copy(self.storage.get(user_id)))
+        if not updates:
+            return None
+        return self.save_user({**updates, 'id': user_id})
+
+    def outbox_depth(self) -> int:
+        """Количество пользователей, ожидающих отправки на сайт"""
+        return len(self.storage.outbox)
+
+    def pending_sync(self, limit: int = 100) -> List[int]:
+        """ID пользователей из очереди отправки (в порядке постановки)"""
+        result = []
+        for user_id in self.storage.outbox:
+            result.append(user_id)
+            if len(result) >= limit:
+                break
+        return result
+
+    def get_sync_payload(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Данные пользователя для отправки на сайт"""
+        user = self.storage.get(user_id)
+        return public_user(user) if user else None
+
+    def mark_synced(self, user_id: int, sent: Dict[str, Any]) -> bool:
+        """Подтверждение отправки одного пользователя
+
+        Снимает пользователя с очереди, только если запись не менялась
+        после того, как была взята на отправку; иначе она уйдёт ещё раз.
+        Ошибка записи пробрасывается: очередь повторит отправку позже.
+        """
+        return self._mark_synced([sent])[0]
+
+    def mark_synced_many(self, sent_users: List[Dict[str, Any]]) -> List[bool]:
+        """Отметка синхронизации для отправленных данных пользователей
+
+        Для каждого запоминается хэш отправленного содержимого (watermark),
+        по которому следующая синхронизация пропустит неизменённых.
+        Ошибка записи только логируется: пользователи уйдут следующей
+        синхронизацией.
+        """
+        try:
+            return self._mark_synced(sent_users)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи отметок синхронизации: {e}")
+            return [False] * len(sent_users)
+
+    def _mark_synced(self, sent_users: List[Dict[str, Any]]) -> List[bool]:
+        entries = []
+        unchanged = []
+        for sent in sent_users:
+            sent = public_user(sent)
+            user = self.storage.get(sent['id'])
+            same = user is not None and public_user(user) == sent
+            entries.append((sent['id'], content_hash(sent), same))
+            unchanged.append(same)
+        self.storage.mark_synced(entries)
+        return unchanged
+
+    def reject_pending(self, sent: Dict[str, Any]) -> bool:
+        """Снятие с очереди данных, которые сайт отклонил
+
+        Отметка синхронизации не меняется: пользователь остаётся в числе
+        изменённых для /sync. Если запись успела измениться, она остаётся в
+        очереди (False). Ошибка записи пробрасывается.
+        """
+        sent = public_user(sent)
+        user = self.storage.get(sent['id'])
+        if user is None or public_user(user) != sent:
+            return False
+        self.storage.mark_synced([(sent['id'], user.get('synced_hash'), True)])
+        return True
+
+    def discard_pending(self, user_id: int):
+        """Удаление из очереди отправки пользователя, которого нет в базе"""
+        self.storage.mark_synced([(user_id, None, True)])
+
+    def iter_changed(self, full: bool = False, with_phone: bool = False) -> Iterator[Dict[str, Any]]:
+        """Пользователи, изменённые после последней успешной синхронизации
+
+        full=True - все пользователи (принудительная сверка с сайтом).
+        """
+        return select_changed(self.storage.iter_users(), full=full, with_phone=with_phone)
+
+    def rebuild_stats(self) -> Dict[str, Any]:
+        """Полный пересчёт статистики по базе"""
+        self.stats = self.storage.scan_counters()
+        self.update_stats()
+        return self.stats.snapshot()
+
+    def flush_stats(self):
+        """Запись statistics.json, если счётчики изменились после прошлой записи"""
+        if self._stats_dirty:
+            self.update_stats()
+
+    def update_stats(self):
+        """Запись текущих счётчиков в statistics.json"""
+        try:
+            atomic_write_json(self.stats_file, self.stats.snapshot(), indent=2)
+            self._stats_dirty = False
+            self._stats_flushed_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"❌ Ошибка статистики: {e}")
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Получение статистики (из памяти)"""
+        return self.stats.snapshot()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Обслуживание базы пользователей бота')
+    sub = parser.add_subparsers(dest='command', required=True)
+    migrate = sub.add_parser('migrate', help='Импорт users.json и statistics.json в SQLite')
+    migrate.add_argument('--data-dir', default='data')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        sqlite_storage = SqliteStorage(args.data_dir)
+        sqlite_storage.open()  # при первом открытии импорт выполняется автоматически
+        print(f"✅ В SQLite пользователей: {sqlite_storage.count()}")
+        sqlite_storage.close()
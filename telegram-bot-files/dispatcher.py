@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - диспетчер обновлений и процессы-воркеры
+
+Один процесс Python обрабатывает обновления на одном ядре. Диспетчер
+получает обновления один раз (getUpdates или webhook) и передаёт их
+WORKERS процессам по user_id % WORKERS: обновления одного пользователя
+всегда попадают в один процесс и обрабатываются по порядку. Сам диспетчер
+обновления не разбирает - только находит отправителя в словаре.
+
+Воркер - полный SavosBotWorking без получения обновлений со своим шардом
+базы (shards.py, data/shard-<номер>); ответы в Telegram и запросы к сайту
+воркеры отправляют сами. При первом запуске база одного процесса в data/
+разбивается на шарды автоматически.
+
+/sync и /broadcast от ADMIN_IDS передаются всем воркерам: каждый выполняет
+свою часть и ведёт своё сообщение о ходе (с номером шарда), скорость
+рассылки BROADCAST_RATE делится между воркерами. /sync обычного
+пользователя и /stats rebuild относятся к его шарду. /stats показывает
+сводку по всем шардам; диспетчер раз в STATS_FLUSH_INTERVAL пишет её в
+data/statistics.json. /metrics - метрики воркера пользователя; метрики
+диспетчера - на METRICS_PORT, воркера i - на METRICS_PORT + 1 + i.
+
+    WORKERS=4 python3 dispatcher.py
+
+Упавший воркер перезапускается, обновления в его очереди сохраняются.
+
+Проверка без сети: синтетические обновления через getUpdates FakeBotRequest,
+сайт - FakeWebsite; сверяются порядок обновлений каждого пользователя,
+сводная статистика и уникальность internal_id по шардам:
+    python3 dispatcher.py bench --workers 1,2,4 --users 2000
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from database import DataDirLockedError, atomic_write_json
+from metrics import REGISTRY, metrics_server_from_env
+from shards import merged_statistics, prepare_layout, shard_of, update_user_id
+from webhook import WebhookServer, wait_for_stop_signal, webhook_settings_from_env
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_UPDATES = ['message', 'callback_query', 'inline_query']
+# Команды администраторов, которые выполняет каждый воркер для своего шарда
+FANOUT_COMMANDS = ('/sync', '/broadcast')
+POLL_TIMEOUT = 10
+
+DISPATCHED_UPDATES = REGISTRY.counter(
+    'savosbot_dispatched_updates_total', 'Обновлений передано воркерам', ['shard'])
+WORKER_RESTARTS = REGISTRY.counter('savosbot_worker_restarts_total', 'Перезапусков воркеров', ['shard'])
+
+
+class RawUpdatesBot(Bot):
+    """Bot с getUpdates без разбора обновлений в объекты telegram"""
+
+    async def get_raw_updates(self, offset: Optional[int] = None, timeout: int = POLL_TIMEOUT,
+                              allowed_updates: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return await self._post(
+            'getUpdates',
+            {'offset': offset, 'timeout': timeout, 'allowed_updates': allowed_updates},
+            read_timeout=timeout + 10
+        )
+
+
+def worker_main(index: int, count: int, data_dir: str, token: str, inbox, events, options: Dict[str, Any]):
+    """Точка входа процесса-воркера
+
+    Сигналы остановки воркер не обрабатывает: их получает диспетчер и
+    останавливает воркеры через очередь, дождавшись обработки принятого.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    port = int(os.getenv('METRICS_PORT', '9108'))
+    if port:
+        os.environ['METRICS_PORT'] = str(port + 1 + index)
+    asyncio.run(run_worker(index, count, data_dir, token, inbox, events, options))
+
+
+def _next_batch(inbox, parent: int) -> Optional[List[Dict[str, Any]]]:
+    """Следующая пачка обновлений (None - остановка или диспетчер завершился)"""
+    while True:
+        try:
+            return inbox.get(timeout=1)
+        except queue.Empty:
+            if os.getppid() != parent:
+                logger.warning("⚠️ Диспетчер завершился, воркер останавливается")
+                return None
+
+
+async def run_worker(index: int, count: int, data_dir: str, token: str, inbox, events,
+                     options: Dict[str, Any]):
+    """Шард index из count: SavosBotWorking, получающий обновления из inbox
+
+    options (для bench): fake_latency - FakeBotRequest вместо Bot API,
+    check_order - проверка порядка обновлений каждого пользователя.
+    """
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from bot_working import SavosBotWorking
+    from update_processor import PerUserUpdateProcessor
+    from webhook import start_application, stop_application
+
+    parent = os.getppid()
+    request = None
+    if options.get('fake_latency') is not None:
+        from fake_telegram import FakeBotRequest
+        request = FakeBotRequest(latency=options['fake_latency'])
+
+    started = time.monotonic()
+    bot = SavosBotWorking(data_dir, request=request, token=token, shard=(index, count))
+    application = bot.application
+    report = {'shard': index, 'pid': os.getpid(), 'processed': 0, 'out_of_order': 0, 'errors': 0}
+
+    if options.get('check_order'):
+        last_seen: Dict[Any, int] = {}
+
+        async def check_order(update, context):
+            report['processed'] += 1
+            key = PerUserUpdateProcessor.update_key(update)
+            if last_seen.get(key, -1) > update.update_id:
+                report['out_of_order'] += 1
+            last_seen[key] = update.update_id
+
+        async def count_error(update, context):
+            report['errors'] += 1
+
+        application.add_handler(TypeHandler(Update, check_order), group=-2)
+        application.add_error_handler(count_error)
+
+    await start_application(application)
+    events.put(('ready', index, round(time.monotonic() - started, 2)))
+    logger.info(f"🧩 Воркер {index + 1}/{count} готов (pid {os.getpid()})")
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            batch = await loop.run_in_executor(None, _next_batch, inbox, parent)
+            if batch is None:
+                break
+            for data in batch:
+                application.update_queue.put_nowait(Update.de_json(data, application.bot))
+    finally:
+        # Application.stop() дожидается обработки уже принятых обновлений
+        await stop_application(application)
+        if options.get('check_order'):
+            report['stats'] = bot.db.get_statistics()
+            report['internal_ids'] = [u['internal_id'] for u in bot.db.iter_users() if u.get('internal_id')]
+            report['outbox_depth'] = bot.outbox.depth
+            if request is not None:
+                report['bot_api_calls'] = dict(request.calls)
+        bot.db.close()
+    events.put(('done', index, report))
+
+
+class WorkerProcess:
+    """Процесс-воркер и его очереди: обновления (inbox) и сообщения диспетчеру (events)
+
+    Очереди у каждого воркера свои и заводятся заново, когда он падает:
+    процесс, убитый внутри get()/put(), оставляет блокировку очереди
+    занятой навсегда. Переданное упавшему воркеру теряется, как при
+    падении бота в одном процессе.
+    """
+
+    def __init__(self, index: int, context):
+        self.index = index
+        self.context = context
+        self.process = None
+        self.reset_queues()
+        # Пауза перед перезапуском растёт, пока воркер падает, не успев запуститься
+        self.restart_delay = 1.0
+        self.restart_at = 0.0
+
+    def reset_queues(self):
+        self.inbox = self.context.Queue()
+        self.events = self.context.Queue()
+
+
+class Dispatcher:
+    """Приём обновлений и раздача их воркерам по шардам пользователей"""
+
+    def __init__(self, data_dir: str = 'data', workers: Optional[int] = None, token: Optional[str] = None,
+                 request=None, get_updates_request=None, options: Optional[Dict[str, Any]] = None):
+        """request/get_updates_request - свои BaseRequest для Bot API диспетчера,
+        options - параметры воркеров (см. run_worker)
+        """
+        self.data_dir = data_dir
+        self.count = workers or int(os.getenv('WORKERS') or 0) or os.cpu_count() or 1
+        self.mode = os.getenv('BOT_MODE', 'polling')
+        self.options = options or {}
+        self.admin_ids = {
+            int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if admin_id
+        }
+        self.stats_interval = float(os.getenv('STATS_FLUSH_INTERVAL', '5'))
+
+        token = token or os.getenv('BOT_TOKEN')
+        if not token:
+            raise ValueError("❌ BOT_TOKEN не найден! Создайте файл .env")
+        self.token = token
+        self.bot = RawUpdatesBot(token, request=request, get_updates_request=get_updates_request)
+        # Разметка шардов (при первом запуске - разбиение базы одного процесса)
+        prepare_layout(self.data_dir, self.count)
+        self.metrics_server = metrics_server_from_env()
+
+        # spawn: воркер - чистый интерпретатор, без потоков и пулов диспетчера
+        self._context = multiprocessing.get_context('spawn')
+        self.workers = [WorkerProcess(index, self._context) for index in range(self.count)]
+        self.ready: Dict[int, float] = {}
+        self.reports: Dict[int, Dict[str, Any]] = {}
+        self.dispatched = 0
+        self._stopping = False
+        self._tasks = set()
+        self._all_done = asyncio.Event()
+
+        REGISTRY.gauge('savosbot_workers_alive', 'Работающих воркеров', func=lambda: sum(
+            1 for worker in self.workers if worker.process is not None and worker.process.is_alive()
+        ))
+
+    def _start_worker(self, worker: WorkerProcess):
+        worker.process = self._context.Process(
+            target=worker_main,
+            args=(worker.index, self.count, self.data_dir, self.token, worker.inbox, worker.events, self.options),
+            name=f'savosbot-worker-{worker.index}'
+        )
+        worker.process.start()
+
+    def _spawn(self, coro, name: str):
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def is_fanout(self, data: Dict[str, Any]) -> bool:
+        """Команда администратора, которую выполняют все воркеры"""
+        message = data.get('message')
+        if not message or not self.admin_ids:
+            return False
+        text = message.get('text') or ''
+        if not text.startswith('/'):
+            return False
+        command = text.split(maxsplit=1)[0].split('@')[0]
+        return command in FANOUT_COMMANDS and (message.get('from') or {}).get('id') in self.admin_ids
+
+    def dispatch(self, updates: List[Dict[str, Any]]):
+        """Раздача пачки обновлений: одна запись в очередь на воркер"""
+        batches: List[List[Dict[str, Any]]] = [[] for _ in range(self.count)]
+        for data in updates:
+            if self.is_fanout(data):
+                for batch in batches:
+                    batch.append(data)
+            else:
+                batches[shard_of(update_user_id(data), self.count)].append(data)
+        for index, batch in enumerate(batches):
+            if batch:
+                self.workers[index].inbox.put(batch)
+                DISPATCHED_UPDATES.inc(len(batch), shard=str(index))
+        self.dispatched += len(updates)
+
+    def _receive_events(self):
+        """Сообщения воркеров: готовность и итог работы (без ожидания)"""
+        for worker in self.workers:
+            try:
+                while True:
+                    self._on_event(*worker.events.get_nowait())
+            except queue.Empty:
+                pass
+
+    def _on_event(self, kind: str, index: int, payload):
+        if kind == 'ready':
+            self.ready[index] = payload
+            self.workers[index].restart_delay = 1.0
+            if len(self.ready) == self.count:
+                logger.info(f"🧩 Все воркеры готовы ({self.count}), загрузка шардов: "
+                            f"до {max(self.ready.values()):.2f} с")
+        elif kind == 'done':
+            self.reports[index] = payload
+            if len(self.reports) == self.count:
+                self._all_done.set()
+
+    async def _watch_workers(self):
+        """Сообщения воркеров и перезапуск упавших"""
+        checked_at = 0.0
+        while True:
+            await asyncio.sleep(0.05)
+            self._receive_events()
+            now = time.monotonic()
+            if now - checked_at < 1:
+                continue
+            checked_at = now
+            for worker in self.workers:
+                if self._stopping or worker.process.is_alive():
+                    continue
+                if not worker.restart_at:
+                    # Новые очереди сразу: обновления на время паузы дождутся нового процесса
+                    self._receive_events()
+                    worker.reset_queues()
+                    # Упал до готовности - вероятно, ошибка запуска: пауза удваивается
+                    started = worker.index in self.ready
+                    delay = 1.0 if started else worker.restart_delay
+                    worker.restart_delay = 1.0 if started else min(worker.restart_delay * 2, 60.0)
+                    worker.restart_at = now + delay
+                    self.ready.pop(worker.index, None)
+                    logger.error(f"❌ Воркер {worker.index} завершился (код {worker.process.exitcode}), "
+                                 f"перезапуск через {delay:.0f} с")
+                if now >= worker.restart_at:
+                    worker.restart_at = 0.0
+                    WORKER_RESTARTS.inc(shard=str(worker.index))
+                    self._start_worker(worker)
+
+    async def _write_statistics(self):
+        """Сводная статистика шардов в data/statistics.json"""
+        path = os.path.join(self.data_dir, 'statistics.json')
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            try:
+                stats = await asyncio.to_thread(merged_statistics, self.data_dir)
+                await asyncio.to_thread(atomic_write_json, path, stats, indent=2)
+            except Exception as e:
+                logger.error(f"❌ Ошибка сводной статистики: {e}")
+
+    async def start(self):
+        """Запуск воркеров и фоновых задач"""
+        for worker in self.workers:
+            self._start_worker(worker)
+        self._spawn(self._watch_workers(), 'worker-watch')
+        self._spawn(self._write_statistics(), 'merged-stats')
+        await self.bot.initialize()
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.warning(f"⚠️ Адрес метрик недоступен: {e}")
+                self.metrics_server = None
+
+    async def poll(self):
+        """getUpdates до отмены задачи; обновления раздаются без разбора"""
+        await self.bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        delay = 1.0
+        while True:
+            try:
+                updates = await self.bot.get_raw_updates(offset, allowed_updates=ALLOWED_UPDATES)
+                delay = 1.0
+            except TelegramError as e:
+                logger.warning(f"⚠️ getUpdates: {e}, повтор через {delay:.0f} с")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            if updates:
+                self.dispatch(updates)
+                offset = updates[-1]['update_id'] + 1
+
+    async def _start_webhook(self) -> WebhookServer:
+        settings = webhook_settings_from_env()
+        if not settings['secret_token']:
+            logger.warning("⚠️ WEBHOOK_SECRET не задан - запросы к webhook не проверяются")
+        server = WebhookServer(listen=settings['listen'], port=settings['port'],
+                               secret_token=settings['secret_token'])
+        server.add_handler(settings['path'], lambda data: self.dispatch([data]))
+        await server.start()
+        if settings['webhook_url']:
+            url = f"{settings['webhook_url'].rstrip('/')}{settings['path']}"
+            await self.bot.set_webhook(url=url, secret_token=settings['secret_token'],
+                                       allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
+            logger.info(f"🔗 Webhook установлен: {url}")
+        return server
+
+    async def stop(self, timeout: float = 60.0):
+        """Остановка воркеров после обработки всего, что им передано"""
+        self._stopping = True
+        for worker in self.workers:
+            worker.inbox.put(None)
+        deadline = time.monotonic() + timeout
+        while not self._all_done.is_set():
+            waiting = [w for w in self.workers if w.index not in self.reports]
+            if time.monotonic() > deadline or not any(w.process.is_alive() for w in waiting):
+                logger.error(f"❌ Воркеры не завершили работу: {[w.index for w in waiting]}")
+                break
+            await asyncio.sleep(0.1)
+        for worker in self.workers:
+            await asyncio.to_thread(worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        stats = merged_statistics(self.data_dir)
+        atomic_write_json(os.path.join(self.data_dir, 'statistics.json'), stats, indent=2)
+        await self.bot.shutdown()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
+    async def serve(self):
+        """Работа до сигнала остановки"""
+        server = None
+        poller = None
+        await self.start()
+        try:
+            if self.mode == 'webhook':
+                server = await self._start_webhook()
+            else:
+                poller = self._spawn(self.poll(), 'poll')
+            logger.info(f"🚀 Диспетчер: воркеров {self.count}, режим: {self.mode}")
+            await wait_for_stop_signal()
+        finally:
+            if poller:
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+            if server:
+                await server.stop()
+            await self.stop()
+            logger.info(f"🛑 Диспетчер остановлен, передано обновлений: {self.dispatched}")
+
+
+def bench_updates(users: int, start_id: int = 1) -> List[Dict[str, Any]]:
+    """Сценарий регистрации: /start, контакт, телефон текстом, /stats
+
+    Пользователи чередуются, поэтому обновления одного пользователя идут
+    вперемешку с чужими - как при наплыве после рекламы.
+    """
+    from fake_telegram import SyntheticUpdates
+
+    generator = SyntheticUpdates()
+    ids = range(start_id, start_id + users)
+    steps = [
+        lambda uid: generator.command(uid, '/start'),
+        lambda uid: generator.contact(uid) if uid % 2 else generator.text(uid, f'+7 999 {uid:07d}'),
+        lambda uid: generator.command(uid, '/stats'),
+    ]
+    return [step(uid) for step in steps for uid in ids]
+
+
+async def run_bench(workers: int, users: int, data_dir: str, latency: float) -> Dict[str, Any]:
+    """Один прогон: диспетчер с polling FakeBotRequest и workers воркерами"""
+    from fake_telegram import FakeBotRequest
+
+    request = FakeBotRequest(latency=latency)
+    dispatcher = Dispatcher(data_dir, workers=workers, token='123456:bench', request=request,
+                            get_updates_request=request, options={'fake_latency': latency, 'check_order': True})
+    updates = bench_updates(users)
+    await dispatcher.start()
+    deadline = time.monotonic() + 300
+    while len(dispatcher.ready) < workers:
+        if time.monotonic() > deadline:
+            await dispatcher.stop(timeout=10)
+            raise RuntimeError(f"❌ Запущено воркеров: {len(dispatcher.ready)} из {workers}")
+        await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    request.updates.extend(updates)
+    poller = dispatcher._spawn(dispatcher.poll(), 'poll')
+    while dispatcher.dispatched < len(updates):
+        await asyncio.sleep(0.01)
+    poller.cancel()
+    await asyncio.gather(poller, return_exceptions=True)
+    await dispatcher.stop(timeout=600)
+    elapsed = time.perf_counter() - started
+
+    reports = [dispatcher.reports[index] for index in sorted(dispatcher.reports)]
+    internal_ids = [i for report in reports for i in report.pop('internal_ids')]
+    merged = merged_statistics(data_dir)
+    return {
+        'workers': workers,
+        'users': users,
+        'updates': len(updates),
+        'elapsed_s': round(elapsed, 2),
+        'throughput_per_s': round(len(updates) / elapsed, 1),
+        'load_s': max(dispatcher.ready.values(), default=0.0),
+        'processed': sum(r['processed'] for r in reports),
+        'out_of_order': sum(r['out_of_order'] for r in reports),
+        'errors': sum(r['errors'] for r in reports),
+        'duplicate_internal_ids': len(internal_ids) - len(set(internal_ids)),
+        'merged_stats': {k: merged[k] for k in ('total_users', 'registered_users', 'shards')},
+        'per_worker': [
+            {'shard': r['shard'], 'processed': r['processed'], 'users': r['stats']['total_users']}
+            for r in reports
+        ],
+    }
+
+
+def bench(args):
+    """Сравнение пропускной способности для разного числа воркеров"""
+    from fake_website import FakeWebsite
+
+    website = FakeWebsite()
+    os.environ['WEBSITE_URL'] = website.start_in_thread()
+    os.environ.setdefault('METRICS_PORT', '0')
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='savos-dispatch-')
+    results = []
+    try:
+        for workers in [int(n) for n in args.workers.split(',') if n]:
+            print(f"⏱️ Воркеров: {workers}, пользователей: {args.users}...", file=sys.stderr)
+            data_dir = os.path.join(work_dir, f'workers-{workers}')
+            result = asyncio.run(run_bench(workers, args.users, data_dir, args.latency))
+            results.append(result)
+            print(f"   {result['throughput_per_s']:>8.1f} обновл/с за {result['elapsed_s']} с, "
+                  f"не по порядку: {result['out_of_order']}, ошибок: {result['errors']}, "
+                  f"повторных internal_id: {result['duplicate_internal_ids']}, "
+                  f"сводно пользователей: {result['merged_stats']['total_users']}", file=sys.stderr)
+    finally:
+        website.stop_thread()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'benchmark': 'dispatcher', 'cpu_count': os.cpu_count(), 'latency_s': args.latency,
+              'results': results}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if any(r['out_of_order'] or r['duplicate_internal_ids'] or r['processed'] != r['updates'] for r in results):
+        raise SystemExit(1)
+
+
+def main():
+    from dotenv import load_dotenv
+    from logging_setup import setup_logging
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Диспетчер обновлений SavosBot и воркеры по шардам')
+    sub = parser.add_subparsers(dest='command')
+    bench_parser = sub.add_parser('bench', help='Проверка на синтетических обновлениях без сети')
+    bench_parser.add_argument('--workers', default='1,2,4', help='Количество воркеров через запятую')
+    bench_parser.add_argument('--users', type=int, default=2000)
+    bench_parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа Bot API, с')
+    bench_parser.add_argument('--work-dir', help='Каталог для баз (по умолчанию временный)')
+    bench_parser.add_argument('--keep', action='store_true', help='Не удалять созданные базы')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        # Воркеры наследуют окружение: без журнала каждого обновления
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        setup_logging()
+        bench(args)
+        return
+
+    setup_logging()
+
+    try:
+        dispatcher = Dispatcher()
+    except (ValueError, DataDirLockedError) as e:
+        logger.error(str(e))
+        raise SystemExit(1)
+    asyncio.run(dispatcher.serve())
+
+
+if __name__ == '__main__':
+    main()
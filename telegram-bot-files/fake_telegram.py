@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - имитация Bot API без сети
+
+FakeBotRequest подставляется в Application.builder().request(...) и
+отвечает на запросы бота заранее заготовленными данными, SyntheticUpdates
+генерирует обновления Telegram (команды, контакты, текст). Используется
+бенчмарками и локальными проверками обработчиков.
+
+Очередь updates - ответы на getUpdates: обновления из SyntheticUpdates,
+положенные в неё, бот получает обычным polling (dispatcher.py bench).
+
+Для проверки рассылки FakeBotRequest умеет отвечать как Telegram на
+заблокировавших бота пользователей (403) и на превышение лимитов
+отправки (429 с retry_after) - общего и на один чат.
+"""
+
+import json
+import time
+import asyncio
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Iterable, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+
+class FakeBotRequest(BaseRequest):
+    """Ответы Bot API из памяти с необязательной задержкой
+
+    blocked - id чатов, заблокировавших бота; rate_limit - сообщений в
+    секунду на весь бот (0 - без лимита); chat_interval - минимальная пауза
+    между сообщениями в один чат.
+    """
+
+    SEND_ENDPOINTS = ('sendMessage', 'editMessageText')
+
+    def __init__(self, latency: float = 0.0, bot_id: int = 1, username: str = 'savos_bench_bot',
+                 blocked: Iterable[int] = (), rate_limit: float = 0.0, chat_interval: float = 0.0):
+        self.latency = latency
+        self.bot_id = bot_id
+        self.username = username
+        self.blocked = set(blocked)
+        self.rate_limit = rate_limit
+        self.chat_interval = chat_interval
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.delivered: Counter = Counter()  # chat_id -> доставленных сообщений
+        self._message_id = 0
+        self._tokens = max(1.0, rate_limit)
+        self._refilled_at = time.monotonic()
+        self._chat_sent: Dict[int, float] = {}
+        self.updates: Deque[Dict[str, Any]] = deque()  # ответы на getUpdates
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return 5.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if endpoint == 'getUpdates' and not self.updates:
+            # Короткое ожидание вместо long polling
+            await asyncio.sleep(0.05)
+        if endpoint in self.SEND_ENDPOINTS:
+            error = self._limit_error(params.get('chat_id'))
+            if error:
+                self.errors[error[0]] += 1
+                return error[0], json.dumps({'ok': False, **error[1]}).encode('utf-8')
+            if endpoint == 'sendMessage':
+                self.delivered[params.get('chat_id')] += 1
+        result = self._result(endpoint, params)
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+    def _limit_error(self, chat_id) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Ответ Telegram на заблокированный чат или превышение лимита"""
+        if chat_id in self.blocked:
+            return 403, {'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+
+        now = time.monotonic()
+        if self.chat_interval:
+            sent = self._chat_sent.get(chat_id)
+            if sent is not None and now - sent < self.chat_interval:
+                retry_after = max(1, round(self.chat_interval - (now - sent)))
+                return 429, {
+                    'error_code': 429, 'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after}
+                }
+        if self.rate_limit:
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return 429, {
+                    'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                    'parameters': {'retry_after': 1}
+                }
+            self._tokens -= 1
+        if self.chat_interval:
+            self._chat_sent[chat_id] = now
+        return None
+
+    def _result(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        if endpoint == 'getMe':
+            return {'id': self.bot_id, 'is_bot': True, 'first_name': 'SavosBot', 'username': self.username}
+        if endpoint in ('sendMessage', 'editMessageText'):
+            self._message_id += 1
+            return {
+                'message_id': params.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+                'text': params.get('text', '')
+            }
+        if endpoint == 'getUserProfilePhotos':
+            user_id = params.get('user_id', 0)
+            return {'total_count': 1, 'photos': [[{
+                'file_id': f'photo-{user_id}', 'file_unique_id': f'u-{user_id}', 'width': 160, 'height': 160
+            }]]}
+        if endpoint == 'getUpdates':
+            limit = params.get('limit') or 100
+            return [self.updates.popleft() for _ in range(min(limit, len(self.updates)))]
+        if endpoint == 'getFile':
+            file_id = params.get('file_id', '')
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_path': f'photos/{file_id}.jpg'}
+        return True
+
+
+class SyntheticUpdates:
+    """Генератор обновлений в формате Bot API (словари для Update.de_json)"""
+
+    def __init__(self):
+        self._update_id = 0
+
+    def message(self, user_id: int, text: Optional[str] = None,
+                contact: Optional[str] = None) -> Dict[str, Any]:
+        self._update_id += 1
+        message = {
+            'message_id': self._update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {
+                'id': user_id, 'is_bot': False,
+                'first_name': f'User{user_id}', 'username': f'user{user_id}'
+            }
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if contact is not None:
+            message['contact'] = {'phone_number': contact, 'first_name': f'User{user_id}', 'user_id': user_id}
+        return {'update_id': self._update_id, 'message': message}
+
+    def command(self, user_id: int, command: str) -> Dict[str, Any]:
+        return self.message(user_id, text=command)
+
+    def contact(self, user_id: int, phone: Optional[str] = None) -> Dict[str, Any]:
+        return self.message(user_id, contact=phone or synthetic_phone(user_id))
+
+    def text(self, user_id: int, text: str) -> Dict[str, Any]:
+        return self.message(user_id, text=text)
+
+
+def synthetic_phone(user_id: int) -> str:
+    """Уникальный номер телефона для синтетического пользователя"""
+    return f"7{user_id % 10**10:010d}"
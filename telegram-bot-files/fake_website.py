@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - локальная замена сайта для проверки синхронизации
+
+Повторяет API сайта, которым пользуется бот (/api/health, /api/users,
+/api/sync-bot-users), хранит пользователей в памяти и умеет имитировать
+проблемы: задержку ответа, долю ошибок 500 и ограничение частоты (429).
+
+Запуск отдельным процессом:
+    python3 fake_website.py --port 8765 --latency 0.05 --error-rate 0.05 --rate-limit 200
+    WEBSITE_URL=http://127.0.0.1:8765 python3 sync_users_to_website.py --full
+
+GET /api/fake/stats - счётчики запросов и ответов, POST /api/fake/reset - сброс.
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class FakeWebsite:
+    """Сайт в памяти с настраиваемыми задержками, ошибками и лимитом запросов"""
+
+    def __init__(self, api_key: str = 'savosbot2024', latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_limit: float = 0.0, burst: Optional[int] = None,
+                 batch: bool = True, seed: Optional[int] = None):
+        self.api_key = api_key
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit  # запросов в секунду, 0 - без ограничения
+        self.burst = burst or max(1, int(rate_limit))
+        self.batch = batch
+        self.random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self.reset()
+
+    def reset(self):
+        """Сброс пользователей и счётчиков"""
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.requests: Counter = Counter()
+        self.responses: Counter = Counter()
+        self.writes = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'users': len(self.users),
+            'writes': self.writes,
+            'requests': dict(self.requests),
+            'responses': {str(status): count for status, count in self.responses.items()},
+            'peak_in_flight': self.peak_in_flight
+        }
+
+    def _take_token(self) -> bool:
+        """Ограничение частоты: корзина токенов на весь сайт"""
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_limit)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        """Общая обработка: счётчики, лимит, задержка, случайные ошибки"""
+        self.requests[request.path] += 1
+        if request.path.startswith('/api/fake/'):
+            return await handler(request)
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if not self._take_token():
+                response = web.json_response(
+                    {'error': 'Too many requests'}, status=429,
+                    headers={'Retry-After': str(max(1, round(1 / self.rate_limit)))}
+                )
+            else:
+                delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+                if delay:
+                    await asyncio.sleep(delay)
+                if self.error_rate and self.random.random() < self.error_rate:
+                    response = web.json_response({'error': 'Database error'}, status=500)
+                else:
+                    try:
+                        response = await handler(request)
+                    except web.HTTPException as e:
+                        # 404/405 для отсутствующих путей тоже попадают в счётчики
+                        self.responses[e.status] += 1
+                        raise
+        finally:
+            self.in_flight -= 1
+        self.responses[response.status] += 1
+        return response
+
+    def _authorized(self, request: web.Request) -> bool:
+        return request.headers.get('Authorization') == f'Bearer {self.api_key}'
+
+    def _store(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        telegram_id = user.get('id') or user.get('telegram_id')
+        stored = self.users.get(telegram_id)
+        if stored is None:
+            stored = self.users[telegram_id] = {'site_id': len(self.users) + 1}
+        stored.update(user)
+        self.writes += 1
+        return stored
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'OK',
+            'message': 'SavosBot Club API (fake) is running',
+            'timestamp': datetime.now().isoformat(),
+            'version': 'fake'
+        })
+
+    async def post_user(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({'error': 'Unauthorized'}, status=401)
+        try:
+            user = await request.json()
+        except ValueError:
+            return web.json_response({'error': 'Invalid JSON'}, status=400)
+        if not isinstance(user, dict) or not user.get('id') or not user.get('source'):
+            return web.json_response({'error': 'Invalid user data'}, status=400)
+
+        created = user['id'] not in self.users
+        stored = self._store(user)
+        return web.json_response({
+            'status': 'success',
+            'message': 'User created' if created else 'User updated',
+            'user_id': stored['site_id'],
+            'internal_id': stored['site_id'],
+            'timestamp': datetime.now().isoformat()
+        })
+
+    async def sync_users(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({'error': 'Invalid JSON'}, status=400)
+        users = body.get('users', body) if isinstance(body, dict) else body
+        users = users if isinstance(users, list) else [users]
+        if not users:
+            return web.json_response({'error': 'No users provided'}, status=400)
+
+        synced = updated = errors = 0
+        for user in users:
+            if not isinstance(user, dict) or not (user.get('id') or user.get('telegram_id')):
+                errors += 1
+                continue
+            if (user.get('id') or user.get('telegram_id')) in self.users:
+                updated += 1
+            else:
+                synced += 1
+            self._store(user)
+        return web.json_response({
+            'success': True, 'synced': synced, 'updated': updated, 'errors': errors, 'total': len(users)
+        })
+
+    async def fake_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def fake_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({'status': 'reset'})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/api/health', self.health)
+        app.router.add_post('/api/users', self.post_user)
+        if self.batch:
+            app.router.add_post('/api/sync-bot-users', self.sync_users)
+        app.router.add_get('/api/fake/stats', self.fake_stats)
+        app.router.add_post('/api/fake/reset', self.fake_reset)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765) -> str:
+        """Запуск в текущем цикле событий; возвращает адрес сайта"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        # port=0 - свободный порт, выбранный системой
+        port = self._runner.addresses[0][1]
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск в отдельном потоке со своим циклом событий
+
+        Так сайт не делит цикл событий с проверяемым клиентом и не искажает
+        его замеры. Возвращает адрес сайта.
+        """
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        result = {}
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                result['url'] = self._loop.run_until_complete(self.start(host, port))
+            except Exception as e:
+                result['error'] = e
+                return
+            finally:
+                started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='fake-website', daemon=True)
+        self._thread.start()
+        started.wait()
+        if 'error' in result:
+            raise result['error']
+        return result['url']
+
+    def stop_thread(self):
+        """Остановка сайта, запущенного start_in_thread"""
+        if not self._thread:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+
+
+def add_fault_arguments(parser):
+    """Общие параметры имитации для сервера и нагрузочного теста"""
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Случайная добавка к задержке (0..jitter), с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500 (0..1)')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Запросов в секунду до ответов 429 (0 - без лимита)')
+    parser.add_argument('--burst', type=int, default=None, help='Запас запросов сверх лимита')
+    parser.add_argument('--no-batch', action='store_true', help='Без /api/sync-bot-users (404, как у старого сайта)')
+    parser.add_argument('--seed', type=int, default=None, help='Зерно генератора ошибок')
+
+
+def website_from_args(args, api_key: str) -> FakeWebsite:
+    return FakeWebsite(
+        api_key=api_key, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, burst=args.burst, batch=not args.no_batch, seed=args.seed
+    )
+
+
+if __name__ == '__main__':
+    import os
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Локальная замена сайта SavosBot Club')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--api-key', default=os.getenv('API_KEY', 'savosbot2024'))
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    async def serve():
+        website = website_from_args(args, args.api_key)
+        url = await website.start(args.host, args.port)
+        logger.info(f"🧪 Тестовый сайт: {url}")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                logger.info(f"📊 {website.stats()}")
+        finally:
+            await website.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - нагрузочный тест синхронизации с сайтом
+
+Создаёт базу из N синтетических пользователей, поднимает локальный
+FakeWebsite (или использует --url) и прогоняет полную синхронизацию тем же
+путём, что бот и sync_users_to_website.py: DatabaseManager + BulkSyncer +
+отметки синхронизации. Перебирает комбинации --concurrency и --batch-size,
+чтобы подобрать настройки без нагрузки на рабочий сайт.
+
+    python3 loadtest_sync.py --users 100000 --concurrency 4,8,16 --batch-size 1,100 \\
+        --latency 0.02 --error-rate 0.02 --rate-limit 500 --output sync-load.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import logging
+import platform
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from database import DatabaseManager
+from website import WebsiteConnection, BulkSyncer
+from fake_website import add_fault_arguments, website_from_args
+from bench_handlers import populate, peak_rss_mb, git_revision
+
+
+def int_list(value: str):
+    return [int(v) for v in value.split(',') if v]
+
+
+async def fetch_site_stats(website: WebsiteConnection) -> Optional[Dict[str, Any]]:
+    """Счётчики тестового сайта (у настоящего сайта их нет)"""
+    try:
+        async with website.session.get(f"{website.website_url}/api/fake/stats") as response:
+            if response.status == 200:
+                return await response.json()
+    except Exception:
+        pass
+    return None
+
+
+async def reset_site(website: WebsiteConnection):
+    try:
+        await website.post_json('/api/fake/reset', {})
+    except Exception:
+        pass
+
+
+async def run_once(base_dir: str, run_dir: str, url: str, api_key: str, users: int,
+                   concurrency: int, batch_size: int, args) -> Dict[str, Any]:
+    """Одна полная синхронизация на свежей копии базы"""
+    shutil.rmtree(run_dir, ignore_errors=True)
+    shutil.copytree(base_dir, run_dir)
+
+    started = time.perf_counter()
+    db = DatabaseManager(run_dir)
+    db.initialize()
+    load_seconds = time.perf_counter() - started
+
+    website = WebsiteConnection(url, api_key, timeout=args.timeout, pool_size=concurrency)
+    syncer = BulkSyncer(
+        website,
+        concurrency=concurrency,
+        batch_size=batch_size,
+        retries=args.retries,
+        retry_delay=args.retry_delay
+    )
+
+    await website.start()
+    try:
+        await reset_site(website)
+        async with db.deferred_sync_marks():
+            report = await syncer.sync(
+                db.iter_users_async(source=lambda: db.iter_changed(full=True)),
+                on_synced=lambda synced: db.run(db.mark_synced_many, synced)
+            )
+        site_stats = await fetch_site_stats(website)
+    finally:
+        await website.close()
+        db.close()
+    end_to_end = time.perf_counter() - started
+
+    return {
+        'users': users,
+        'storage': os.environ.get('DB_STORAGE', 'json'),
+        'concurrency': concurrency,
+        'batch_size': batch_size,
+        'retries': args.retries,
+        'timeout_s': args.timeout,
+        'total': report.total,
+        'succeeded': report.succeeded,
+        'failed': report.failed,
+        'requests': report.requests,
+        'retried_requests': report.retries,
+        'sync_s': round(report.elapsed, 3),
+        'users_per_s': round(report.rate, 1),
+        'load_s': round(load_seconds, 3),
+        'end_to_end_s': round(end_to_end, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'site': site_stats
+    }
+
+
+async def main_async(args) -> Dict[str, Any]:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='savos-sync-load-')
+    base_dir = os.path.join(work_dir, 'base')
+    run_dir = os.path.join(work_dir, 'run')
+
+    storage = os.environ.setdefault('DB_STORAGE', args.storage)
+    if not os.path.exists(base_dir):
+        print(f"🧪 Создание базы: {args.users} пользователей ({storage})...", file=sys.stderr)
+        populate(base_dir, storage, args.users, registered_share=1.0)
+
+    fake = None
+    url = args.url
+    if not url:
+        fake = website_from_args(args, args.api_key)
+        url = fake.start_in_thread('127.0.0.1', 0)
+
+    report = {
+        'benchmark': 'sync',
+        'revision': git_revision(),
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'url': url if args.url else 'fake',
+        'faults': {
+            'latency_s': args.latency, 'jitter_s': args.jitter, 'error_rate': args.error_rate,
+            'rate_limit_per_s': args.rate_limit, 'batch_endpoint': not args.no_batch
+        },
+        'results': []
+    }
+    try:
+        for concurrency in int_list(args.concurrency):
+            for batch_size in int_list(args.batch_size):
+                result = await run_once(
+                    base_dir, run_dir, url, args.api_key, args.users, concurrency, batch_size, args
+                )
+                report['results'].append(result)
+                print(
+                    f"   concurrency={concurrency:<3} batch={batch_size:<4} "
+                    f"{result['users_per_s']:>8.1f} польз/с  всего {result['end_to_end_s']:.1f} с  "
+                    f"запросов {result['requests']}, повторов {result['retried_requests']}, "
+                    f"ошибок {result['failed']}",
+                    file=sys.stderr
+                )
+    finally:
+        if fake:
+            fake.stop_thread()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест синхронизации с сайтом')
+    parser.add_argument('--users', type=int, default=10000, help='Пользователей в базе')
+    parser.add_argument('--storage', default='json', choices=['json', 'journal', 'sqlite'],
+                        help='Движок хранения (если DB_STORAGE не задан)')
+    parser.add_argument('--concurrency', default='8', help='Одновременных запросов (через запятую - перебор)')
+    parser.add_argument('--batch-size', default='1', help='Пользователей в запросе (через запятую - перебор)')
+    parser.add_argument('--retries', type=int, default=3, help='Повторов на запрос')
+    parser.add_argument('--retry-delay', type=float, default=0.5, help='Начальная пауза между повторами, с')
+    parser.add_argument('--timeout', type=float, default=10, help='Таймаут запроса, с')
+    parser.add_argument('--url', help='Адрес сайта вместо встроенного тестового')
+    parser.add_argument('--api-key', default=os.getenv('API_KEY', 'savosbot2024'))
+    parser.add_argument('--work-dir', help='Каталог для баз (по умолчанию временный)')
+    parser.add_argument('--keep', action='store_true', help='Не удалять созданные базы')
+    parser.add_argument('--output', help='Файл для JSON-результата (по умолчанию stdout)')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.ERROR)
+
+    report = asyncio.run(main_async(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"💾 Результаты: {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
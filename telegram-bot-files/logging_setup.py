@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - логирование бота
+
+Записи только кладутся в очередь (без форматирования и без ожидания), а
+форматирование, маскировка и вывод идут в отдельном потоке (QueueListener):
+медленный stdout/диск не задерживает цикл событий. При переполнении
+очереди (LOG_QUEUE_SIZE) записи отбрасываются, а не блокируют обработчики.
+
+Структурированные записи - постоянное сообщение и поля:
+
+    logger.info("✅ Пользователь сохранён", extra=hot(user_id=user_id))
+
+Сообщение форматируется только если уровень включён, поля выводятся как
+key=value (LOG_FORMAT=text) или в JSON-строке (LOG_FORMAT=json). Поля phone
+маскируются, поле text заменяется длиной; номера телефонов и токены ботов
+маскируются и в тексте сообщений (в том числе сторонних библиотек).
+
+Записи горячего пути (extra=hot(...)) прореживаются по уровням:
+LOG_SAMPLE="INFO=0.1,DEBUG=0.01" - доля сохраняемых записей.
+
+LOG_MODE=production: JSON, уровень по умолчанию WARNING, без поиска места
+вызова и сведений о потоках/процессах в записях, без логов httpx о каждом
+запросе. LOG_LEVEL задаёт уровень явно.
+"""
+
+import os
+import re
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from metrics import LOG_RECORDS_DROPPED
+
+# Последовательность цифр, похожая на телефон: от 11 цифр или от 10 с «+»
+# (10-значные id пользователей, даты и id групп «-100...» не трогаем)
+_PHONE = re.compile(r'(?<![\w+\-])\+?\d[\d \-()]{8,}\d(?!\w)')
+_BOT_TOKEN = re.compile(r'bot\d+:[\w-]{20,}')
+
+
+def kv(**fields) -> Dict[str, Any]:
+    """extra для структурированной записи: logger.info(msg, extra=kv(...))"""
+    return {'fields': fields}
+
+
+def hot(**fields) -> Dict[str, Any]:
+    """extra для записи горячего пути (прореживается по LOG_SAMPLE)"""
+    return {'fields': fields, 'hot': True}
+
+
+def mask_phone(value: str) -> str:
+    """+79991234567 -> +*********67"""
+    digits = re.sub(r'\D', '', value)
+    return ('+' if value.lstrip().startswith('+') else '') + '*' * max(len(digits) - 2, 0) + digits[-2:]
+
+
+def _mask_match(match: re.Match) -> str:
+    value = match.group(0)
+    digits = sum(c.isdigit() for c in value)
+    if digits < (10 if value.startswith('+') else 11):
+        return value
+    return mask_phone(value)
+
+
+def redact(text: str) -> str:
+    """Маскировка телефонов и токенов ботов в произвольном тексте"""
+    if 'bot' in text:
+        text = _BOT_TOKEN.sub('bot<token>', text)
+    return _PHONE.sub(_mask_match, text)
+
+
+def redact_field(name: str, value: Any) -> Any:
+    if value is None:
+        return value
+    if name == 'phone':
+        return mask_phone(str(value))
+    if name == 'text':
+        return f"<{len(str(value))} симв.>"
+    if isinstance(value, str):
+        return redact(value)
+    return value
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """'INFO=0.1,DEBUG=0' -> {logging.INFO: 0.1, logging.DEBUG: 0.0}"""
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, rate = part.partition('=')
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Неизвестный уровень в LOG_SAMPLE: {name}")
+        rates[level] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживание записей горячего пути по уровням"""
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rates or not getattr(record, 'hot', False):
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.inc(reason='sampled')
+        return False
+
+
+class StructuredFormatter(logging.Formatter):
+    """Текст 'время - уровень - сообщение key=value' или JSON-строка, с маскировкой"""
+
+    def __init__(self, json_output: bool = False):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = redact(record.getMessage())
+        fields = {name: redact_field(name, value) for name, value in getattr(record, 'fields', {}).items()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if self.json_output:
+            data = {
+                'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                'level': record.levelname,
+                'logger': record.name,
+                'msg': message,
+                **fields,
+            }
+            if record.exc_text:
+                data['exc'] = redact(record.exc_text)
+            return json.dumps(data, ensure_ascii=False, default=str)
+
+        text = f"{self.formatTime(record)} - {record.levelname} - {message}"
+        if fields:
+            text += ' ' + ' '.join(f"{name}={value}" for name, value in fields.items())
+        if record.exc_text:
+            text += '\n' + redact(record.exc_text)
+        return text
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Постановка записи в очередь без форматирования и без ожидания
+
+    Стандартный QueueHandler форматирует сообщение в вызывающем потоке;
+    здесь запись передаётся как есть и форматируется в потоке вывода
+    (аргументы сообщений и поля - неизменяемые значения).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason='overflow')
+
+
+def setup_logging() -> Optional[logging.handlers.QueueListener]:
+    """Настройка логирования из переменных окружения
+
+    Если корневой логгер уже настроен (скрипты, бенчмарки), ничего не
+    меняет и возвращает None. Поток вывода останавливается при выходе,
+    оставшиеся в очереди записи дописываются.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+
+    production = os.getenv('LOG_MODE', '').lower() == 'production'
+    level = os.getenv('LOG_LEVEL', 'WARNING' if production else 'INFO').upper()
+    json_output = os.getenv('LOG_FORMAT', 'json' if production else 'text').lower() == 'json'
+
+    if production:
+        # Меньше работы на каждую запись (см. «Optimization» в Logging HOWTO)
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        logging.logAsyncioTasks = False
+        logging.raiseExceptions = False
+        # httpx пишет INFO на каждый запрос к Bot API
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter(json_output))
+
+    log_queue = queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv('LOG_SAMPLE', ''))))
+
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - метрики работы бота
+
+Счётчики, гистограммы и показатели (gauge) без внешних зависимостей.
+Отдаются в текстовом формате Prometheus с локального HTTP-адреса
+(METRICS_PORT, по умолчанию 127.0.0.1:9108) и кратко - командой /metrics
+для администраторов (ADMIN_IDS).
+
+Все метрики регистрируются в общем реестре REGISTRY; обновлять их можно
+из любого потока (включая поток базы данных).
+"""
+
+import os
+import math
+import time
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин по умолчанию (секунды): от 0.5 мс до 30 с
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    # Формат Prometheus различает регистр: NaN, +Inf, -Inf
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def _samples(self) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+            for key, value in self.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Текущее значение: задаётся set() или вычисляется функцией при выдаче"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 func: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._funcs: Dict[Tuple[str, ...], Callable[[], float]] = {}
+        if func is not None:
+            self._funcs[()] = func
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, func: Callable[[], float], **labels):
+        """Значение, вычисляемое при каждой выдаче (например, длина очереди)"""
+        with self._lock:
+            self._funcs[self._key(labels)] = func
+
+    def remove_function(self, func: Callable[[], float], **labels):
+        """Снять функцию с метки, если она всё ещё привязана (владелец закрыт)"""
+        with self._lock:
+            key = self._key(labels)
+            if self._funcs.get(key) is func:
+                del self._funcs[key]
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        func = self._funcs.get(key)
+        if func is not None:
+            try:
+                return func()
+            except Exception:
+                return math.nan
+        return self._values.get(key, 0)
+
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            keys = sorted(set(self._values) | set(self._funcs))
+        return [(key, self.value(**dict(zip(self.label_names, key)))) for key in keys]
+
+    def _samples(self) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+            for key, value in self.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (задержки, размеры)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> (счётчики по корзинам + переполнение, сумма, количество)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels) -> '_Timer':
+        """Замер длительности блока: with histogram.time(handler='start'): ..."""
+        return _Timer(self, labels)
+
+    def items(self) -> List[Tuple[Tuple[str, ...], List[int], float, int]]:
+        with self._lock:
+            return [(key, list(s[0]), s[1], s[2]) for key, s in sorted(self._series.items())]
+
+    def quantile(self, q: float, **labels) -> float:
+        """Оценка квантиля по корзинам (как histogram_quantile в Prometheus)"""
+        series = self._series.get(self._key(labels))
+        if not series or not series[2]:
+            return 0.0
+        return self._quantile(q, list(series[0]), series[2])
+
+    def _quantile(self, q: float, counts: List[int], total: int) -> float:
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, counts, total_sum, count in self.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total_sum)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Набор метрик; повторная регистрация имени возвращает ту же метрику"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"❌ Метрика {name} уже зарегистрирована как {metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (),
+              func: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = self._register(Gauge, name, documentation, labels)
+        if func is not None:
+            gauge.set_function(func)
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labels, buckets)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def metrics(self) -> Iterable[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)"""
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Общие метрики бота: модули обновляют их в местах замера
+HANDLER_SECONDS = REGISTRY.histogram(
+    'savosbot_handler_seconds', 'Время обработки обновления обработчиком', ['handler', 'bot'])
+HANDLER_ERRORS = REGISTRY.counter(
+    'savosbot_handler_errors_total', 'Исключения в обработчиках', ['handler', 'bot'])
+UPDATE_LAG_SECONDS = REGISTRY.histogram(
+    'savosbot_update_lag_seconds', 'Задержка от отправки сообщения до начала обработки',
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300))
+STORAGE_OP_SECONDS = REGISTRY.histogram(
+    'savosbot_storage_op_seconds', 'Время операций с базой (в потоке базы)', ['op'])
+STORAGE_QUEUE_SECONDS = REGISTRY.histogram(
+    'savosbot_storage_queue_seconds', 'Ожидание свободного потока базы', ['op'])
+STORAGE_BYTES = REGISTRY.counter(
+    'savosbot_storage_bytes_total', 'Байты, прочитанные и записанные хранилищем', ['engine', 'direction'])
+WEBSITE_REQUEST_SECONDS = REGISTRY.histogram(
+    'savosbot_website_request_seconds', 'Время запросов к сайту', ['path'])
+WEBSITE_RESPONSES = REGISTRY.counter(
+    'savosbot_website_responses_total', 'Ответы сайта по статусам', ['path', 'status'])
+SYNC_USERS = REGISTRY.counter(
+    'savosbot_sync_users_total', 'Пользователи, отправленные на сайт', ['via', 'result'])
+SYNC_USERS_PER_SECOND = REGISTRY.gauge(
+    'savosbot_sync_users_per_second', 'Скорость последней массовой синхронизации')
+BROADCAST_MESSAGES = REGISTRY.counter(
+    'savosbot_broadcast_messages_total', 'Сообщения рассылки по результату', ['result'])
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    'savosbot_log_records_dropped_total', 'Записи лога, отброшенные прореживанием или переполнением очереди', ['reason'])
+
+
+def timed_handler(name: str, callback, bot: str = 'main'):
+    """Обёртка обработчика Telegram с замером времени и учётом ошибок
+
+    bot - имя бота в общем процессе (метка bot, см. runtime.py).
+    """
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name, bot=bot)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name, bot=bot)
+    wrapper.__name__ = getattr(callback, '__name__', name)
+    return wrapper
+
+
+def summary(registry: MetricsRegistry = REGISTRY) -> str:
+    """Краткая сводка для команды /metrics"""
+    lines = []
+
+    handlers = registry.get('savosbot_handler_seconds')
+    if handlers and handlers.items():
+        lines.append('⏱️ Обработчики (p50 / p99, вызовов):')
+        errors = registry.get('savosbot_handler_errors_total')
+        # Имя бота показываем, только если в процессе их несколько
+        several_bots = len({bot for (_, bot), *_ in handlers.items()}) > 1
+        for (name, bot), counts, _, count in handlers.items():
+            p50 = handlers._quantile(0.5, counts, count) * 1000
+            p99 = handlers._quantile(0.99, counts, count) * 1000
+            failed = errors.value(handler=name, bot=bot) if errors else 0
+            label = f"{bot}/{name}" if several_bots else name
+            lines.append(f"  {label}: {p50:.1f} / {p99:.1f} мс, {count}" + (f", ошибок {failed:g}" if failed else ''))
+
+    lag = registry.get('savosbot_update_lag_seconds')
+    if lag and lag.items():
+        lines.append(f"📨 Задержка обновлений p50 / p99: {lag.quantile(0.5):.2f} / {lag.quantile(0.99):.2f} с")
+
+    storage = registry.get('savosbot_storage_op_seconds')
+    if storage and storage.items():
+        busiest = sorted(storage.items(), key=lambda item: -item[2])[:5]
+        lines.append('💾 База (p99, вызовов):')
+        for (op,), counts, _, count in busiest:
+            lines.append(f"  {op}: {storage._quantile(0.99, counts, count) * 1000:.1f} мс, {count}")
+    written = registry.get('savosbot_storage_bytes_total')
+    if written and written.items():
+        for (engine, direction), value in written.items():
+            lines.append(f"  {engine} {'запись' if direction == 'write' else 'чтение'}: {value / 1024 / 1024:.1f} МБ")
+
+    website = registry.get('savosbot_website_request_seconds')
+    if website and website.items():
+        lines.append('🌐 Сайт (p50 / p99, запросов):')
+        for (path,), counts, _, count in website.items():
+            p50 = website._quantile(0.5, counts, count) * 1000
+            p99 = website._quantile(0.99, counts, count) * 1000
+            lines.append(f"  {path}: {p50:.0f} / {p99:.0f} мс, {count}")
+    responses = registry.get('savosbot_website_responses_total')
+    if responses and responses.items():
+        lines.append('  статусы: ' + ', '.join(
+            f"{path} {status}×{value:g}" for (path, status), value in responses.items()
+        ))
+
+    sync = registry.get('savosbot_sync_users_total')
+    sent = [(key, value) for key, value in sync.items() if value] if sync else []
+    if sent:
+        lines.append('📤 Отправлено на сайт: ' + ', '.join(
+            f"{via}/{result}: {value:g}" for (via, result), value in sent
+        ))
+
+    broadcast = registry.get('savosbot_broadcast_messages_total')
+    messages = [(result, value) for (result,), value in broadcast.items() if value] if broadcast else []
+    if messages:
+        lines.append('📢 Рассылка: ' + ', '.join(f"{result}: {value:g}" for result, value in messages))
+
+    for metric in registry.metrics():
+        if isinstance(metric, Gauge) and metric.name.startswith('savosbot_'):
+            for key, value in metric.items():
+                if value and not math.isnan(value):
+                    labels = f" ({', '.join(key)})" if key else ''
+                    lines.append(f"📈 {metric.documentation}{labels}: {value:g}")
+
+    return '\n'.join(lines) if lines else 'Метрик пока нет'
+
+
+class MetricsServer:
+    """Локальный HTTP-адрес с метриками в формате Prometheus (GET /metrics)"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = '127.0.0.1', port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def handle(self, request):
+        from aiohttp import web
+        return web.Response(
+            text=self.registry.render(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"📈 Метрики: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def metrics_server_from_env(registry: MetricsRegistry = REGISTRY) -> Optional[MetricsServer]:
+    """Сервер метрик по METRICS_HOST/METRICS_PORT (METRICS_PORT=0 - отключён)"""
+    port = int(os.getenv('METRICS_PORT', '9108'))
+    if not port:
+        return None
+    return MetricsServer(registry, host=os.getenv('METRICS_HOST', '127.0.0.1'), port=port)
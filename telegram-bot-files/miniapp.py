@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - бот мини-приложения
+
+На /start отвечает кнопкой, открывающей мини-приложение (MINI_APP_URL).
+Запускается отдельно (miniapp_bot.py в корне проекта) или вместе с
+основным ботом в одном процессе (runtime.py, BOTS=main,miniapp).
+"""
+
+import os
+import logging
+from typing import Optional
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+from telegram.ext import Application, CommandHandler, ContextTypes
+
+from metrics import REGISTRY, timed_handler
+from logging_setup import hot
+
+logger = logging.getLogger(__name__)
+
+MINI_APP_URL = os.getenv("MINI_APP_URL", "https://savos-club-two.vercel.app/mini-app")
+
+
+class MiniAppBot:
+    """Обработчики бота мини-приложения
+
+    db - общая база пользователей (необязательно, только чтение): знакомых
+    участников бот приветствует по имени.
+    """
+
+    def __init__(self, token: str, name: str = 'miniapp', db=None, request=None,
+                 get_updates_request=None):
+        if not token:
+            raise ValueError(f"❌ Не задан токен бота {name}")
+
+        self.name = name
+        self.db = db
+
+        builder = Application.builder().token(token)
+        if request is not None:
+            builder = builder.request(request)
+        if get_updates_request is not None:
+            builder = builder.get_updates_request(get_updates_request)
+        self.application = builder.build()
+        self.application.add_handler(CommandHandler("start", timed_handler('start', self.start, name)))
+
+        REGISTRY.gauge('savosbot_update_queue_size', 'Обновлений в очереди Application',
+                       ['bot']).set_function(self.application.update_queue.qsize, bot=name)
+
+    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик /start - кнопка мини-приложения"""
+        user = update.effective_user
+        logger.info("👤 /start (мини-приложение)", extra=hot(user_id=user.id, bot=self.name))
+
+        member: Optional[dict] = None
+        if self.db is not None:
+            member = await self.db.run(self.db.get_user, user.id)
+
+        keyboard = [[InlineKeyboardButton("📱 Открыть мини‑приложение", web_app=WebAppInfo(url=MINI_APP_URL))]]
+        greeting = f"👋 С возвращением, {user.first_name}!" if member else "👋 Добро пожаловать в SavosBot Club!"
+        await update.message.reply_text(
+            f"{greeting}\n\nНажмите кнопку ниже, чтобы открыть мини‑приложение.",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - фото профиля пользователей
+
+Фото получается в фоне, вне пути ответа на /start: два запроса к Bot API
+(get_user_profile_photos и get_file) больше не задерживают приветствие.
+Результат get_file кэшируется по file_unique_id с TTL, а у существующих
+пользователей фото обновляется лениво - не чаще раза в PHOTO_CACHE_TTL.
+
+Изменение фото определяется по file_unique_id (хранится в записи как
+photo_unique_id), а не по ссылке: ссылка содержит токен бота и меняется
+при каждом get_file, и сравнение по ней перезаписывало бы пользователя
+(и отправляло его на сайт) без изменения фото.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilePhotoResolver:
+    """Фоновое получение фото профиля с кэшем по file_unique_id"""
+
+    def __init__(self, db, ttl: float = 3000, max_entries: int = 10000, on_update=None):
+        self.db = db
+        self.on_update = on_update  # вызывается после изменения записи (например, outbox.notify)
+        # Ссылка на файл от get_file гарантированно живёт не меньше часа
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._files: Dict[str, Tuple[str, float]] = {}  # file_unique_id -> (file_path, истекает)
+        self._checked: Dict[int, float] = {}  # user_id -> время последней проверки
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def is_stale(self, user_id: int) -> bool:
+        """Пора ли перепроверить фото пользователя"""
+        checked = self._checked.get(user_id)
+        return checked is None or time.monotonic() - checked >= self.ttl
+
+    def schedule(self, bot, user_id: int, spawn) -> Optional[asyncio.Future]:
+        """Запуск фонового обновления фото (одна задача на пользователя)
+
+        spawn - функция запуска фоновой задачи бота (coro, name) -> Task.
+        """
+        task = self._inflight.get(user_id)
+        if task is not None and not task.done():
+            return task
+        task = spawn(self.refresh(bot, user_id), f'photo-{user_id}')
+        self._inflight[user_id] = task
+        task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return task
+
+    async def resolve(self, bot, user_id: int) -> Optional[Tuple[str, str]]:
+        """Текущее фото профиля: (file_unique_id, ссылка) или None, если фото нет"""
+        photos = await bot.get_user_profile_photos(user_id, limit=1)
+        if not photos.total_count:
+            return None
+
+        photo = photos.photos[0][0]
+        now = time.monotonic()
+        cached = self._files.get(photo.file_unique_id)
+        if cached and cached[1] > now:
+            self.hits += 1
+            return photo.file_unique_id, cached[0]
+
+        self.misses += 1
+        photo_file = await bot.get_file(photo.file_id)
+        self._remember(photo.file_unique_id, photo_file.file_path, now)
+        return photo.file_unique_id, photo_file.file_path
+
+    async def refresh(self, bot, user_id: int):
+        """Получение фото и обновление записи пользователя при изменении"""
+        try:
+            photo = await self.resolve(bot, user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось получить фото {user_id}: {e}")
+            return
+        now = time.monotonic()
+        if len(self._checked) >= self.max_entries:
+            self._checked = {uid: at for uid, at in self._checked.items() if now - at < self.ttl}
+        self._checked[user_id] = now
+
+        unique_id, photo_url = photo or (None, None)
+
+        def mutate(user):
+            # Та же картинка - запись не трогаем, даже если ссылка другая
+            if user is None or (user.get('photo_unique_id') == unique_id
+                                and bool(user.get('photo_url')) == bool(photo_url)):
+                return None
+            return {'photo_url': photo_url, 'photo_unique_id': unique_id}
+
+        # Проверка и запись одной операцией: не конфликтует с обработчиками
+        if not await self.db.run(self.db.update_user, user_id, mutate):
+            return
+        logger.info(f"🖼️ Фото пользователя {user_id} обновлено")
+        if self.on_update:
+            self.on_update()
+
+    def _remember(self, file_unique_id: str, file_path: str, now: float):
+        if len(self._files) >= self.max_entries:
+            # Сначала выбрасываем истёкшие, затем самые старые записи
+            expired = [key for key, (_, expires) in self._files.items() if expires <= now]
+            for key in expired or list(self._files)[:len(self._files) // 10 or 1]:
+                del self._files[key]
+        self._files[file_unique_id] = (file_path, now + self.ttl)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - сообщения о ходе долгих операций
+
+Одно сообщение на чат, которое периодически редактируется текущим текстом
+(синхронизация с сайтом, рассылка). Неизменившийся текст повторно не
+отправляется, ошибки редактирования не прерывают саму операцию.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict
+
+from telegram import Message
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressMessages:
+    """Сообщения о ходе операции, по одному на чат
+
+    label - первая строка каждого сообщения (например, шард в dispatcher.py:
+    каждый воркер ведёт свою часть операции и своё сообщение).
+    """
+
+    def __init__(self, render: Callable[[], str], interval: float = 3.0,
+                 busy_text: str = "🔄 Операция уже идёт, ход - в сообщении выше.", label: str = ''):
+        self.render = render
+        self.interval = interval
+        self.busy_text = busy_text
+        self.label = label
+        self._messages: Dict[int, Message] = {}  # chat_id -> сообщение о ходе
+        self._texts: Dict[int, str] = {}  # chat_id -> последний отправленный текст
+
+    async def attach(self, message: Message):
+        """Сообщение о ходе в ответ на команду (второе в тот же чат не заводится)"""
+        existing = self._messages.get(message.chat_id)
+        if existing is not None:
+            await message.reply_text(self.busy_text, reply_to_message_id=existing.message_id)
+            return
+        text = self.text()
+        self.add(await message.reply_text(text), text)
+
+    def text(self) -> str:
+        """Текущий текст сообщения (с подписью label)"""
+        text = self.render()
+        return f"{self.label}\n{text}" if self.label else text
+
+    def add(self, message: Message, text: str):
+        """Уже отправленное сообщение о ходе (например, после перезапуска)"""
+        self._messages[message.chat_id] = message
+        self._texts[message.chat_id] = text
+
+    async def refresh(self):
+        """Обновление всех сообщений текущим текстом"""
+        text = self.text()
+        for chat_id, message in list(self._messages.items()):
+            if self._texts.get(chat_id) == text:
+                continue
+            try:
+                await message.edit_text(text)
+                self._texts[chat_id] = text
+            except TelegramError as e:
+                logger.debug(f"Не удалось обновить сообщение о ходе в чате {chat_id}: {e}")
+
+    async def run(self):
+        """Периодическое обновление (запускается задачей, отменяется по окончании)"""
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - несколько ботов в одном процессе
+
+Один цикл событий и общие ресурсы вместо отдельного процесса на бота:
+- пул соединений с Bot API (TELEGRAM_POOL_SIZE, по умолчанию 256) и пул
+  для getUpdates - общие для всех токенов;
+- база пользователей (DatabaseManager) - одна, загружается один раз;
+- метрики - общий реестр и один сервер метрик; у метрик обработчиков и
+  очередей есть метка bot.
+
+Боты задаются переменной BOTS: имена через запятую, для второго бота
+того же вида - имя:вид (по умолчанию BOTS=main):
+
+    BOTS=main,miniapp
+    BOTS=main,miniapp,promo:miniapp
+
+Виды: main - основной бот клуба (bot_working.py), miniapp - кнопка
+мини-приложения (miniapp.py). Основной бот может быть только один:
+очередь отправки на сайт, синхронизация и рассылка относятся к базе.
+Токен - переменная <ИМЯ>_BOT_TOKEN (MINIAPP_BOT_TOKEN, PROMO_BOT_TOKEN),
+для бота с именем main - BOT_TOKEN.
+
+BOT_MODE=polling (по умолчанию) - getUpdates для каждого токена;
+BOT_MODE=webhook - один HTTP-сервер (webhook.py): бот main принимает
+обновления по WEBHOOK_PATH, остальные - по WEBHOOK_PATH/<имя>.
+
+    python3 runtime.py
+"""
+
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from telegram.request import BaseRequest, HTTPXRequest
+
+from bot_working import SavosBotWorking, force_direct_connection
+from database import DataDirLockedError, DatabaseManager
+from metrics import metrics_server_from_env
+from miniapp import MiniAppBot
+from shards import ensure_unsharded
+from webhook import (WebhookServer, start_application, stop_application, wait_for_stop_signal,
+                     webhook_settings_from_env)
+
+logger = logging.getLogger(__name__)
+
+BOT_KINDS = ('main', 'miniapp')
+ALLOWED_UPDATES = ['message', 'callback_query', 'inline_query']
+
+
+class SharedRequest(BaseRequest):
+    """Один пул соединений для нескольких Bot
+
+    Каждый Bot открывает и закрывает свои запросы в initialize()/shutdown();
+    общий пул открывается первым из них и закрывается последним.
+    """
+
+    def __init__(self, request: BaseRequest):
+        self.request = request
+        self._users = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.request.read_timeout
+
+    async def initialize(self) -> None:
+        async with self._lock:
+            if not self._users:
+                await self.request.initialize()
+            self._users += 1
+
+    async def shutdown(self) -> None:
+        async with self._lock:
+            if not self._users:
+                return
+            self._users -= 1
+            if not self._users:
+                await self.request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data=None, **timeouts) -> Tuple[int, bytes]:
+        return await self.request.do_request(url, method, request_data, **timeouts)
+
+
+def parse_bots(spec: str) -> List[Tuple[str, str]]:
+    """'main,miniapp,promo:miniapp' -> [('main', 'main'), ('miniapp', 'miniapp'), ('promo', 'miniapp')]"""
+    bots = []
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, kind = part.partition(':')
+        name, kind = name.strip(), kind.strip() or name.strip()
+        if kind not in BOT_KINDS:
+            raise ValueError(f"❌ Неизвестный вид бота в BOTS: {part} (доступны: {', '.join(BOT_KINDS)})")
+        if any(name == other for other, _ in bots):
+            raise ValueError(f"❌ Бот {name} указан в BOTS дважды")
+        bots.append((name, kind))
+
+    if not bots:
+        raise ValueError("❌ BOTS не содержит ни одного бота")
+    if sum(kind == 'main' for _, kind in bots) > 1:
+        raise ValueError("❌ Основной бот (main) может быть только один")
+    return bots
+
+
+def token_variable(name: str) -> str:
+    """Переменная окружения с токеном бота"""
+    return 'BOT_TOKEN' if name == 'main' else f"{name.upper()}_BOT_TOKEN"
+
+
+class BotRuntime:
+    """Несколько ботов в одном цикле событий с общими ресурсами"""
+
+    def __init__(self, bots: List[Tuple[str, str]], data_dir: str = 'data',
+                 request: Optional[BaseRequest] = None, get_updates_request: Optional[BaseRequest] = None,
+                 tokens: Optional[Dict[str, str]] = None):
+        """bots - [(имя, вид)] из parse_bots()
+
+        request/get_updates_request - свои BaseRequest для Bot API (проверки
+        без сети), tokens - токены по имени бота вместо переменных окружения.
+        """
+        self.mode = os.getenv('BOT_MODE', 'polling')
+        tokens = {name: (tokens or {}).get(name) or os.getenv(token_variable(name)) for name, _ in bots}
+        missing = [token_variable(name) for name, token in tokens.items() if not token]
+        if missing:
+            raise ValueError(f"❌ Не заданы токены: {', '.join(missing)}")
+        if len(set(tokens.values())) != len(tokens):
+            raise ValueError("❌ У нескольких ботов в BOTS один и тот же токен")
+
+        # Прокси отключаются до создания пулов: httpx читает их при создании клиента
+        force_direct_connection()
+        self.request = SharedRequest(request or HTTPXRequest(
+            connection_pool_size=int(os.getenv('TELEGRAM_POOL_SIZE', '256'))
+        ))
+        self.get_updates_request = SharedRequest(get_updates_request or HTTPXRequest(
+            connection_pool_size=len(bots)
+        ))
+        self.metrics_server = metrics_server_from_env()
+
+        ensure_unsharded(data_dir)
+        self.db = DatabaseManager(data_dir)
+        self.db.initialize()
+        try:
+            self.bots = [self._create_bot(name, kind, tokens[name], data_dir) for name, kind in bots]
+        except Exception:
+            self.db.close()
+            raise
+
+    def _create_bot(self, name: str, kind: str, token: str, data_dir: str):
+        shared = {
+            'name': name,
+            'db': self.db,
+            'request': self.request,
+            'get_updates_request': self.get_updates_request,
+        }
+        if kind == 'main':
+            return SavosBotWorking(data_dir, token=token, serve_metrics=False, **shared)
+        return MiniAppBot(token, **shared)
+
+    @staticmethod
+    def webhook_path(name: str, base: str) -> str:
+        return base if name == 'main' else f"{base.rstrip('/')}/{name}"
+
+    async def start(self):
+        """Запуск всех Application (без получения обновлений)"""
+        started = []
+        try:
+            for bot in self.bots:
+                await start_application(bot.application)
+                started.append(bot)
+        except Exception:
+            for bot in reversed(started):
+                await stop_application(bot.application)
+            raise
+
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.warning(f"⚠️ Адрес метрик недоступен: {e}")
+                self.metrics_server = None
+
+    async def stop(self):
+        """Остановка получения обновлений и всех Application"""
+        for bot in reversed(self.bots):
+            application = bot.application
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            await stop_application(application)
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
+    async def _start_webhook(self) -> WebhookServer:
+        settings = webhook_settings_from_env()
+        if not settings['secret_token']:
+            logger.warning("⚠️ WEBHOOK_SECRET не задан - запросы к webhook не проверяются")
+
+        server = WebhookServer(listen=settings['listen'], port=settings['port'],
+                               secret_token=settings['secret_token'])
+        for bot in self.bots:
+            server.add_application(self.webhook_path(bot.name, settings['path']), bot.application)
+        await server.start()
+
+        if settings['webhook_url']:
+            for bot in self.bots:
+                url = f"{settings['webhook_url'].rstrip('/')}{self.webhook_path(bot.name, settings['path'])}"
+                await bot.application.bot.set_webhook(
+                    url=url,
+                    secret_token=settings['secret_token'],
+                    allowed_updates=ALLOWED_UPDATES,
+                    drop_pending_updates=True
+                )
+                logger.info(f"🔗 Webhook {bot.name} установлен: {url}")
+        return server
+
+    async def serve(self):
+        """Работа всех ботов до сигнала остановки"""
+        server = None
+        await self.start()
+        try:
+            if self.mode == 'webhook':
+                server = await self._start_webhook()
+            else:
+                for bot in self.bots:
+                    await bot.application.updater.start_polling(
+                        allowed_updates=ALLOWED_UPDATES,
+                        drop_pending_updates=True,
+                        bootstrap_retries=5
+                    )
+            logger.info(f"🚀 Запущено ботов: {len(self.bots)} "
+                        f"({', '.join(bot.name for bot in self.bots)}), режим: {self.mode}")
+            await wait_for_stop_signal()
+        finally:
+            if server:
+                await server.stop()
+            await self.stop()
+            # Фиксируем хранилище перед выходом
+            self.db.close()
+
+
+def main():
+    """Запуск ботов из BOTS"""
+    try:
+        runtime = BotRuntime(parse_bots(os.getenv('BOTS', 'main')))
+    except (ValueError, DataDirLockedError) as e:
+        logger.error(str(e))
+        raise SystemExit(1)
+    asyncio.run(runtime.serve())
+
+
+if __name__ == '__main__':
+    main()
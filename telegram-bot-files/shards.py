@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - шарды базы пользователей для dispatcher.py
+
+Пользователь с id относится к шарду id % N; каждый шард - отдельный каталог
+data/shard-<номер> со своим хранилищем (DB_STORAGE), statistics.json и
+broadcast.json. Количество шардов записано в data/shards.json.
+
+internal_id остаются уникальными на всю базу: шард i выдаёт только номера,
+дающие i + 1 в остатке от деления на N (database.next_internal_id), а
+последовательность каждого шарда начинается не ниже наибольшего номера,
+выданного до разбиения.
+
+Разбиение и обратная сборка (исходные файлы переносятся в
+data/shards-backup-<время>, ничего не удаляется):
+    python3 shards.py split --data-dir data --shards 4   # из data/ или другого числа шардов
+    python3 shards.py merge --data-dir data              # обратно в data/ (один процесс)
+    python3 shards.py stats --data-dir data              # сводная статистика
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from database import (DataDirLockedError, SqliteStorage, atomic_write_json, create_storage, latest_snapshot, scan_internal_ids,
+                      write_users_snapshot, SNAPSHOT_FILES)
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_FILE = 'shards.json'
+# Файлы хранилища в каталоге данных (переносятся в резервную копию при разбиении/сборке)
+DATA_FILES = (*SNAPSHOT_FILES.values(), 'users.journal', 'internal_id.seq', 'users.db', 'users.db-wal',
+              'users.db-shm', 'statistics.json', 'broadcast.json')
+
+
+def shard_of(user_id: Optional[int], count: int) -> int:
+    """Номер шарда пользователя (обновления без пользователя и чата - в шард 0)"""
+    return user_id % count if user_id is not None else 0
+
+
+def update_user_id(data: Dict[str, Any]) -> Optional[int]:
+    """Ключ шарда для обновления-словаря Bot API: отправитель, иначе чат
+
+    Тот же порядок, что у PerUserUpdateProcessor.update_key, но без
+    разбора обновления в объекты telegram.
+    """
+    for key, value in data.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user:
+            return user.get('id')
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat.get('id')
+    return None
+
+
+def shard_dir(data_dir: str, index: int) -> str:
+    return os.path.join(data_dir, f'shard-{index}')
+
+
+def read_layout(data_dir: str) -> int:
+    """Количество шардов из shards.json (0 - база не разбита)"""
+    path = os.path.join(data_dir, LAYOUT_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r') as f:
+        return int(json.load(f)['shards'])
+
+
+def ensure_unsharded(data_dir: str):
+    """Запуск одним процессом: разбитая база не должна подменяться пустой"""
+    count = read_layout(data_dir)
+    if count:
+        raise ValueError(
+            f"❌ База в {data_dir} разбита на шарды ({count}): запускайте dispatcher.py "
+            f"или соберите её обратно: python3 shards.py merge --data-dir {data_dir}"
+        )
+
+
+def has_unsharded_data(data_dir: str) -> bool:
+    """В каталоге есть база одного процесса (bot_working.py / runtime.py)"""
+    return bool(latest_snapshot(data_dir)) or os.path.exists(os.path.join(data_dir, 'users.db'))
+
+
+def merge_statistics(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сводная статистика по снимкам StatsCounters.snapshot() всех шардов
+
+    «Сегодня» учитывается только из снимков, записанных сегодня.
+    """
+    today = datetime.now().date().isoformat()
+    merged = {'total_users': 0, 'active_users': 0, 'registered_users': 0, 'today_users': 0}
+    shards = 0
+    for snapshot in snapshots:
+        shards += 1
+        for key in ('total_users', 'active_users', 'registered_users'):
+            merged[key] += snapshot.get(key, 0)
+        if (snapshot.get('last_update') or '')[:10] == today:
+            merged['today_users'] += snapshot.get('today_users', 0)
+    merged['shards'] = shards
+    merged['last_update'] = datetime.now().isoformat()
+    return merged
+
+
+def read_shard_statistics(data_dir: str, count: int, skip: Optional[int] = None) -> List[Dict[str, Any]]:
+    """statistics.json шардов (кроме skip); недоступные файлы пропускаются
+
+    Воркеры записывают изменения раз в STATS_FLUSH_INTERVAL (и при
+    остановке), поэтому чужие шарды отстают от памяти не больше чем на
+    этот интервал.
+    """
+    snapshots = []
+    for index in range(count):
+        if index == skip:
+            continue
+        path = os.path.join(shard_dir(data_dir, index), 'statistics.json')
+        try:
+            with open(path, 'r') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.debug(f"Статистика шарда {index} недоступна: {e}")
+    return snapshots
+
+
+def merged_statistics(data_dir: str) -> Dict[str, Any]:
+    """Сводная статистика разбитой базы по файлам шардов"""
+    count = read_layout(data_dir)
+    merged = merge_statistics(read_shard_statistics(data_dir, count))
+    merged['missing_shards'] = count - merged['shards']
+    return merged
+
+
+def _open_sources(dirs: List[str]) -> list:
+    storages = []
+    for path in dirs:
+        storage = create_storage(path)
+        storage.open()
+        storages.append(storage)
+    return storages
+
+
+def _sequence(storage) -> int:
+    """Сохранённая последовательность internal_id открытого хранилища"""
+    if isinstance(storage, SqliteStorage):
+        return int(storage.get_meta('internal_id_seq') or 0)
+    return storage.internal_id_seq
+
+
+def _write_store(path: str, users: List[Dict[str, Any]], outbox: Dict[int, float], internal_id_seq: int):
+    """Запись одного хранилища (DB_STORAGE) из готового списка пользователей"""
+    os.makedirs(path, exist_ok=True)
+    if os.getenv('DB_STORAGE', 'json') == 'sqlite':
+        storage = SqliteStorage(path)
+        storage.open()
+        with storage.conn:
+            storage.upsert_many(users)
+            storage.conn.executemany(
+                'INSERT OR IGNORE INTO outbox (user_id, enqueued_at) VALUES (?, ?)',
+                [(user['id'], outbox[user['id']]) for user in users if user['id'] in outbox]
+            )
+            storage.set_meta('internal_id_seq', str(internal_id_seq))
+        storage.close()
+        return
+
+    for user in users:
+        if user['id'] in outbox:
+            user['sync_pending'] = True
+    snapshot_format = os.getenv('DB_SNAPSHOT_FORMAT', 'json')
+    write_users_snapshot(os.path.join(path, SNAPSHOT_FILES[snapshot_format]), users)
+    atomic_write_json(os.path.join(path, 'internal_id.seq'), internal_id_seq)
+
+
+def _backup(data_dir: str, paths: List[str]) -> Optional[str]:
+    """Перенос исходных файлов и каталогов в data/shards-backup-<время>"""
+    paths = [p for p in paths if os.path.exists(p)]
+    if not paths:
+        return None
+    base = os.path.join(data_dir, f"shards-backup-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+    backup, attempt = base, 1
+    while os.path.exists(backup):
+        attempt += 1
+        backup = f"{base}-{attempt}"
+    os.makedirs(backup)
+    for path in paths:
+        shutil.move(path, os.path.join(backup, os.path.basename(path)))
+    return backup
+
+
+def reshard(data_dir: str, count: int) -> Dict[str, Any]:
+    """Разбиение базы на count шардов (count=0 - сборка обратно в data_dir)
+
+    Источник - текущие шарды (по shards.json) или база одного процесса в
+    data_dir. Новые хранилища пишутся рядом и подменяют исходные только
+    после записи всех; исходные файлы остаются в резервной копии.
+    """
+    started = time.monotonic()
+    current = read_layout(data_dir)
+    if current:
+        sources = [shard_dir(data_dir, index) for index in range(current)]
+    elif has_unsharded_data(data_dir):
+        sources = [data_dir]
+    else:
+        sources = []
+    if not count and not current:
+        raise ValueError("❌ База не разбита на шарды")
+    if count == current:
+        return {'shards': count, 'users': None, 'backup': None}
+
+    storages = _open_sources(sources)
+    try:
+        outbox: Dict[int, float] = {}
+        for storage in storages:
+            outbox.update(storage.outbox)
+        # Последовательность новых шардов - не ниже всех выданных номеров
+        max_id, duplicates = scan_internal_ids(
+            user.get('internal_id') for storage in storages for user in storage.iter_users()
+        )
+        if duplicates:
+            logger.warning(f"⚠️ Повторяющиеся internal_id: {len(duplicates)} (например, {duplicates[:5]})")
+        internal_id_seq = max([max_id, *map(_sequence, storages)])
+
+        staging = os.path.join(data_dir, '.shards-new')
+        shutil.rmtree(staging, ignore_errors=True)
+        targets = [shard_dir(staging, index) for index in range(count)] if count else [staging]
+        total = 0
+        for index, target in enumerate(targets):
+            users = [
+                user.copy() for storage in storages for user in storage.iter_users()
+                if not count or shard_of(user['id'], count) == index
+            ]
+            _write_store(target, users, outbox, internal_id_seq)
+            total += len(users)
+    finally:
+        for storage in storages:
+            storage.close()
+
+    for source in sources:
+        if os.path.exists(os.path.join(source, 'broadcast.json')):
+            logger.warning(f"⚠️ Ход рассылки из {source} не переносится (остаётся в резервной копии)")
+
+    layout = os.path.join(data_dir, LAYOUT_FILE)
+    old = [shard_dir(data_dir, index) for index in range(current)] + [layout]
+    if not current or not count:
+        # Файлы базы одного процесса в data_dir: источник разбиения или место для сборки
+        old += [os.path.join(data_dir, name) for name in DATA_FILES]
+    backup = _backup(data_dir, old)
+
+    if count:
+        for index in range(count):
+            os.rename(shard_dir(staging, index), shard_dir(data_dir, index))
+        atomic_write_json(layout, {'shards': count, 'created_at': datetime.now().isoformat()})
+    else:
+        for name in os.listdir(staging):
+            os.rename(os.path.join(staging, name), os.path.join(data_dir, name))
+    os.rmdir(staging)
+
+    logger.info(
+        f"🧩 База: {current or 'без шардов'} -> {count or 'без шардов'}, пользователей: {total} "
+        f"за {time.monotonic() - started:.1f} с" + (f", исходные файлы: {backup}" if backup else "")
+    )
+    return {'shards': count, 'users': total, 'backup': backup}
+
+
+def prepare_layout(data_dir: str, count: int):
+    """Подготовка шардов при запуске dispatcher.py
+
+    Пустой каталог размечается сразу, база одного процесса разбивается
+    автоматически (как импорт в SQLite при первом запуске). Другое
+    количество шардов требует явного split: перенос всей базы не
+    должен происходить из-за опечатки в WORKERS.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    current = read_layout(data_dir)
+    if current == count:
+        return
+    if current:
+        raise ValueError(
+            f"❌ Шардов в базе: {current}, а WORKERS={count}. "
+            f"Перераспределение: python3 shards.py split --data-dir {data_dir} --shards {count}"
+        )
+    if has_unsharded_data(data_dir):
+        logger.info(f"🧩 Разбиение базы на {count} шардов...")
+        reshard(data_dir, count)
+        return
+    atomic_write_json(os.path.join(data_dir, LAYOUT_FILE), {'shards': count, 'created_at': datetime.now().isoformat()})
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Шарды базы пользователей')
+    sub = parser.add_subparsers(dest='command', required=True)
+    split_parser = sub.add_parser('split', help='Разбить базу (или шарды) на N шардов')
+    split_parser.add_argument('--data-dir', default='data')
+    split_parser.add_argument('--shards', type=int, required=True)
+    merge_parser = sub.add_parser('merge', help='Собрать шарды обратно в одну базу')
+    merge_parser.add_argument('--data-dir', default='data')
+    stats_parser = sub.add_parser('stats', help='Сводная статистика по шардам')
+    stats_parser.add_argument('--data-dir', default='data')
+    args = parser.parse_args()
+
+    if args.command in ('split', 'merge'):
+        if args.command == 'split' and args.shards < 1:
+            parser.error('--shards должно быть не меньше 1')
+        try:
+            result = reshard(args.data_dir, args.shards if args.command == 'split' else 0)
+        except DataDirLockedError as e:
+            # Перераспределение только при остановленном боте
+            raise SystemExit(str(e))
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print(json.dumps(merged_statistics(args.data_dir), ensure_ascii=False, indent=2))
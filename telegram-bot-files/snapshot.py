@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - двоичный снимок базы пользователей (users.snap)
+
+Компактная замена users.json для движков json/journal
+(DB_SNAPSHOT_FORMAT=binary). Формат, версия 1:
+
+    magic    8 байт  b'SAVOSNAP'
+    version  u16
+    hlen     u32     длина заголовка
+    header   hlen    JSON: count, fields [[имя, код], ...], strings,
+                     split (строки не содержат '\\0')
+    offsets  (strings + 1) * u32   начала строк в blob
+    blob     строки UTF-8, каждая завершается '\\0'
+    blocks   блоки записей: u32 длина, u32 число записей, затем столбцы
+
+Строковые значения лежат в таблице строк (повторяющиеся, например имена,
+- один раз), запись хранит номер строки (0 - None). Записи идут
+блоками с длиной в начале (читатель пропускает незнакомые столбцы в конце
+блока); внутри блока - столбцы: маски присутствующих ключей и None-значений,
+затем значения полей по кодам: q - int64, ? - bool, d - float, I - строка,
+J - JSON-текст значения (вложенные и смешанные типы).
+
+Чтение идёт через mmap: столбец блока разбирается одним struct.unpack_from,
+поэтому основная работа выполняется в C. iter_snapshot() читает файл по
+блокам и не загружает таблицу строк целиком.
+
+Преобразование без потерь (сверяется после записи):
+
+    python3 snapshot.py to-binary data/users.json data/users.snap
+    python3 snapshot.py to-json data/users.snap data/users.json
+    python3 snapshot.py bench --users 100000 1000000
+"""
+
+import os
+import gc
+import json
+import mmap
+import contextlib
+import time
+import struct
+import operator
+import tempfile
+import functools
+import itertools
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Sequence, Tuple
+
+MAGIC = b'SAVOSNAP'
+VERSION = 1
+PREAMBLE = struct.Struct('<8sHI')
+BLOCK = struct.Struct('<II')
+OFFSET = struct.Struct('<I')
+OFFSET_PAIR = struct.Struct('<II')
+BLOCK_SIZE = 8192
+
+# Ширина масок ключей по числу полей
+_MASK_CODES = ((8, 'B'), (16, 'H'), (32, 'I'), (64, 'Q'))
+_INT64 = (-(1 << 63), (1 << 63) - 1)
+# Код поля -> формат struct (J - номер JSON-текста в таблице строк)
+_STRUCT_CODES = {'q': 'q', '?': '?', 'd': 'd', 'I': 'I', 'J': 'I'}
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Без сборщика мусора на время массовой обработки записей
+
+    Снимок не создаёт циклических ссылок, а проходы сборщика по миллиону
+    уже загруженных словарей заметно замедляют и запись, и чтение.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _column_codes(fields: Sequence[Tuple[str, str]]) -> List[str]:
+    """Форматы struct столбцов блока: маска ключей, маска None, поля"""
+    for bits, mask in _MASK_CODES:
+        if len(fields) <= bits:
+            return [mask, mask] + [_STRUCT_CODES[code] for _, code in fields]
+    raise ValueError(f"❌ Слишком много полей для снимка: {len(fields)} (не больше 64)")
+
+
+def _field_code(values: Sequence[Any]) -> str:
+    """Код поля по всем его значениям, кроме None"""
+    types = set(map(type, values))
+    types.discard(type(None))
+    if not types or types == {str}:
+        return 'I'
+    if types == {bool}:
+        return '?'
+    if types == {int}:
+        present = [value for value in values if value is not None]
+        if _INT64[0] <= min(present) and max(present) <= _INT64[1]:
+            return 'q'
+    if types == {float}:
+        return 'd'
+    return 'J'
+
+
+def write_snapshot(f: BinaryIO, users: Sequence[Dict[str, Any]], block_size: int = BLOCK_SIZE) -> int:
+    """Запись снимка в открытый двоичный файл; возвращает число байт
+
+    Ключи записей - по первому появлению; номера строк выдаются общей
+    таблицей для всех полей.
+    """
+    with _gc_paused():
+        return _write_snapshot(f, users, block_size)
+
+
+def _write_snapshot(f: BinaryIO, users: Sequence[Dict[str, Any]], block_size: int) -> int:
+    names = dict.fromkeys(itertools.chain.from_iterable(users))
+    # Обычно у всех записей одинаковый набор ключей - тогда маски не нужны
+    same_keys = set(map(len, users)) <= {len(names)}
+
+    table: List[str] = []
+    strings: Dict[Any, int] = {None: 0}  # повторяющиеся строки -> номер
+    count = len(users)
+    full = (1 << len(names)) - 1
+    presence = [full] * count
+    nulls = [0] * count
+    fields = []
+    columns = []
+
+    for bit, name in enumerate(names):
+        flag = 1 << bit
+        column = list(map(dict.get, users, itertools.repeat(name)))
+        code = _field_code(column)
+        fields.append((name, code))
+
+        if not same_keys and not all(map(operator.contains, users, itertools.repeat(name))):
+            presence = [p if name in user else p & ~flag for p, user in zip(presence, users)]
+
+        if code in ('I', 'J'):
+            if code == 'J':
+                column = [
+                    json.dumps(value, ensure_ascii=False, separators=(',', ':')) if value is not None else None
+                    for value in column
+                ]
+            distinct = set(column)
+            distinct.discard(None)
+            if len(distinct) == count - column.count(None):
+                # Все значения разные (даты, хэши): номера подряд, без словаря
+                ids = itertools.count(len(table) + 1)
+                table.extend(value for value in column if value is not None)
+                column = [next(ids) if value is not None else 0 for value in column]
+            else:
+                new = list(distinct.difference(strings))
+                strings.update(zip(new, itertools.count(len(table) + 1)))
+                table.extend(new)
+                column = list(map(strings.__getitem__, column))
+        elif None in column:
+            default = False if code == '?' else 0
+            nulls = [n | flag if value is None else n for n, value in zip(nulls, column)]
+            column = [default if value is None else value for value in column]
+        columns.append(column)
+
+    codes = _column_codes(fields)
+    joined = '\0'.join(table)
+    split = joined.count('\0') == max(len(table) - 1, 0)
+    if split:
+        blob = (joined + '\0').encode('utf-8') if table else b''
+        sizes = map(len, blob.split(b'\0')[:-1])
+    else:
+        encoded = [s.encode('utf-8') for s in table]
+        blob = b''.join(data + b'\0' for data in encoded)
+        sizes = map(len, encoded)
+    offsets = list(itertools.accumulate(map((1).__add__, sizes), initial=0))
+    if offsets[-1] > 0xFFFFFFFF:
+        raise ValueError("❌ Таблица строк снимка больше 4 ГБ")
+
+    header = json.dumps({
+        'count': count,
+        'fields': fields,
+        'strings': len(table),
+        'split': split,
+    }, ensure_ascii=False).encode('utf-8')
+
+    written = f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+    written += f.write(header)
+    written += f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+    written += f.write(blob)
+
+    columns = [presence, nulls, *columns]
+    for start in range(0, count, block_size):
+        stop = min(start + block_size, count)
+        n = stop - start
+        body = b''.join(
+            struct.pack(f'<{n}{code}', *column[start:stop]) for code, column in zip(codes, columns)
+        )
+        written += f.write(BLOCK.pack(len(body), n))
+        written += f.write(body)
+    return written
+
+
+class _Layout:
+    """Разобранный заголовок снимка и положение разделов в файле"""
+
+    def __init__(self, buffer):
+        magic, version, header_size = PREAMBLE.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("❌ Не файл снимка пользователей")
+        if version != VERSION:
+            raise ValueError(f"❌ Неподдерживаемая версия снимка: {version}")
+
+        start = PREAMBLE.size
+        header = json.loads(bytes(buffer[start:start + header_size]))
+        self.count: int = header['count']
+        self.fields: List[Tuple[str, str]] = [tuple(field) for field in header['fields']]
+        self.names = [name for name, _ in self.fields]
+        self.codes = _column_codes(self.fields)
+        self.strings: int = header['strings']
+        self.split: bool = header['split']
+
+        self.offsets_start = start + header_size
+        self.blob_start = self.offsets_start + OFFSET.size * (self.strings + 1)
+        blob_size = OFFSET.unpack_from(buffer, self.offsets_start + OFFSET.size * self.strings)[0]
+        self.blocks_start = self.blob_start + blob_size
+
+    def string_table(self, buffer) -> List[Any]:
+        """Все строки: [None, строка 1, ...]"""
+        blob = buffer[self.blob_start:self.blocks_start]
+        if self.split:
+            table = blob.decode('utf-8').split('\0')
+            table.pop()
+        else:
+            offsets = struct.unpack_from(f'<{self.strings + 1}I', buffer, self.offsets_start)
+            table = [blob[a:b - 1].decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+        table.insert(0, None)
+        return table
+
+    def string_reader(self, buffer) -> Callable[[int], Any]:
+        """Чтение строки по номеру прямо из файла (без таблицы в памяти)"""
+        @functools.lru_cache(maxsize=65536)
+        def read(index: int):
+            if not index:
+                return None
+            a, b = OFFSET_PAIR.unpack_from(buffer, self.offsets_start + OFFSET.size * (index - 1))
+            return str(buffer[self.blob_start + a:self.blob_start + b - 1], 'utf-8')
+        return read
+
+    def blocks(self, buffer) -> Iterator[List[tuple]]:
+        """Столбцы блоков по очереди"""
+        position = self.blocks_start
+        remaining = self.count
+        while remaining:
+            if position + BLOCK.size > len(buffer):
+                raise ValueError("❌ Снимок обрезан")
+            length, n = BLOCK.unpack_from(buffer, position)
+            position += BLOCK.size
+            if position + length > len(buffer) or n > remaining:
+                raise ValueError("❌ Снимок обрезан")
+            offset = position
+            columns = []
+            for code in self.codes:
+                column = struct.Struct(f'<{n}{code}')
+                columns.append(column.unpack_from(buffer, offset))
+                offset += column.size
+            yield columns
+            position += length
+            remaining -= n
+
+    def decode(self, columns: List[tuple], resolve: Callable[[int], Any]) -> List[Dict[str, Any]]:
+        """Столбцы блока -> словари пользователей"""
+        presence, nulls = columns[0], columns[1]
+        columns = columns[2:]
+        # Различных масок немного: объединение по множеству вместо обхода записей
+        null_bits = functools.reduce(operator.or_, set(nulls), 0)
+
+        for bit, (_, code) in enumerate(self.fields):
+            column = columns[bit]
+            if code == 'I':
+                column = list(map(resolve, column))
+            elif code == 'J':
+                column = [json.loads(s) if s is not None else None for s in map(resolve, column)]
+            elif null_bits >> bit & 1:
+                flag = 1 << bit
+                column = [None if n & flag else v for v, n in zip(column, nulls)]
+            columns[bit] = column
+
+        users = list(map(dict, map(zip, itertools.repeat(self.names), zip(*columns))))
+
+        full = (1 << len(self.names)) - 1
+        if presence.count(full) != len(presence):
+            for user, p in zip(users, presence):
+                if p != full:
+                    for bit, name in enumerate(self.names):
+                        if not p >> bit & 1:
+                            del user[name]
+        return users
+
+
+def _open_map(path: str):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("❌ Пустой файл снимка")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_snapshot(path: str) -> List[Dict[str, Any]]:
+    """Загрузка всех пользователей из снимка"""
+    buffer = _open_map(path)
+    try:
+        layout = _Layout(buffer)
+        resolve = layout.string_table(buffer).__getitem__
+        users = []
+        with _gc_paused():
+            for columns in layout.blocks(buffer):
+                users.extend(layout.decode(columns, resolve))
+        return users
+    finally:
+        buffer.close()
+
+
+def iter_snapshot(path: str) -> Iterator[Dict[str, Any]]:
+    """Потоковое чтение снимка по блокам: память не зависит от числа пользователей"""
+    buffer = _open_map(path)
+    try:
+        layout = _Layout(buffer)
+        resolve = layout.string_reader(buffer)
+        for columns in layout.blocks(buffer):
+            yield from layout.decode(columns, resolve)
+    finally:
+        buffer.close()
+
+
+
+# --- Преобразование и замер -------------------------------------------------
+
+def _convert(source: str, target: str, to_binary: bool):
+    from database import atomic_write, atomic_write_json
+
+    started = time.perf_counter()
+    if to_binary:
+        with open(source, 'r') as f:
+            users = json.load(f)
+        size = atomic_write(target, lambda f: write_snapshot(f, users), binary=True)
+        restored = read_snapshot(target)
+    else:
+        users = read_snapshot(source)
+        size = atomic_write_json(target, users, indent=2)
+        with open(target, 'r') as f:
+            restored = json.load(f)
+
+    if restored != users:
+        os.remove(target)
+        raise SystemExit(f"❌ Данные после преобразования не совпали, {target} удалён")
+    print(f"✅ {source} -> {target}: {len(users)} пользователей, "
+          f"{os.path.getsize(source) / 1e6:.1f} -> {size / 1e6:.1f} МБ за {time.perf_counter() - started:.2f} с")
+
+
+def _synthetic_users(count: int) -> List[Dict[str, Any]]:
+    """Пользователи, похожие на настоящие (для замера)"""
+    import random
+    from datetime import datetime, timedelta
+
+    rnd = random.Random(42)
+    first = ['Александр', 'Мария', 'Иван', 'Анна', 'Дмитрий', 'Елена', 'Alex', 'Maria', 'Sergey', 'Olga']
+    last = [None, None, 'Иванов', 'Петрова', 'Smirnov', 'Kuznetsova']
+    base = datetime(2024, 1, 1)
+    users = []
+    for i in range(count):
+        username = f"user_{i}" if rnd.random() < 0.7 else None
+        registered = rnd.random() < 0.6
+        user = {
+            'id': 100_000_000 + i * 7,
+            'username': username,
+            'first_name': rnd.choice(first),
+            'last_name': rnd.choice(last),
+            'joined_at': (base + timedelta(seconds=i * 37, microseconds=rnd.randrange(10 ** 6))).isoformat(),
+            'is_active': rnd.random() < 0.95,
+            'profile_link': f"https://t.me/{username}" if username else None,
+            'photo_url': f"https://api.telegram.org/file/bot<token>/photos/file_{i}.jpg" if rnd.random() < 0.5 else None,
+            'phone': f"7{rnd.randrange(10 ** 10):010d}" if registered else None,
+            'internal_id': i + 1 if registered else None,
+            'synced_hash': '%040x' % rnd.getrandbits(160),
+        }
+        users.append(user)
+    return users
+
+
+def _bench(counts: Sequence[int]):
+    def timed(func):
+        started = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - started
+
+    def load_json(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save_json(path, users):
+        with open(path, 'w') as f:
+            json.dump(users, f, indent=2)
+
+    def save_binary(path, users):
+        with open(path, 'wb') as f:
+            write_snapshot(f, users)
+
+    def stream_binary(path):
+        return sum(1 for _ in iter_snapshot(path))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'users.json')
+        snap_path = os.path.join(tmp, 'users.snap')
+        print(f"{'польз.':>9} | {'формат':<7} | {'размер, МБ':>10} | {'запись, с':>9} | {'чтение, с':>9} | {'поток, с':>8}")
+        for count in counts:
+            users = _synthetic_users(count)
+            _, json_save = timed(lambda: save_json(json_path, users))
+            loaded, json_load = timed(lambda: load_json(json_path))
+            del loaded
+            _, snap_save = timed(lambda: save_binary(snap_path, users))
+            loaded, snap_load = timed(lambda: read_snapshot(snap_path))
+            assert loaded == users, "снимок не совпал с исходными данными"
+            del loaded
+            streamed, snap_stream = timed(lambda: stream_binary(snap_path))
+            assert streamed == count
+
+            print(f"{count:>9} | {'json':<7} | {os.path.getsize(json_path) / 1e6:>10.1f} | "
+                  f"{json_save:>9.2f} | {json_load:>9.2f} | {'-':>8}")
+            print(f"{count:>9} | {'binary':<7} | {os.path.getsize(snap_path) / 1e6:>10.1f} | "
+                  f"{snap_save:>9.2f} | {snap_load:>9.2f} | {snap_stream:>8.2f}")
+            del users
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Двоичный снимок пользователей бота')
+    sub = parser.add_subparsers(dest='command', required=True)
+    to_binary = sub.add_parser('to-binary', help='users.json -> users.snap')
+    to_binary.add_argument('source')
+    to_binary.add_argument('target')
+    to_json = sub.add_parser('to-json', help='users.snap -> users.json')
+    to_json.add_argument('source')
+    to_json.add_argument('target')
+    bench = sub.add_parser('bench', help='Сравнение с users.json на синтетических данных')
+    bench.add_argument('--users', type=int, nargs='+', default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        _bench(args.users)
+    else:
+        _convert(args.source, args.target, to_binary=args.command == 'to-binary')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - фоновая синхронизация с сайтом по команде /sync
+
+Синхронизация идёт отдельной задачей и не задерживает обработку обновлений.
+Ход работы показывается в одном сообщении на чат, которое периодически
+редактируется (не чаще раза в SYNC_PROGRESS_INTERVAL секунд). Повторный
+/sync во время работы не запускает вторую синхронизацию, а подключается к
+текущей.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from telegram import Message
+
+from progress import ProgressMessages
+from website import SyncReport
+
+logger = logging.getLogger(__name__)
+
+
+class SyncJob:
+    """Одна фоновая синхронизация и сообщения о её ходе"""
+
+    def __init__(self, full: bool = False, interval: float = 3.0):
+        self.full = full
+        self.report = SyncReport()
+        self.result: Optional[SyncReport] = None
+        self.error = False
+        self.finished = False
+        self.task: Optional[asyncio.Task] = None
+        self.progress = ProgressMessages(
+            self.text, interval, busy_text="🔄 Синхронизация уже идёт, ход - в сообщении выше."
+        )
+
+    def start(self, run: Callable[[SyncReport], Awaitable[Optional[SyncReport]]], spawn) -> asyncio.Task:
+        """Запуск синхронизации
+
+        run(report) - сама синхронизация (None при ошибке), spawn - функция
+        запуска фоновой задачи бота (coro, name) -> Task.
+        """
+        self.task = spawn(self._run(run), 'sync-job')
+        return self.task
+
+    async def wait(self) -> Optional[SyncReport]:
+        """Ожидание окончания (None - синхронизация завершилась ошибкой)"""
+        await asyncio.shield(self.task)
+        return self.result
+
+    async def attach(self, message: Message):
+        """Сообщение о ходе синхронизации в ответ на /sync"""
+        await self.progress.attach(message)
+        if self.finished:
+            # Синхронизация закончилась, пока отправлялось сообщение
+            await self.progress.refresh()
+
+    def text(self) -> str:
+        """Текст сообщения о ходе или итогах"""
+        report = self.result or self.report
+        elapsed = report.elapsed or (time.monotonic() - report.started)
+        rate = report.processed / elapsed if elapsed > 0 else 0.0
+        scope = "всех пользователей" if self.full else "изменённых пользователей"
+
+        if self.finished:
+            if self.error:
+                return "❌ Ошибка синхронизации. Все данные сохранены локально."
+            if not report.total:
+                return "📭 Нет изменённых пользователей для синхронизации"
+            title = "✅ Синхронизация завершена!" if not report.failed else "⚠️ Синхронизация завершена с ошибками"
+        else:
+            title = f"🔄 Синхронизация {scope}..."
+
+        return (
+            f"{title}\n\n"
+            f"📤 Отправлено: {report.succeeded}\n"
+            f"❌ Ошибок: {report.failed}\n"
+            f"📋 Найдено: {report.total}\n"
+            f"⚡ {rate:.1f} польз/с, {elapsed:.0f} с"
+        )
+
+    async def _run(self, run):
+        reporter = asyncio.create_task(self.progress.run())
+        try:
+            self.result = await run(self.report)
+            self.error = self.result is None
+        except Exception as e:
+            logger.error(f"❌ Ошибка фоновой синхронизации: {e}")
+            self.error = True
+        finally:
+            reporter.cancel()
+            self.finished = True
+        await self.progress.refresh()
+        return self.result
@@ -2,75 +2,138 @@
 # -*- coding: utf-8 -*-
 """
 Скрипт для синхронизации пользователей из JSON в SQLite на сайте
+
+Использует тот же движок массовой синхронизации, что и бот (BulkSyncer):
+несколько одновременных запросов через один пул соединений, повторы и
+(по --batch-size) пакетная отправка.
+
+Отправляются только пользователи, изменённые после последней успешной
+синхронизации (по хэшу содержимого в записи); --full отправляет всех.
+Данные читаются через DatabaseManager (движок из DB_STORAGE), и отметки
+синхронизации записываются в базу. Для json/journal каталог данных
+блокируется (data/users.lock): при работающем боте скрипт не запустится -
+остановите бота или используйте --stream.
+
+--stream (json/journal) читает снимок (users.json или users.snap)
+потоково, по одной записи: память не зависит от размера файла, а отправка
+начинается до окончания чтения. Файлы только читаются (без блокировки,
+можно при работающем боте), поэтому отметки синхронизации не
+записываются (следующий обычный запуск отправит этих пользователей ещё
+раз) - режим рассчитан на большие базы и --full.
 """
 
 import os
-import json
-import requests
 import sys
+import asyncio
+import argparse
+import itertools
+import logging
+
+from database import DataDirLockedError, DatabaseManager, select_changed, stream_users
+from website import WebsiteConnection, BulkSyncer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Синхронизация пользователей бота с сайтом')
+    parser.add_argument('--data-dir', default='data', help='Каталог данных бота')
+    parser.add_argument('--full', action='store_true',
+                        help='Отправить всех пользователей, а не только изменённых')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('SYNC_CONCURRENCY', '8')),
+                        help='Одновременных запросов к сайту')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('SYNC_BATCH_SIZE', '1')),
+                        help='Пользователей в одном запросе (1 - по одному через /api/users)')
+    parser.add_argument('--retries', type=int, default=3, help='Повторов на запрос')
+    parser.add_argument('--timeout', type=float, default=10, help='Таймаут запроса, с')
+    parser.add_argument('--stream', action='store_true',
+                        help='Потоковое чтение снимка без загрузки базы (json/journal, без отметок синхронизации)')
+    return parser.parse_args()
 
-def main():
+
+async def iter_in_thread(iterator, chunk_size: int = 500):
+    """Чтение итератора порциями в отдельном потоке (цикл событий не блокируется)"""
+    while True:
+        chunk = await asyncio.to_thread(lambda: list(itertools.islice(iterator, chunk_size)))
+        if not chunk:
+            return
+        for item in chunk:
+            yield item
+
+
+async def main():
     """Синхронизация всех пользователей"""
-    
-    # Путь к JSON файлу
-    users_file = os.path.join('data', 'users.json')
-    
-    if not os.path.exists(users_file):
-        print("❌ Файл users.json не найден!")
+    args = parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.WARNING)
+
+    if not os.path.isdir(args.data_dir):
+        print("❌ Каталог данных бота не найден!")
         sys.exit(1)
-    
-    # Загружаем пользователей
-    with open(users_file, 'r') as f:
-        users = json.load(f)
-    
-    if not users:
-        print("📭 Нет пользователей для синхронизации")
-        sys.exit(0)
-    
-    print(f"📊 Найдено {len(users)} пользователей")
-    
+
+    storage = os.getenv('DB_STORAGE', 'json')
+    if args.stream and storage not in ('json', 'journal'):
+        print(f"ℹ️ --stream только для json/journal, {storage} и так читается постранично")
+        args.stream = False
+
+    db = None
+    if args.stream:
+        # Генератор: файл -> фильтр изменённых -> отправка, без списка в памяти
+        users = iter_in_thread(select_changed(stream_users(args.data_dir), full=args.full))
+        on_synced = None
+        print(f"📊 Потоковое чтение {args.data_dir}, отправляются {'все' if args.full else 'изменённые'}")
+    else:
+        # Загружаем пользователей
+        db = DatabaseManager(args.data_dir)
+        try:
+            db.initialize()
+        except DataDirLockedError as e:
+            print(f"{e}\n"
+                  "ℹ️ Похоже, работает бот: остановите его или запустите с --stream (только чтение)")
+            sys.exit(1)
+
+        total = db.stats.total
+        if not total:
+            print("📭 Нет пользователей для синхронизации")
+            db.close()
+            sys.exit(0)
+
+        users = db.iter_users_async(source=lambda: db.iter_changed(full=args.full))
+        on_synced = lambda synced: db.run(db.mark_synced_many, synced)
+        print(f"📊 Найдено {total} пользователей, отправляются {'все' if args.full else 'изменённые'}")
+
     # Настройки подключения
     website_url = os.getenv('WEBSITE_URL', 'https://savos-club-two.vercel.app')
     api_key = os.getenv('API_KEY', 'savosbot2024')
-    
-    # Синхронизируем каждого пользователя
-    success_count = 0
-    error_count = 0
-    
-    for user in users:
-        try:
-            print(f"\n📤 Отправка пользователя {user.get('id')} ({user.get('first_name')})...")
-            
-            response = requests.post(
-                f"{website_url}/api/users",
-                json={
-                    **user,
-                    'source': 'telegram_bot_sync'
-                },
-                headers={
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json'
-                },
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                print(f"✅ Пользователь {user.get('id')} успешно синхронизирован (internal_id: {result.get('internal_id')})")
-                success_count += 1
-            else:
-                print(f"⚠️ Ошибка синхронизации {user.get('id')}: {response.status_code}")
-                error_count += 1
-                
-        except Exception as e:
-            print(f"❌ Ошибка при отправке {user.get('id')}: {e}")
-            error_count += 1
-    
+
+    website = WebsiteConnection(website_url, api_key, timeout=args.timeout, pool_size=args.concurrency)
+    syncer = BulkSyncer(
+        website,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        retries=args.retries
+    )
+
+    await website.start()
+    try:
+        if db:
+            # Отметки записываются один раз в конце синхронизации
+            async with db.deferred_sync_marks():
+                report = await syncer.sync(users, on_synced=on_synced)
+        else:
+            report = await syncer.sync(users, on_synced=on_synced)
+    finally:
+        await website.close()
+        if db:
+            db.close()
+
     print(f"\n{'='*50}")
-    print(f"✅ Успешно: {success_count}")
-    print(f"❌ Ошибок: {error_count}")
+    print(f"📤 Изменённых: {report.total}")
+    print(f"✅ Успешно: {report.succeeded}")
+    print(f"❌ Ошибок: {report.failed}")
+    print(f"⏱️ Время: {report.elapsed:.1f} с ({report.rate:.1f} польз/с)")
+    print(f"🔁 Запросов: {report.requests}, повторов: {report.retries}")
+    if report.failed_ids:
+        print(f"⚠️ Не синхронизированы: {', '.join(str(i) for i in report.failed_ids)}")
     print(f"{'='*50}")
 
-if __name__ == '__main__':
-    main()
 
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Общие настройки тестов: модули бота лежат плоско в telegram-bot-files/"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager, create_storage  # noqa: E402
+
+ENGINES = ('json', 'journal', 'sqlite')
+
+
+@pytest.fixture(autouse=True)
+def _clean_env(monkeypatch):
+    """Настройки из окружения разработчика не влияют на тесты"""
+    for name in ('DB_STORAGE', 'DB_SNAPSHOT_FORMAT', 'DB_COMPACT_RECORDS', 'STATS_FLUSH_INTERVAL'):
+        monkeypatch.delenv(name, raising=False)
+
+
+@pytest.fixture
+def open_db(tmp_path):
+    """open_db(движок) - открытая база во временном каталоге (закрывается после теста)"""
+    opened = []
+
+    def factory(kind: str = 'json', data_dir=None, **kwargs) -> DatabaseManager:
+        data_dir = str(data_dir or tmp_path)
+        db = DatabaseManager(data_dir, storage=create_storage(data_dir, kind), **kwargs)
+        db.initialize()
+        opened.append(db)
+        return db
+
+    yield factory
+    for db in opened:
+        try:
+            db.close()
+        except Exception:
+            pass
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Движки хранения: сохранение и перечитывание, сбой записи, журнал"""
+
+import json
+import os
+
+import pytest
+
+import database
+from conftest import ENGINES
+from database import JournalStorage
+
+
+def _profile(user_id: int, **fields):
+    return {'id': user_id, 'first_name': f'User{user_id}', 'username': f'user{user_id}',
+            'is_active': True, 'joined_at': '2026-01-02T03:04:05', **fields}
+
+
+@pytest.mark.parametrize('kind', ENGINES)
+def test_round_trip(open_db, tmp_path, kind):
+    db = open_db(kind)
+    db.save_user(_profile(1))
+    db.save_user(_profile(2, last_name='Иванов', extra_field={'nested': [1, 2]}))
+    registered = db.register_phone(1, '79990000001')
+    db.save_user({'id': 2, 'is_active': False})
+    db.close()
+
+    db = open_db(kind, tmp_path)
+    assert db.get_user(1)['phone'] == '79990000001'
+    assert db.get_user(1)['internal_id'] == registered['internal_id'] == 1
+    assert db.get_user_by_phone('79990000001')['id'] == 1
+    assert db.get_user_by_internal_id(1)['id'] == 1
+    assert db.get_user(2)['last_name'] == 'Иванов'
+    assert db.get_user(2)['is_active'] is False
+    assert db.pending_sync() == [1]
+    stats = db.get_statistics()
+    assert (stats['total_users'], stats['active_users'], stats['registered_users']) == (2, 1, 1)
+
+    # Последовательность переживает перезапуск: номер не выдаётся повторно
+    assert db.register_phone(2, '79990000002')['internal_id'] == 2
+
+
+def test_binary_snapshot_round_trip(open_db, tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_SNAPSHOT_FORMAT', 'binary')
+    db = open_db('json')
+    db.save_user(_profile(1, phone='79990000001'))
+    db.close()
+    assert os.path.exists(tmp_path / 'users.snap')
+
+    db = open_db('json', tmp_path)
+    assert db.get_user(1)['phone'] == '79990000001'
+
+
+@pytest.mark.parametrize('kind', ('json', 'journal'))
+def test_failed_write_leaves_memory_unchanged(open_db, monkeypatch, kind):
+    db = open_db(kind)
+    db.save_user(_profile(1))
+    before = (db.get_user(1), db.pending_sync(), db.get_statistics()['registered_users'])
+
+    def broken(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(database, 'atomic_write', broken)
+    monkeypatch.setattr(JournalStorage, '_persist_many', broken)
+
+    assert db.register_phone(1, '79990000001') is None
+    assert db.register_phone(2, '79990000002', _profile(2)) is None
+    assert (db.get_user(1), db.pending_sync(), db.get_statistics()['registered_users']) == before
+    assert db.get_user(2) is None
+    assert db.get_user_by_phone('79990000001') is None
+    assert db.get_user_by_internal_id(1) is None
+
+    # После восстановления диска номер выдаётся с начала
+    monkeypatch.undo()
+    assert db.register_phone(1, '79990000001')['internal_id'] == 1
+
+
+def test_failed_sqlite_write_leaves_database_unchanged(open_db):
+    db = open_db('sqlite')
+    db.save_user(_profile(1))
+    before = (db.get_user(1), db.pending_sync(), db.get_statistics()['registered_users'])
+    for event in ('INSERT', 'UPDATE'):
+        db.storage.conn.execute(
+            f"CREATE TRIGGER fail_{event.lower()} BEFORE {event} ON users "
+            "BEGIN SELECT RAISE(ABORT, 'disk I/O error'); END"
+        )
+
+    assert db.register_phone(1, '79990000001') is None
+    assert db.register_phone(2, '79990000002', _profile(2)) is None
+    assert (db.get_user(1), db.pending_sync(), db.get_statistics()['registered_users']) == before
+    assert db.get_user(2) is None
+
+
+@pytest.mark.parametrize('kind', ('json', 'journal'))
+def test_failed_sync_mark_keeps_user_queued(open_db, monkeypatch, kind):
+    db = open_db(kind)
+    db.save_user(_profile(1, phone='79990000001'))
+    sent = db.get_sync_payload(1)
+
+    def broken(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(type(db.storage), '_persist_many', broken)
+    with pytest.raises(OSError):
+        db.mark_synced(1, sent)
+    assert db.mark_synced_many([sent]) == [False]
+    assert db.pending_sync() == [1]
+    assert db.get_user(1)['sync_pending'] is True
+    assert 'synced_hash' not in db.get_user(1)
+
+    monkeypatch.undo()
+    assert db.mark_synced(1, sent) is True
+    assert db.pending_sync() == []
+
+
+def test_journal_compaction_and_replay(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_bytes=10 ** 9)
+    storage.open()
+    for user_id in range(1, 51):
+        storage.upsert(_profile(user_id), allocate_internal_id=True)
+    storage.compact(wait=True)
+    assert not os.path.exists(storage.old_journal_file)
+    assert len(json.load(open(tmp_path / 'users.json'))) == 50
+
+    # Изменения после сжатия - только в журнале
+    storage.upsert({'id': 7, 'phone': '79990000007'}, enqueue=True)
+    storage.close()
+
+    reopened = JournalStorage(str(tmp_path))
+    reopened.open()
+    assert reopened.count() == 50
+    assert reopened.get(7)['phone'] == '79990000007'
+    assert 7 in reopened.outbox
+    assert reopened.internal_id_seq == 50
+    reopened.close()
+
+
+def test_journal_drops_truncated_tail(tmp_path):
+    storage = JournalStorage(str(tmp_path))
+    storage.open()
+    storage.upsert(_profile(1))
+    storage.close()
+    with open(tmp_path / 'users.journal', 'ab') as f:
+        f.write(b'{"id": 2, "first_na')
+
+    reopened = JournalStorage(str(tmp_path))
+    reopened.open()
+    assert [u['id'] for u in reopened.iter_users()] == [1]
+    reopened.upsert(_profile(3))
+    reopened.close()
+
+    again = JournalStorage(str(tmp_path))
+    again.open()
+    assert sorted(u['id'] for u in again.iter_users()) == [1, 3]
+    again.close()
+
+
+def test_stream_users_prefers_journal(tmp_path):
+    storage = JournalStorage(str(tmp_path), compact_bytes=10 ** 9)
+    storage.open()
+    storage.upsert(_profile(1))
+    storage.upsert(_profile(2))
+    storage.compact(wait=True)
+    storage.upsert({'id': 2, 'first_name': 'Renamed'})
+    storage.close()
+
+    users = {u['id']: u for u in database.stream_users(str(tmp_path))}
+    assert users[1]['first_name'] == 'User1'
+    assert users[2]['first_name'] == 'Renamed'
+
+
+def test_compaction_keeps_unfinished_old_journal(tmp_path, monkeypatch):
+    storage = JournalStorage(str(tmp_path), compact_bytes=10 ** 9)
+    storage.open()
+    storage.upsert(_profile(1))
+    storage.compact(wait=True)
+
+    def broken(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    # Снимок не записывается: изменения остаются только в users.journal.old
+    monkeypatch.setattr(database, 'write_users_snapshot', broken)
+    storage.upsert({'id': 1, 'phone': '79990000001'})
+    storage.compact(wait=True)
+    storage.upsert(_profile(2))
+    storage.compact(wait=True)
+    assert os.path.exists(storage.old_journal_file)
+    assert not os.path.getsize(storage.journal_file)
+
+    # Падение процесса до записи снимка: всё восстанавливается из .old
+    storage._journal.close()
+    storage.lock.release()
+    monkeypatch.undo()
+    reopened = JournalStorage(str(tmp_path))
+    reopened.open()
+    assert reopened.get(1)['phone'] == '79990000001'
+    assert reopened.get(2) is not None
+    assert not os.path.exists(reopened.old_journal_file)
+    reopened.close()
+
+
+def test_failed_rotation_keeps_journal_writable(tmp_path, monkeypatch):
+    storage = JournalStorage(str(tmp_path), compact_bytes=1)
+
+    def broken(*args, **kwargs):
+        raise OSError('rename failed')
+
+    storage.open()
+    monkeypatch.setattr(JournalStorage, '_rotate_journal', broken)
+    storage.upsert(_profile(1))
+    storage.upsert(_profile(2))
+    monkeypatch.undo()
+    storage.close()
+
+    reopened = JournalStorage(str(tmp_path))
+    reopened.open()
+    assert sorted(u['id'] for u in reopened.iter_users()) == [1, 2]
+    reopened.close()
+
+
+@pytest.mark.parametrize('kind', ('json', 'journal'))
+def test_data_dir_is_locked_while_open(open_db, tmp_path, kind):
+    db = open_db(kind)
+    db.save_user(_profile(1))
+
+    with pytest.raises(database.DataDirLockedError):
+        database.DatabaseManager(str(tmp_path), storage=database.create_storage(str(tmp_path), kind)).initialize()
+    with pytest.raises(database.DataDirLockedError):
+        JournalStorage(str(tmp_path)).open()
+    # Потоковое чтение не блокирует и не мешает
+    assert [u['id'] for u in database.stream_users(str(tmp_path))] == [1]
+
+    db.close()
+    reopened = open_db(kind, tmp_path)
+    assert reopened.get_user(1) is not None
+
+
+def test_sqlite_is_not_locked(open_db, tmp_path):
+    open_db('sqlite')
+    second = open_db('sqlite', tmp_path)
+    assert second.get_user(1) is None
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Маскировка телефонов и токенов в логах"""
+
+import pytest
+
+from logging_setup import mask_phone, redact, redact_field
+
+
+@pytest.mark.parametrize('value, masked', [
+    ('+79991234567', '+*********67'),
+    ('79991234567', '*********67'),
+    ('+7 (999) 123-45-67', '+*********67'),
+    ('', ''),
+])
+def test_mask_phone(value, masked):
+    assert mask_phone(value) == masked
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Телефон +79991234567 сохранён', 'Телефон +*********67 сохранён'),
+    ('phone=8 (999) 123-45-67.', 'phone=*********67.'),
+    # id пользователей, даты и id групп не похожи на телефон
+    ('user_id=1234567890', 'user_id=1234567890'),
+    ('2026-10-18 12:00:00', '2026-10-18 12:00:00'),
+    ('chat -1001234567890', 'chat -1001234567890'),
+    ('https://api.telegram.org/bot123456:ABCdefGHIjklMNOpqrSTUvwx/getMe',
+     'https://api.telegram.org/bot<token>/getMe'),
+])
+def test_redact(text, expected):
+    assert redact(text) == expected
+
+
+def test_redact_field():
+    assert redact_field('phone', 79991234567) == '*********67'
+    assert redact_field('text', 'секрет') == '<6 симв.>'
+    assert redact_field('error', 'bot1:abcdefghijklmnopqrstuvwxyz failed') == 'bot<token> failed'
+    assert redact_field('user_id', 42) == 42
+    assert redact_field('phone', None) is None
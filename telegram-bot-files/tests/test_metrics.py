@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Текстовый формат метрик"""
+
+import math
+
+from metrics import MetricsRegistry
+
+
+def test_special_values_use_prometheus_spelling():
+    registry = MetricsRegistry()
+    gauge = registry.gauge('test_value', 'Значение', ['case'])
+    gauge.set(math.inf, case='plus')
+    gauge.set(-math.inf, case='minus')
+    gauge.set(2.0, case='integer')
+    gauge.set(0.25, case='fraction')
+    # Сбой функции выдаётся как NaN
+    gauge.set_function(lambda: 1 / 0, case='broken')
+
+    lines = registry.render().splitlines()
+    assert 'test_value{case="plus"} +Inf' in lines
+    assert 'test_value{case="minus"} -Inf' in lines
+    assert 'test_value{case="broken"} NaN' in lines
+    assert 'test_value{case="integer"} 2' in lines
+    assert 'test_value{case="fraction"} 0.25' in lines
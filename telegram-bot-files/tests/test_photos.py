@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Фото профиля: запись пользователя только при смене картинки"""
+
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import ENGINES
+from photos import ProfilePhotoResolver
+
+
+class FakeBot:
+    """get_file каждый раз отдаёт новую ссылку (как ссылка с токеном)"""
+
+    def __init__(self):
+        self.unique_id = 'photo-a'
+        self._links = itertools.count(1)
+
+    async def get_user_profile_photos(self, user_id, limit=1):
+        if self.unique_id is None:
+            return SimpleNamespace(total_count=0, photos=[])
+        photo = SimpleNamespace(file_id=f'file-{self.unique_id}', file_unique_id=self.unique_id)
+        return SimpleNamespace(total_count=1, photos=[[photo]])
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=f'https://api.telegram.org/file/bot{next(self._links)}/{file_id}.jpg')
+
+
+@pytest.mark.parametrize('kind', ENGINES)
+def test_photo_written_only_when_picture_changes(open_db, kind):
+    db = open_db(kind)
+    db.save_user({'id': 1, 'first_name': 'u', 'photo_url': None})
+    bot = FakeBot()
+    updates = []
+    # ttl=0: кэш get_file не помогает, ссылка меняется при каждой проверке
+    photos = ProfilePhotoResolver(db, ttl=0, on_update=lambda: updates.append(1))
+
+    async def refresh():
+        await photos.refresh(bot, 1)
+        return db.get_user(1)
+
+    first = asyncio.run(refresh())
+    assert first['photo_unique_id'] == 'photo-a'
+    assert first['photo_url']
+
+    for _ in range(3):
+        assert asyncio.run(refresh()) == first
+    assert len(updates) == 1
+
+    bot.unique_id = 'photo-b'
+    assert asyncio.run(refresh())['photo_unique_id'] == 'photo-b'
+    bot.unique_id = None
+    removed = asyncio.run(refresh())
+    assert (removed['photo_url'], removed['photo_unique_id']) == (None, None)
+    assert len(updates) == 3
+
+
+def test_photo_id_added_to_old_records(open_db):
+    # Запись до появления photo_unique_id: один раз дописывается
+    db = open_db('json')
+    db.save_user({'id': 1, 'first_name': 'u', 'photo_url': 'https://old/link.jpg'})
+    photos = ProfilePhotoResolver(db, ttl=0)
+    bot = FakeBot()
+
+    asyncio.run(photos.refresh(bot, 1))
+    user = db.get_user(1)
+    assert user['photo_unique_id'] == 'photo-a'
+    asyncio.run(photos.refresh(bot, 1))
+    assert db.get_user(1) == user
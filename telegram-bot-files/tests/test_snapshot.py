@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Двоичный снимок users.snap и потоковое чтение users.json"""
+
+import json
+
+import pytest
+
+from database import iter_json_array
+from snapshot import iter_snapshot, read_snapshot, write_snapshot
+
+USERS = [
+    {'id': 1, 'first_name': 'Анна', 'username': None, 'is_active': True, 'joined_at': '2026-01-02T03:04:05',
+     'phone': '79990000001', 'internal_id': 1, 'synced_hash': 'ab' * 8},
+    {'id': 2 ** 40, 'first_name': 'Анна', 'is_active': False, 'score': 1.5},
+    {'id': 3, 'first_name': 'nul\u0000byte', 'tags': ['a', {'b': None}], 'internal_id': 2 ** 62},
+    {'id': 4, 'mixed': 1},
+    {'id': 5, 'mixed': 'text'},
+    {'id': 6},
+]
+
+
+@pytest.mark.parametrize('block_size', (1, 2, 8192))
+def test_binary_snapshot_round_trip(tmp_path, block_size):
+    path = tmp_path / 'users.snap'
+    with open(path, 'wb') as f:
+        write_snapshot(f, USERS, block_size=block_size)
+
+    assert read_snapshot(str(path)) == USERS
+    assert list(iter_snapshot(str(path))) == USERS
+
+
+def test_binary_snapshot_empty(tmp_path):
+    path = tmp_path / 'users.snap'
+    with open(path, 'wb') as f:
+        write_snapshot(f, [])
+    assert read_snapshot(str(path)) == []
+
+
+@pytest.mark.parametrize('buffer_size', (1, 3, 7, 64 * 1024))
+@pytest.mark.parametrize('indent', (None, 2))
+def test_iter_json_array(tmp_path, buffer_size, indent):
+    # Числа и строки на границе буфера не должны обрываться
+    items = [*USERS[:2], 1234567890123, -0.5, 'строка', [], {}, None, True]
+    path = tmp_path / 'users.json'
+    path.write_text(json.dumps(items, ensure_ascii=False, indent=indent), encoding='utf-8')
+
+    assert list(iter_json_array(str(path), buffer_size=buffer_size)) == items
+
+
+@pytest.mark.parametrize('text', ('[]', ' [ ] ', '\n[\n]\n'))
+def test_iter_json_array_empty(tmp_path, text):
+    path = tmp_path / 'users.json'
+    path.write_text(text)
+    assert list(iter_json_array(str(path), buffer_size=1)) == []
+
+
+@pytest.mark.parametrize('text', ('{"id": 1}', '[1 2]', '[1, 2', ''))
+def test_iter_json_array_rejects_malformed(tmp_path, text):
+    path = tmp_path / 'users.json'
+    path.write_text(text)
+    with pytest.raises(ValueError):
+        list(iter_json_array(str(path), buffer_size=2))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Параллельная обработка обновлений с порядком в пределах пользователя"""
+
+import asyncio
+import random
+import time
+
+from telegram import Update
+
+from fake_telegram import SyntheticUpdates
+from update_processor import PerUserUpdateProcessor
+
+
+def test_per_user_order_is_kept():
+    generator = SyntheticUpdates()
+    rng = random.Random(1)
+    handled = []
+
+    async def handle(user_id, number):
+        await asyncio.sleep(rng.uniform(0, 0.005))
+        handled.append((user_id, number))
+
+    async def run():
+        processor = PerUserUpdateProcessor(8)
+        tasks = []
+        for number in range(20):
+            for user_id in range(1, 11):
+                update = Update.de_json(generator.command(user_id, '/start'), None)
+                tasks.append(asyncio.create_task(processor.process_update(update, handle(user_id, number))))
+        await asyncio.gather(*tasks)
+        return processor
+
+    processor = asyncio.run(run())
+    for user_id in range(1, 11):
+        assert [n for u, n in handled if u == user_id] == list(range(20))
+    assert processor.active_keys == 0
+    assert processor.current_concurrent_updates == 0
+
+
+def test_one_busy_user_does_not_block_others():
+    generator = SyntheticUpdates()
+    finished = {}
+
+    async def handle(user_id, delay):
+        await asyncio.sleep(delay)
+        finished.setdefault(user_id, time.monotonic())
+
+    async def run():
+        processor = PerUserUpdateProcessor(4)
+        started = time.monotonic()
+        # Очередь одного пользователя длиннее числа слотов
+        tasks = [
+            asyncio.create_task(processor.process_update(
+                Update.de_json(generator.command(1, '/start'), None), handle(1, 0.05)))
+            for _ in range(10)
+        ]
+        tasks += [
+            asyncio.create_task(processor.process_update(
+                Update.de_json(generator.command(user_id, '/start'), None), handle(user_id, 0)))
+            for user_id in range(2, 6)
+        ]
+        await asyncio.gather(*tasks)
+        return started
+
+    started = asyncio.run(run())
+    assert all(finished[user_id] - started < 0.2 for user_id in range(2, 6))
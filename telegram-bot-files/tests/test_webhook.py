@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Приём обновлений webhook: секретный токен и маршруты"""
+
+import asyncio
+
+import aiohttp
+
+from webhook import SECRET_HEADER, WebhookServer
+
+
+def test_secret_token_and_routes():
+    received = []
+
+    def broken(data):
+        raise ValueError('not an update')
+
+    async def run():
+        server = WebhookServer(listen='127.0.0.1', port=0, secret_token='s3cret')
+        server.add_handler('/telegram', received.append)
+        server.add_handler('/broken', broken)
+        await server.start()
+        url = f"http://127.0.0.1:{server._runner.addresses[0][1]}"
+        statuses = []
+        try:
+            async with aiohttp.ClientSession() as session:
+                for path, headers, body in [
+                    ('/telegram', {SECRET_HEADER: 's3cret'}, b'{"update_id": 1}'),
+                    ('/telegram', {SECRET_HEADER: 'wrong'}, b'{"update_id": 2}'),
+                    ('/telegram', {}, b'{"update_id": 3}'),
+                    ('/telegram', {SECRET_HEADER: 's3cret'}, b'not json'),
+                    ('/broken', {SECRET_HEADER: 's3cret'}, b'{"update_id": 4}'),
+                    ('/other', {SECRET_HEADER: 's3cret'}, b'{"update_id": 5}'),
+                ]:
+                    async with session.post(f"{url}{path}", data=body, headers=headers) as response:
+                        statuses.append(response.status)
+        finally:
+            await server.stop()
+        return statuses
+
+    assert asyncio.run(run()) == [200, 403, 403, 400, 400, 404]
+    assert received == [{'update_id': 1}]
+
+
+def test_without_secret_accepts_any_request():
+    received = []
+
+    async def run():
+        server = WebhookServer(listen='127.0.0.1', port=0)
+        server.add_handler('/telegram', received.append)
+        await server.start()
+        url = f"http://127.0.0.1:{server._runner.addresses[0][1]}/telegram"
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json={'update_id': 1}) as response:
+                    return response.status
+        finally:
+            await server.stop()
+
+    assert asyncio.run(run()) == 200
+    assert received == [{'update_id': 1}]
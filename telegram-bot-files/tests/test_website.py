@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Очередь отправки на сайт и массовая синхронизация"""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import database
+from fake_website import FakeWebsite
+from website import BulkSyncer, CircuitBreaker, OutboxWorker, WebsiteConnection
+
+# Ответ сайта по id пользователя: (статус, тело)
+ANSWERS = {
+    1: (200, ''),
+    2: (201, 'not json'),
+    3: (422, '{"error": "bad phone"}'),
+    4: (503, ''),
+    5: (429, ''),
+}
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_post('/api/users', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+def test_outbox_status_handling(open_db):
+    db = open_db('json')
+    for user_id in ANSWERS:
+        db.save_user({'id': user_id, 'first_name': 'u', 'phone': f'7999000000{user_id}'})
+    hits = {}
+
+    async def users(request):
+        user_id = (await request.json())['id']
+        hits[user_id] = hits.get(user_id, 0) + 1
+        status, text = ANSWERS[user_id]
+        return web.Response(status=status, text=text)
+
+    async def run():
+        runner, url = await _serve(users)
+        website = WebsiteConnection(url, 'key', breaker=CircuitBreaker(failure_threshold=10 ** 6))
+        await website.start()
+        try:
+            outbox = OutboxWorker(db, website, base_delay=0.01, max_delay=0.01)
+            for _ in range(3):
+                await outbox.drain()
+                await asyncio.sleep(0.05)
+        finally:
+            await website.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+    # 2xx принят независимо от тела, 4xx не повторяется, 5xx и 429 остаются в очереди
+    assert db.pending_sync() == [4, 5]
+    assert hits[1] == hits[2] == hits[3] == 1
+    assert hits[4] > 1 and hits[5] > 1
+    # Отклонённый сайтом пользователь не считается отправленным
+    assert 3 in {u['id'] for u in db.iter_changed(with_phone=True)}
+    db.save_user({'id': 3, 'first_name': 'fixed'})
+    assert 3 in db.pending_sync()
+
+
+@pytest.mark.parametrize('batch', (True, False))
+def test_bulk_sync_batches(batch):
+    fake = FakeWebsite(api_key='key', batch=batch)
+    users = [{'id': user_id, 'first_name': 'u'} for user_id in range(1, 26)]
+    acked = []
+
+    async def run():
+        url = await fake.start(port=0)
+        website = WebsiteConnection(url, 'key')
+        await website.start()
+        try:
+            syncer = BulkSyncer(website, concurrency=2, batch_size=10, ack_batch=5)
+            return await syncer.sync(users, on_synced=acked.append)
+        finally:
+            await website.close()
+            await fake.stop()
+
+    report = asyncio.run(run())
+
+    assert (report.total, report.succeeded, report.failed) == (25, 25, 0)
+    assert sorted(u['id'] for chunk in acked for u in chunk) == list(range(1, 26))
+    assert len(fake.users) == 25
+    if batch:
+        assert fake.requests['/api/sync-bot-users'] == 3
+        assert fake.requests['/api/users'] == 0
+    else:
+        # Пакетного endpoint нет: после первого 404 - по одному
+        assert fake.requests['/api/users'] == 25
+
+
+def test_bulk_sync_retries_server_errors():
+    fake = FakeWebsite(api_key='key', error_rate=0.3, seed=1)
+    users = [{'id': user_id, 'first_name': 'u'} for user_id in range(1, 41)]
+
+    async def run():
+        url = await fake.start(port=0)
+        # Автомат защиты не должен открыться от случайной серии ошибок
+        website = WebsiteConnection(url, 'key', breaker=CircuitBreaker(failure_threshold=10 ** 6))
+        await website.start()
+        try:
+            syncer = BulkSyncer(website, concurrency=4, retries=10, retry_delay=0.001)
+            return await syncer.sync(users)
+        finally:
+            await website.close()
+            await fake.stop()
+
+    report = asyncio.run(run())
+    assert report.succeeded == 40
+    assert report.retries > 0
+    assert len(fake.users) == 40
+
+
+def test_outbox_backs_off_when_marking_fails(open_db, monkeypatch):
+    db = open_db('json')
+    for user_id in (1, 2, 3):
+        db.save_user({'id': user_id, 'first_name': 'u', 'phone': f'7999000000{user_id}'})
+    hits = {}
+
+    async def users(request):
+        user_id = (await request.json())['id']
+        hits[user_id] = hits.get(user_id, 0) + 1
+        return web.json_response({'status': 'success'})
+
+    mark_synced = db.mark_synced
+
+    def flaky(user_id, sent):
+        if user_id == 2:
+            raise OSError('No space left on device')
+        return mark_synced(user_id, sent)
+
+    monkeypatch.setattr(db, 'mark_synced', flaky)
+
+    async def run():
+        runner, url = await _serve(users)
+        website = WebsiteConnection(url, 'key')
+        await website.start()
+        try:
+            outbox = OutboxWorker(db, website, base_delay=60)
+            waits = [await outbox.drain() for _ in range(3)]
+            return outbox, waits
+        finally:
+            await website.close()
+            await runner.cleanup()
+
+    outbox, waits = asyncio.run(run())
+
+    # Остальные отмечены, сбойный отложен с паузой, а не отправляется по кругу
+    assert db.pending_sync() == [2]
+    assert hits == {1: 1, 2: 1, 3: 1}
+    assert all(wait >= 20 for wait in waits)
+    assert outbox._attempts[2] == 1
+
+
+def test_bulk_sync_writes_json_once(open_db, tmp_path, monkeypatch):
+    db = open_db('json')
+    for user_id in range(1, 26):
+        db.save_user({'id': user_id, 'first_name': 'u', 'phone': f'79990{user_id:06d}'})
+    fake = FakeWebsite(api_key='key', batch=True)
+    writes = []
+    write_users_snapshot = database.write_users_snapshot
+
+    def counting(*args, **kwargs):
+        writes.append(args[0])
+        return write_users_snapshot(*args, **kwargs)
+
+    monkeypatch.setattr(database, 'write_users_snapshot', counting)
+
+    async def run():
+        url = await fake.start(port=0)
+        website = WebsiteConnection(url, 'key')
+        await website.start()
+        try:
+            syncer = BulkSyncer(website, concurrency=2, batch_size=5, ack_batch=5)
+            async with db.deferred_sync_marks():
+                report = await syncer.sync(db.iter_users_async(source=db.iter_changed),
+                                           on_synced=lambda synced: db.run(db.mark_synced_many, synced))
+                # До конца синхронизации отметки только в памяти
+                assert writes == []
+            return report
+        finally:
+            await website.close()
+            await fake.stop()
+
+    report = asyncio.run(run())
+
+    # Пять подтверждённых пачек - одна перезапись users.json
+    assert report.succeeded == 25
+    assert len(writes) == 1
+    db.close()
+    assert list(open_db('json', tmp_path).iter_changed()) == []
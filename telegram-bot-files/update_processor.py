@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - параллельная обработка обновлений
+
+Обновления разных пользователей обрабатываются одновременно (до
+max_concurrent_updates), а обновления одного пользователя - строго по
+порядку поступления: каждое ждёт блокировку своего пользователя.
+Блокировка берётся до общего семафора, поэтому очередь одного
+пользователя занимает не больше одного слота и не задерживает остальных.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка с последовательностью в пределах пользователя"""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[Any, asyncio.Lock] = {}
+        self._waiters: Dict[Any, int] = {}
+
+    @staticmethod
+    def update_key(update: object) -> Optional[Any]:
+        """Ключ очерёдности: пользователь, иначе чат; None - без очерёдности"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return ('user', update.effective_user.id)
+            if update.effective_chat:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Сначала очередь пользователя, потом слот общего семафора"""
+        key = self.update_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            # Блокировки удаляются, когда у пользователя нет ожидающих обновлений
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    @property
+    def active_keys(self) -> int:
+        """Пользователей с обновлениями в обработке или в ожидании"""
+        return len(self._locks)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - компактная запись пользователя для хранилища в памяти
+
+Движки json/journal держат всех пользователей в памяти. Обычный словарь
+на десяток ключей со строками дат, хэшей и ссылок занимает около
+килобайта, поэтому при миллионе участников база весит гигабайты.
+UserRecord хранит те же данные в __slots__:
+
+- joined_at - целое число микросекунд (строка ISO восстанавливается
+  при чтении; значения другого вида лежат в extra как есть);
+- synced_hash - 20 байт вместо 40-символьной hex-строки;
+- profile_link не хранится, если совпадает с https://t.me/{username};
+- is_active, sync_pending и признак ссылки - два бита на поле в одном
+  небольшом целом; отсутствующие ключи и None места не занимают;
+- first_name/last_name интернируются (одинаковые имена - одна строка);
+- остальные ключи - в словаре extra, который создаётся только при нужде.
+
+Снаружи запись ведёт себя как словарь (MutableMapping): тот же набор
+ключей и значений, поэтому public_user(), content_hash() и сборка данных
+для сайта работают без изменений. copy() возвращает обычный dict - для
+записи на диск и для вызывающего кода.
+
+Отчёт о расходе памяти (байт на пользователя, dict и UserRecord):
+
+    python3 user_record.py --users 100000
+    python3 user_record.py --data-dir data
+"""
+
+import sys
+import operator
+import itertools
+import collections
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_ABSENT = object()
+
+# Поля в слотах (имя слота = ключ); незаданный слот - ключа нет
+SLOT_FIELDS = ('id', 'username', 'first_name', 'last_name', 'joined_at',
+               'photo_url', 'phone', 'internal_id', 'synced_hash')
+# Поля-флаги: по два бита в _flags (0 - нет ключа, 1 - None, 2 - True, 3 - False;
+# для profile_link 2 - ссылка из username)
+FLAG_FIELDS = ('is_active', 'profile_link', 'sync_pending')
+
+_SLOTS = frozenset(SLOT_FIELDS)
+_FLAG_SHIFT = {name: 2 * i for i, name in enumerate(FLAG_FIELDS)}
+_INTERNED = frozenset(('first_name', 'last_name'))
+_BOOL_CODES = {_ABSENT: 0, None: 1, True: 2, False: 3}
+_get_slots = operator.attrgetter(*SLOT_FIELDS)
+
+
+def _consume(iterator):
+    collections.deque(iterator, maxlen=0)
+
+
+# Кодировщики возвращают _ABSENT, если значение не восстановится точно
+# (такие значения хранятся в extra как есть)
+def _encode_time(value: Any) -> Any:
+    """'2024-01-01T12:00:00.123456' -> микросекунды от 1970"""
+    if type(value) is not str:
+        return _ABSENT
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return _ABSENT
+    if moment.tzinfo is not None:
+        return _ABSENT
+    micros = (moment - _EPOCH) // _MICROSECOND
+    return micros if _decode_time(micros) == value else _ABSENT
+
+
+def _decode_time(value: int) -> str:
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def _encode_hash(value: Any) -> Any:
+    """hex-строка sha1 (строчными) -> 20 байт"""
+    if type(value) is not str or len(value) != 40:
+        return _ABSENT
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return _ABSENT
+    return raw if raw.hex() == value else _ABSENT
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if type(value) is str else value
+
+
+def _profile_link(username: Any) -> Optional[str]:
+    return f"https://t.me/{username}" if username and type(username) is str else None
+
+
+def _link_code(link: Any, username: Any) -> int:
+    if link is _ABSENT:
+        return 0
+    if link is None:
+        return 1
+    derived = _profile_link(username)
+    return 2 if derived is not None and link == derived else 0
+
+
+_ENCODERS = {'joined_at': _encode_time, 'synced_hash': _encode_hash}
+_DECODERS = {'joined_at': _decode_time, 'synced_hash': bytes.hex}
+
+
+class UserRecord(MutableMapping):
+    """Запись пользователя с доступом как к словарю"""
+
+    __slots__ = SLOT_FIELDS + ('_flags', '_extra')
+
+    def __init__(self, data=(), **kwargs):
+        self._flags = 0
+        self._extra: Optional[Dict[str, Any]] = None
+        self.update(data, **kwargs)
+
+    @classmethod
+    def from_dicts(cls, users: List[Dict[str, Any]]) -> List['UserRecord']:
+        """Записи для всей базы сразу (загрузка при запуске)
+
+        Работа идёт по столбцам, как в snapshot.py: значения поля достаются
+        и раскладываются по слотам через map(), без цикла Python по ключам
+        каждой записи. Редкие значения (не кодируемые, незнакомые ключи)
+        проходят обычный __setitem__.
+        """
+        count = len(users)
+        records = list(map(cls.__new__, itertools.repeat(cls, count)))
+        _consume(map(UserRecord._extra.__set__, records, itertools.repeat(None)))
+        rest = []
+
+        usernames = None
+        for key in SLOT_FIELDS:
+            column = list(map(dict.get, users, itertools.repeat(key), itertools.repeat(_ABSENT)))
+            if key == 'username':
+                usernames = column
+            if key in _ENCODERS:
+                values = list(map(_ENCODERS[key], column))
+            elif key in _INTERNED:
+                values = list(map(_intern, column))
+            else:
+                values = column
+            setter = getattr(UserRecord, key).__set__
+            if _ABSENT in values:
+                for record, value, raw in zip(records, values, column):
+                    if value is not _ABSENT:
+                        setter(record, value)
+                    elif raw is not _ABSENT:
+                        rest.append((record, key, raw))
+            else:
+                _consume(map(setter, records, values))
+
+        flags = [0] * count
+        for key, shift in _FLAG_SHIFT.items():
+            column = list(map(dict.get, users, itertools.repeat(key), itertools.repeat(_ABSENT)))
+            if key == 'profile_link':
+                codes = list(map(_link_code, column, usernames))
+            elif set(map(type, column)) <= {bool, type(None), object}:
+                codes = list(map(_BOOL_CODES.__getitem__, column))
+            else:
+                codes = [0] * count
+            if 0 in codes:
+                rest.extend(
+                    (record, key, value) for record, value, code in zip(records, column, codes)
+                    if not code and value is not _ABSENT
+                )
+            flags = list(map(operator.or_, flags, map(operator.lshift, codes, itertools.repeat(shift))))
+        _consume(map(UserRecord._flags.__set__, records, flags))
+
+        known = _SLOTS.union(_FLAG_SHIFT)
+        for key in dict.fromkeys(itertools.chain.from_iterable(users)):
+            if key not in known:
+                rest.extend((record, key, user[key]) for record, user in zip(records, users) if key in user)
+
+        for record, key, value in rest:
+            record[key] = value
+        return records
+
+    # --- поля-флаги -------------------------------------------------------
+
+    def _flag_code(self, key: str, value: Any) -> int:
+        """Код значения поля-флага (0 - не выражается кодом, хранится в extra)"""
+        if key == 'profile_link':
+            return _link_code(value, getattr(self, 'username', None))
+        if value is None or type(value) is bool:
+            return _BOOL_CODES[value]
+        return 0
+
+    def _flag_value(self, key: str, code: int) -> Any:
+        if code == 1:
+            return None
+        if key == 'profile_link':
+            return _profile_link(getattr(self, 'username', None))
+        return code == 2
+
+    def _set_extra(self, key: str, value: Any):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def _drop_extra(self, key: str) -> bool:
+        extra = self._extra
+        if extra is None or key not in extra:
+            return False
+        del extra[key]
+        if not extra:
+            self._extra = None
+        return True
+
+    def _clear_slot(self, key: str) -> bool:
+        try:
+            object.__delattr__(self, key)
+        except AttributeError:
+            return False
+        return True
+
+    # --- MutableMapping ---------------------------------------------------
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _SLOTS:
+            value = getattr(self, key, _ABSENT)
+            if value is not _ABSENT:
+                decode = _DECODERS.get(key)
+                return decode(value) if decode else value
+        else:
+            shift = _FLAG_SHIFT.get(key)
+            if shift is not None:
+                code = (self._flags >> shift) & 3
+                if code:
+                    return self._flag_value(key, code)
+
+        extra = self._extra
+        if extra is not None and key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in _SLOTS:
+            # Смена username не должна менять уже сохранённую profile_link
+            link = self.get('profile_link', _ABSENT) if key == 'username' else _ABSENT
+            if key in _ENCODERS:
+                encoded = _ENCODERS[key](value)
+            elif key in _INTERNED:
+                encoded = _intern(value)
+            else:
+                encoded = value
+            if encoded is _ABSENT:
+                self._clear_slot(key)
+                self._set_extra(key, value)
+            else:
+                object.__setattr__(self, key, encoded)
+                self._drop_extra(key)
+            if link is not _ABSENT:
+                self['profile_link'] = link
+            return
+
+        shift = _FLAG_SHIFT.get(key)
+        if shift is not None:
+            code = self._flag_code(key, value)
+            self._flags = (self._flags & ~(3 << shift)) | (code << shift)
+            if code:
+                self._drop_extra(key)
+                return
+        self._set_extra(key, value)
+
+    def __delitem__(self, key: str):
+        if key in _SLOTS:
+            link = self.get('profile_link', _ABSENT) if key == 'username' else _ABSENT
+            if not (self._clear_slot(key) or self._drop_extra(key)):
+                raise KeyError(key)
+            if link is not _ABSENT:
+                self['profile_link'] = link
+            return
+
+        shift = _FLAG_SHIFT.get(key)
+        if shift is not None and (self._flags >> shift) & 3:
+            self._flags &= ~(3 << shift)
+            return
+        if not self._drop_extra(key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        if key in _SLOTS and hasattr(self, key):
+            return True
+        shift = _FLAG_SHIFT.get(key)
+        if shift is not None and (self._flags >> shift) & 3:
+            return True
+        return self._extra is not None and key in self._extra
+
+    # Обход и представления - через копию: запись собирается один раз
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.copy())
+
+    def __len__(self) -> int:
+        return len(self.copy())
+
+    def keys(self):
+        return self.copy().keys()
+
+    def items(self):
+        return self.copy().items()
+
+    def values(self):
+        return self.copy().values()
+
+    def copy(self) -> Dict[str, Any]:
+        """Обычный словарь с теми же ключами и значениями"""
+        try:
+            data = dict(zip(SLOT_FIELDS, _get_slots(self)))
+        except AttributeError:
+            data = {key: getattr(self, key) for key in SLOT_FIELDS if hasattr(self, key)}
+        if 'joined_at' in data:
+            data['joined_at'] = _decode_time(data['joined_at'])
+        if 'synced_hash' in data:
+            data['synced_hash'] = data['synced_hash'].hex()
+
+        flags = self._flags
+        if flags:
+            for key, shift in _FLAG_SHIFT.items():
+                code = (flags >> shift) & 3
+                if code:
+                    data[key] = self._flag_value(key, code)
+        if self._extra is not None:
+            data.update(self._extra)
+        return data
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.copy()!r})"
+
+    def __reduce__(self):
+        return self.__class__, (self.copy(),)
+
+
+def memory_report(load: Callable[[], List[Dict[str, Any]]]) -> Dict[str, float]:
+    """Байт на пользователя: словари после загрузки и те же данные в UserRecord
+
+    load() загружает пользователей заново (как при запуске бота); память
+    считается через tracemalloc, в неё входят и строки значений. Время
+    преобразования замеряется отдельно, без tracemalloc.
+    """
+    import gc
+    import time
+    import tracemalloc
+
+    users = load()
+    started = time.perf_counter()
+    UserRecord.from_dicts(users)
+    convert = time.perf_counter() - started
+    del users
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        users = load()
+        count = len(users)
+        as_dicts = tracemalloc.get_traced_memory()[0]
+        records = UserRecord.from_dicts(users)
+        del users
+        gc.collect()
+        as_records = tracemalloc.get_traced_memory()[0]
+        del records
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'users': count,
+        'dict_bytes': as_dicts / max(count, 1),
+        'record_bytes': as_records / max(count, 1),
+        'convert_seconds': convert,
+    }
+
+
+if __name__ == '__main__':
+    import os
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Расход памяти на пользователя: dict и UserRecord')
+    parser.add_argument('--data-dir', help='Каталог данных бота (по умолчанию - синтетические пользователи)')
+    parser.add_argument('--users', type=int, default=100_000, help='Число синтетических пользователей')
+    args = parser.parse_args()
+
+    if args.data_dir:
+        from database import latest_snapshot, read_users_snapshot
+
+        path = latest_snapshot(args.data_dir)
+        if not path:
+            print(f"❌ В {args.data_dir} нет снимка пользователей")
+            sys.exit(1)
+        source = path
+        load = lambda: read_users_snapshot(path)
+    else:
+        from snapshot import _synthetic_users
+
+        # Через JSON-текст: строки значений - отдельные объекты, как после загрузки файла
+        text = json.dumps(_synthetic_users(args.users))
+        source = f"{args.users} синтетических"
+        load = lambda: json.loads(text)
+
+    report = memory_report(load)
+    saved = 1 - report['record_bytes'] / report['dict_bytes'] if report['dict_bytes'] else 0
+    print(f"📊 Пользователи: {report['users']} ({source})")
+    print(f"   dict:       {report['dict_bytes']:>8.0f} байт/польз.")
+    print(f"   UserRecord: {report['record_bytes']:>8.0f} байт/польз. (-{saved:.0%})")
+    print(f"   Преобразование: {report['convert_seconds']:.2f} с")
+    if report['users']:
+        million = 1_000_000 / 2 ** 20
+        print(f"   На 1 млн: {report['dict_bytes'] * million:.0f} МБ -> {report['record_bytes'] * million:.0f} МБ")
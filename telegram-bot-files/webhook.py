@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - приём обновлений Telegram через webhook
+
+Встроенный HTTP-сервер на aiohttp: проверяет секретный токен
+(X-Telegram-Bot-Api-Secret-Token), кладёт обновление в очередь
+Application и сразу отвечает 200, не дожидаясь обработчиков.
+
+Проверка без Telegram - отправка записанных обновлений на локальный адрес:
+    python3 webhook.py replay updates.json --url http://127.0.0.1:8443/telegram --secret SECRET
+"""
+
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """HTTP-приёмник обновлений для одного или нескольких Application
+
+    Каждый путь обслуживается своим обработчиком (path -> handler(data)):
+    приложение (add_application) или функция, получающая обновление
+    словарём без разбора (add_handler, например dispatcher.py).
+    """
+
+    def __init__(self, listen: str = '0.0.0.0', port: int = 8443, secret_token: Optional[str] = None):
+        self.listen = listen
+        self.port = port
+        self.secret_token = secret_token
+        self.routes: Dict[str, Callable[[dict], None]] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_handler(self, path: str, handler: Callable[[dict], None]):
+        """Регистрация обработчика обновлений-словарей по пути"""
+        self.routes[path] = handler
+
+    def add_application(self, path: str, application):
+        """Регистрация приложения по пути"""
+        def deliver(data: dict):
+            application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+        self.add_handler(path, deliver)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Приём одного обновления"""
+        handler = self.routes.get(request.path)
+        if handler is None:
+            return web.Response(status=404)
+
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ''), self.secret_token
+        ):
+            logger.warning(f"⚠️ Webhook: неверный секретный токен от {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        # Подтверждаем сразу, обработка идёт из очереди Application (или воркера)
+        try:
+            handler(data)
+        except Exception as e:
+            logger.warning(f"⚠️ Webhook: некорректное обновление: {e}")
+            return web.Response(status=400)
+        return web.Response(text='OK')
+
+    async def start(self):
+        app = web.Application()
+        for path in self.routes:
+            app.router.add_post(path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"🕸️ Webhook слушает {self.listen}:{self.port} ({', '.join(self.routes)})")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def start_application(application):
+    """Запуск Application без updater (как это делает run_polling)"""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+
+async def stop_application(application):
+    """Остановка Application с вызовом post_stop/post_shutdown"""
+    if application.running:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+async def wait_for_stop_signal():
+    """Ожидание SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop.set))
+    await stop.wait()
+
+
+async def serve_webhook(application, webhook_url: Optional[str] = None, path: str = '/telegram',
+                        listen: str = '0.0.0.0', port: int = 8443, secret_token: Optional[str] = None,
+                        allowed_updates: Optional[List[str]] = None, drop_pending_updates: bool = True):
+    """Работа бота в режиме webhook до сигнала остановки
+
+    Если webhook_url не задан, setWebhook не вызывается - удобно для
+    локальной проверки отправкой записанных обновлений.
+    """
+    server = WebhookServer(listen=listen, port=port, secret_token=secret_token)
+    server.add_application(path, application)
+
+    await start_application(application)
+    try:
+        await server.start()
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=f"{webhook_url.rstrip('/')}{path}",
+                secret_token=secret_token,
+                allowed_updates=allowed_updates,
+                drop_pending_updates=drop_pending_updates
+            )
+            logger.info(f"🔗 Webhook установлен: {webhook_url.rstrip('/')}{path}")
+        await wait_for_stop_signal()
+    finally:
+        await server.stop()
+        await stop_application(application)
+
+
+def webhook_settings_from_env() -> dict:
+    """Настройки webhook из переменных окружения"""
+    return {
+        'webhook_url': os.getenv('WEBHOOK_URL') or None,
+        'path': os.getenv('WEBHOOK_PATH', '/telegram'),
+        'listen': os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+        'port': int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', '8443'))),
+        'secret_token': os.getenv('WEBHOOK_SECRET') or None,
+    }
+
+
+async def replay(updates_file: str, url: str, secret: Optional[str] = None, delay: float = 0.0):
+    """Отправка записанных обновлений (JSON-массив или по одному в строке) на webhook"""
+    import aiohttp
+
+    with open(updates_file, 'r') as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        updates = json.loads(text)
+    else:
+        updates = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    headers = {SECRET_HEADER: secret} if secret else {}
+    async with aiohttp.ClientSession() as session:
+        for update in updates:
+            async with session.post(url, json=update, headers=headers) as response:
+                print(f"{update.get('update_id')}: HTTP {response.status}")
+            if delay:
+                await asyncio.sleep(delay)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Инструменты webhook')
+    sub = parser.add_subparsers(dest='command', required=True)
+    replay_parser = sub.add_parser('replay', help='Отправить записанные обновления на локальный webhook')
+    replay_parser.add_argument('updates_file')
+    replay_parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    replay_parser.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET'))
+    replay_parser.add_argument('--delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        asyncio.run(replay(args.updates_file, args.url, args.secret, args.delay))
@@ -0,0 +1,642 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SavosBot Club - подключение бота к сайту
+
+Асинхронный клиент на aiohttp с одним долгоживущим пулом соединений
+(keep-alive), который открывается и закрывается вместе с Application,
+фоновый обработчик очереди отправки пользователей на сайт и движок
+массовой синхронизации (общий для бота и sync_users_to_website.py).
+
+Запросы к API сайта идут через автомат защиты (CircuitBreaker): после
+серии ошибок запросы сразу отклоняются, пока HealthMonitor не убедится,
+что сайт снова отвечает.
+"""
+
+import time
+import socket
+import random
+import asyncio
+import logging
+from typing import Dict, Any, Optional, List, Tuple, Iterable, AsyncIterable, Callable, Union
+
+import aiohttp
+
+from metrics import REGISTRY, SYNC_USERS, SYNC_USERS_PER_SECOND, WEBSITE_REQUEST_SECONDS, WEBSITE_RESPONSES
+from logging_setup import hot, kv
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Запрос отклонён: сайт считается недоступным"""
+
+
+class CircuitBreaker:
+    """Автомат защиты для запросов к сайту
+
+    closed    - запросы идут как обычно, ошибки подряд считаются;
+    open      - после failure_threshold ошибок подряд запросы сразу
+                отклоняются в течение reset_timeout;
+    half_open - пропускается одна пробная операция: успех закрывает
+                автомат, ошибка снова открывает.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._listeners: List[Callable[[str, str], None]] = []
+
+    def on_change(self, callback: Callable[[str, str], None]):
+        """Подписка на смену состояния: callback(старое, новое)"""
+        self._listeners.append(callback)
+
+    def _set_state(self, state: str):
+        old, self.state = self.state, state
+        if old == state:
+            return
+        for callback in self._listeners:
+            try:
+                callback(old, state)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика смены состояния сайта: {e}")
+
+    def retry_in(self) -> float:
+        """Секунд до пробного запроса (0 - можно сейчас)"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос (в half_open - только один пробный)"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if self.retry_in() > 0:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self._trial:
+            return False
+        self._trial = True
+        return True
+
+    def release(self):
+        """Пробный запрос не завершился (отменён) - разрешаем следующий"""
+        self._trial = False
+
+    def record_success(self):
+        self.failures = 0
+        self._trial = False
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self._trial = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.failures >= self.failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+class WebsiteConnection:
+    """Подключение к сайту"""
+
+    def __init__(self, website_url: str, api_key: str, timeout: float = 10,
+                 pool_size: int = 20, keepalive_timeout: float = 60,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.website_url = website_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.connected = False
+
+        self.breaker = breaker or CircuitBreaker()
+        self.breaker.on_change(self._on_breaker_change)
+        REGISTRY.gauge(
+            'savosbot_website_circuit_open', 'Автомат защиты сайта: 0 - закрыт, 1 - пробный запрос, 2 - открыт',
+            func=lambda: {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1}.get(self.breaker.state, 2)
+        )
+
+    def _on_breaker_change(self, old: str, new: str):
+        if new == CircuitBreaker.OPEN:
+            self.connected = False
+            logger.warning(
+                f"🔌 Сайт недоступен ({self.breaker.failures} ошибок подряд), запросы приостановлены "
+                f"на {self.breaker.reset_timeout:.0f} с"
+            )
+        elif new == CircuitBreaker.CLOSED:
+            self.connected = True
+            logger.info("🔌 Сайт снова доступен")
+
+    async def start(self):
+        """Открытие пула соединений (вызывается из post_init)"""
+        if self.session and not self.session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+            family=socket.AF_INET  # IPv4, как и для клиента Telegram
+        )
+        # trust_env=False - переменные прокси окружения не используются
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            trust_env=False,
+            headers={'Authorization': f'Bearer {self.api_key}'}
+        )
+
+    async def close(self):
+        """Закрытие пула соединений (вызывается из post_shutdown)"""
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def check_connection(self) -> Dict[str, Any]:
+        """Проверка подключения"""
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.session.get(
+                f"{self.website_url}/api/health",
+                timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                status = response.status
+                if response.status == 200:
+                    self.connected = True
+                    return await response.json()
+                self.connected = False
+                return {'status': 'error', 'message': f'HTTP {response.status}'}
+        except Exception as e:
+            self.connected = False
+            return {'status': 'error', 'message': str(e)}
+        finally:
+            WEBSITE_REQUEST_SECONDS.observe(time.perf_counter() - started, path='/api/health')
+            WEBSITE_RESPONSES.inc(path='/api/health', status=status)
+
+    async def post_json(self, path: str, payload: Any) -> Tuple[int, Any]:
+        """POST на сайт через общий пул; возвращает (HTTP статус, JSON ответа)
+
+        При открытом автомате защиты сразу выбрасывает CircuitOpenError.
+        Сетевые ошибки и ответы 5xx считаются отказами сайта.
+        """
+        if not self.breaker.allow():
+            WEBSITE_RESPONSES.inc(path=path, status='circuit_open')
+            raise CircuitOpenError(f"сайт недоступен, повтор через {self.breaker.retry_in():.0f} с")
+
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.session.post(f"{self.website_url}{path}", json=payload) as response:
+                status = response.status
+                try:
+                    data = await response.json(content_type=None)
+                except ValueError:
+                    data = None
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            WEBSITE_REQUEST_SECONDS.observe(time.perf_counter() - started, path=path)
+            WEBSITE_RESPONSES.inc(path=path, status=status)
+
+        if status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return status, data
+
+    async def send_user(self, user_data: Dict[str, Any], source: str = 'telegram_bot') -> str:
+        """Отправка пользователя на сайт
+
+        Возвращает итог доставки (он же метка result в метриках):
+        'ok'       - сайт принял (2xx, тело ответа не важно);
+        'rejected' - сайт отклонил данные (4xx кроме 408 и 429), повтор не поможет;
+        'retry'    - сеть, 5xx, 408/429 или открытый автомат защиты.
+        """
+        try:
+            status, _ = await self.post_json('/api/users', {**user_data, 'source': source})
+        except CircuitOpenError as e:
+            logger.debug(f"Отправка пользователя {user_data.get('id')} отложена: {e}")
+            return 'retry'
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка подключения к сайту: {e}")
+            # Пользователь остаётся в очереди отправки и будет отправлен повторно
+            return 'retry'
+
+        if 200 <= status < 300:
+            logger.info("✅ Пользователь отправлен на сайт", extra=hot(user_id=user_data['id']))
+            return 'ok'
+        if 400 <= status < 500 and status not in (408, 429):
+            logger.warning("⚠️ Сайт отклонил пользователя", extra=kv(user_id=user_data.get('id'), status=status))
+            return 'rejected'
+        logger.warning("⚠️ Ошибка отправки", extra=kv(user_id=user_data.get('id'), status=status))
+        return 'retry'
+
+
+class HealthMonitor:
+    """Периодическая проверка сайта (/api/health)
+
+    Обновляет WebsiteConnection.connected и управляет автоматом защиты:
+    пока он открыт, пробная проверка выполняется по истечении reset_timeout,
+    и при успехе автомат закрывается - подписчики on_change узнают о
+    восстановлении сайта.
+    """
+
+    def __init__(self, website: WebsiteConnection, interval: float = 30.0):
+        self.website = website
+        self.interval = interval
+        self.checks = 0
+        self._task: Optional[asyncio.Task] = None
+        self._first_check = asyncio.Event()
+
+    def start(self):
+        """Запуск фоновой проверки (из post_init)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name='website-health')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def wait_first_check(self):
+        """Ожидание результата первой проверки"""
+        await self._first_check.wait()
+
+    async def check(self) -> Optional[Dict[str, Any]]:
+        """Одна проверка через автомат защиты (None - проверка не положена)"""
+        breaker = self.website.breaker
+        if not breaker.allow():
+            return None
+        try:
+            result = await self.website.check_connection()
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        if self.website.connected:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        self.checks += 1
+        self._first_check.set()
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                result = await self.check()
+                if result is not None and not self.website.connected:
+                    logger.warning(f"⚠️ Проверка сайта: {result.get('message')}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка проверки сайта: {e}")
+            self._first_check.set()
+            # Пока сайт недоступен, следующая проверка - сразу по окончании паузы автомата
+            breaker = self.website.breaker
+            delay = self.interval
+            if breaker.state == CircuitBreaker.OPEN:
+                delay = min(self.interval, breaker.retry_in() + 0.05)
+            await asyncio.sleep(delay)
+
+
+class OutboxWorker:
+    """Фоновая отправка пользователей из очереди на сайт
+
+    Очередь хранится в базе (DatabaseManager) и переживает перезапуск.
+    Повторные изменения одного пользователя схлопываются в одну запись
+    очереди, а отправляется всегда последняя версия. После неудачи
+    пользователь откладывается с экспоненциальной задержкой и разбросом;
+    данные, которые сайт отклонил (4xx), снимаются с очереди без повторов.
+    """
+
+    def __init__(self, db, website: WebsiteConnection, concurrency: int = 4,
+                 base_delay: float = 1.0, max_delay: float = 300.0, idle_interval: float = 30.0):
+        self.db = db
+        self.website = website
+        self.concurrency = concurrency
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_interval = idle_interval
+
+        self._attempts: Dict[int, int] = {}
+        self._next_attempt: Dict[int, float] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """Размер очереди"""
+        return self.db.outbox_depth()
+
+    def start(self):
+        """Запуск фоновой задачи (из post_init)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name='outbox-worker')
+
+    async def stop(self):
+        """Остановка фоновой задачи (из post_shutdown)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """Сигнал о новых записях в очереди"""
+        self._wake.set()
+
+    def resume(self):
+        """Сайт снова доступен: отправить всё отложенное сразу, без ожидания пауз"""
+        self._attempts.clear()
+        self._next_attempt.clear()
+        self.notify()
+
+    def _backoff(self, user_id: int) -> float:
+        attempts = self._attempts.get(user_id, 0) + 1
+        self._attempts[user_id] = attempts
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _defer(self, user_id: int):
+        """Следующая попытка для пользователя - после паузы"""
+        delay = self._backoff(user_id)
+        self._next_attempt[user_id] = time.monotonic() + delay
+        logger.info("⏳ Повторная отправка", extra=hot(user_id=user_id, delay=round(delay, 1)))
+
+    async def _run(self):
+        logger.info(f"📮 Очередь отправки на сайт: {self.depth} в ожидании")
+        while True:
+            try:
+                wait = await self.drain()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки очереди: {e}")
+                wait = self.idle_interval
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self) -> float:
+        """Отправка всех готовых записей; возвращает паузу до следующей попытки"""
+        while True:
+            if self.website.breaker.state == CircuitBreaker.OPEN:
+                # Сайт недоступен: ждём восстановления (resume) вместо попыток
+                return self.idle_interval
+
+            pending = await self.db.run(self.db.pending_sync, 1000)
+            now = time.monotonic()
+            due = [uid for uid in pending if self._next_attempt.get(uid, 0) <= now]
+
+            if not due:
+                waits = [self._next_attempt[uid] - now for uid in pending if uid in self._next_attempt]
+                return max(0.1, min(waits)) if waits else self.idle_interval
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def push(user_id: int):
+                async with semaphore:
+                    try:
+                        await self._push(user_id)
+                    except Exception as e:
+                        # Сбой базы с одним пользователем не прерывает остальных
+                        logger.error(f"❌ Ошибка отправки из очереди: {e}", extra=hot(user_id=user_id))
+                        self._defer(user_id)
+
+            await asyncio.gather(*(push(uid) for uid in due[:self.concurrency * 8]), return_exceptions=True)
+
+    async def _push(self, user_id: int):
+        payload = await self.db.run(self.db.get_sync_payload, user_id)
+        if payload is None:
+            await self.db.run(self.db.discard_pending, user_id)
+            return
+
+        result = await self.website.send_user(payload)
+        SYNC_USERS.inc(via='outbox', result=result)
+        if result == 'retry':
+            self._defer(user_id)
+            return
+
+        if result == 'rejected':
+            # Повторы не помогут: запись уходит из очереди, но остаётся
+            # неотправленной для /sync и вернётся в очередь при изменении
+            done = await self.db.run(self.db.reject_pending, payload)
+        else:
+            done = await self.db.run(self.db.mark_synced, user_id, payload)
+        # Пауза сбрасывается только после записи отметки: при сбое базы
+        # пользователь откладывается (push), а не отправляется сразу снова
+        self._attempts.pop(user_id, None)
+        self._next_attempt.pop(user_id, None)
+        if not done:
+            # Запись изменилась во время отправки - уйдёт ещё раз
+            self.notify()
+
+
+class SyncReport:
+    """Итоги массовой синхронизации"""
+
+    def __init__(self):
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.requests = 0
+        self.retries = 0
+        self.failed_ids: List[Any] = []
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def processed(self) -> int:
+        """Отправлено или окончательно не отправлено"""
+        return self.succeeded + self.failed
+
+    @property
+    def rate(self) -> float:
+        """Пользователей в секунду"""
+        elapsed = self.elapsed or (time.monotonic() - self.started)
+        return self.total / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"✅ Успешно: {self.succeeded}, ❌ Ошибок: {self.failed} из {self.total} "
+            f"за {self.elapsed:.1f} с ({self.rate:.1f} польз/с, "
+            f"запросов: {self.requests}, повторов: {self.retries})"
+        )
+
+
+class BulkSyncer:
+    """Массовая отправка пользователей на сайт
+
+    Ограниченное число одновременных запросов через общий пул соединений
+    WebsiteConnection, повторы каждого запроса с экспоненциальной паузой и
+    (при batch_size > 1) пакетная отправка в /api/sync-bot-users. Если сайт
+    не поддерживает пакетный endpoint, отправка переключается на /api/users
+    по одному пользователю.
+    """
+
+    BATCH_PATH = '/api/sync-bot-users'
+    SINGLE_PATH = '/api/users'
+
+    def __init__(self, website: WebsiteConnection, concurrency: int = 8, batch_size: int = 1,
+                 retries: int = 3, retry_delay: float = 0.5, source: str = 'telegram_bot_sync',
+                 ack_batch: int = 500):
+        self.website = website
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.source = source
+        self.ack_batch = ack_batch
+        self.batch_supported = self.batch_size > 1
+
+    async def sync(self, users: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+                   on_synced: Optional[Callable[[List[Dict[str, Any]]], Any]] = None,
+                   report: Optional[SyncReport] = None) -> SyncReport:
+        """Отправка всех пользователей
+
+        on_synced получает успешно отправленных пачками до ack_batch
+        (для записи отметок синхронизации одной операцией). Переданный
+        report заполняется по ходу отправки - по нему можно следить за
+        прогрессом из другой задачи.
+        """
+        report = report or SyncReport()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        synced: List[Dict[str, Any]] = []
+
+        async def flush():
+            if on_synced and synced:
+                batch = synced[:]
+                synced.clear()
+                result = on_synced(batch)
+                if asyncio.iscoroutine(result):
+                    await result
+
+        async def worker():
+            while True:
+                chunk = await queue.get()
+                try:
+                    if chunk is None:
+                        return
+                    sent = await self._send_chunk(chunk, report)
+                    if on_synced:
+                        synced.extend(sent)
+                    if len(synced) >= self.ack_batch:
+                        await flush()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка синхронизации пакета: {e}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            chunk: List[Dict[str, Any]] = []
+            async for user in _aiter(users):
+                report.total += 1
+                chunk.append(user)
+                if len(chunk) >= self.batch_size:
+                    await queue.put(chunk)
+                    chunk = []
+            if chunk:
+                await queue.put(chunk)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            await flush()
+        finally:
+            for task in workers:
+                task.cancel()
+
+        report.elapsed = time.monotonic() - report.started
+        SYNC_USERS.inc(report.succeeded, via='bulk', result='ok')
+        SYNC_USERS.inc(report.failed, via='bulk', result='failed')
+        if report.total:
+            SYNC_USERS_PER_SECOND.set(round(report.rate, 1))
+        return report
+
+    async def _send_chunk(self, chunk: List[Dict[str, Any]], report: SyncReport) -> List[Dict[str, Any]]:
+        """Отправка пакета; возвращает успешно отправленных"""
+        if self.batch_supported and len(chunk) > 1:
+            status, data = await self._post_with_retries(
+                self.BATCH_PATH,
+                {'users': [{**u, 'source': self.source} for u in chunk]},
+                report
+            )
+            if status in (404, 405):
+                if self.batch_supported:
+                    logger.warning("⚠️ Сайт не поддерживает пакетную синхронизацию, отправка по одному")
+                self.batch_supported = False
+            elif status == 200 and isinstance(data, dict) and not data.get('errors'):
+                report.succeeded += len(chunk)
+                return chunk
+            else:
+                # Пакет целиком не подтверждён - досылаем по одному
+                logger.warning(f"⚠️ Пакет из {len(chunk)} пользователей не подтверждён (HTTP {status})")
+
+        ok = []
+        for user in chunk:
+            status, _ = await self._post_with_retries(self.SINGLE_PATH, {**user, 'source': self.source}, report)
+            if status is not None and 200 <= status < 300:
+                report.succeeded += 1
+                ok.append(user)
+            else:
+                report.failed += 1
+                if len(report.failed_ids) < 100:
+                    report.failed_ids.append(user.get('id'))
+                # При открытом автомате защиты итог виден в сводке, без строки на каждого
+                if self.website.breaker.state != CircuitBreaker.OPEN:
+                    logger.warning(f"⚠️ Ошибка синхронизации пользователя {user.get('id')}: {status}")
+        return ok
+
+    async def _post_with_retries(self, path: str, payload: Any, report: SyncReport) -> Tuple[Optional[int], Any]:
+        """POST с повторами при сетевых ошибках, 429 и 5xx"""
+        status, data = None, None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                report.retries += 1
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            report.requests += 1
+            try:
+                status, data = await self.website.post_json(path, payload)
+            except CircuitOpenError:
+                # Сайт недоступен: повторы бессмысленны до закрытия автомата
+                return None, None
+            except Exception as e:
+                logger.debug(f"Ошибка запроса {path}: {e}")
+                status, data = None, None
+                continue
+            if status != 429 and status < 500:
+                break
+        return status, data
+
+
+async def _aiter(items):
+    """Единый асинхронный обход обычных и асинхронных итераторов"""
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item